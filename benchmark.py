@@ -0,0 +1,304 @@
+"""
+Benchmarks of the hot paths of the simulator.
+
+Every benchmark runs a fixed amount of work a few times and keeps the best
+time, so that results are comparable between runs and versions. Results
+are written as JSON, and a previous result file can be given to report
+regressions:
+
+    python benchmark.py --output new.json
+    python benchmark.py --quick --compare new.json
+
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from components import *
+from protocols import *
+from tools import *
+from statistics import *
+
+
+###############################################################################
+#
+# Workload
+#
+###############################################################################
+@remote_class("coord")
+class BenchCoordinator(Sender):
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.received = 0
+
+    def update(self, msg):
+        self.received += 1
+
+
+@remote_class("site")
+class BenchSite(Sender):
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.received = 0
+
+    def notify(self, msg):
+        self.received += 1
+
+
+def build_network(k):
+    """
+    Builds a star network with k sites.
+
+    :param k: the number of sites
+    :return: the network
+    """
+    net = StarNetwork(k, site_type=BenchSite, coord_type=BenchCoordinator)
+    net.add_interface("coord", {"update": True})
+    net.add_interface("site", {"notify": True})
+    net.add_sites(k, "coord")
+    net.add_coord("site")
+    net.setup_connections()
+    return net
+
+
+def nested_payload(width):
+    """
+    :param width: the number of entries of the payload
+    :return: a payload of tuples, lists and dicts
+    """
+    return {i: (i, float(i), "key", [i, i + 1, i + 2]) for i in range(width)}
+
+
+###############################################################################
+#
+# Benchmarks
+#
+###############################################################################
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    A decorator that registers a benchmark.
+
+    The benchmark is a function of (sizes, ops) that yields tuples
+    (k, ops, func): `func` performs `ops` operations on a problem of size k.
+
+    :param name: the name of the benchmark
+    :return: the decorator
+    """
+
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+
+    return decorator
+
+
+@benchmark("unicast_send")
+def bench_unicast(sizes, ops):
+    net = build_network(10)
+    sites = list(net.sites.values())
+
+    def run():
+        for i in range(ops):
+            sites[i % 10].send("update", i)
+
+    yield 10, ops, run
+
+
+@benchmark("multicast_send")
+def bench_multicast(sizes, ops):
+    for k in sizes:
+        net = build_network(k)
+        # about the same number of deliveries for every k
+        broadcasts = max(1, ops // k)
+
+        def run(net=net, broadcasts=broadcasts):
+            for i in range(broadcasts):
+                net.coord.send("notify", i)
+
+        yield k, broadcasts, run
+
+
+@benchmark("msg_size_nested")
+def bench_msg_size(sizes, ops):
+    for width in (10, 100, 1000):
+        payload = nested_payload(width)
+        repeat = max(1, ops // width)
+
+        def run(payload=payload, repeat=repeat):
+            for _ in range(repeat):
+                msg_size(payload)
+
+        yield width, repeat, run
+
+
+@benchmark("network_construction")
+def bench_construction(sizes, ops):
+    for k in sizes:
+        def run(k=k):
+            build_network(k)
+
+        yield k, 1, run
+
+
+@benchmark("statistics_queries")
+def bench_statistics(sizes, ops):
+    for k in sizes:
+        net = build_network(k)
+        for site in net.sites.values():
+            site.send("update", 1)
+
+        def run(net=net, k=k):
+            for i in range(ops):
+                total_bytes(net)
+                src_bytes(net, i % k)
+                dst_msgs(net, i % k)
+                endpoint_msgs(net, "update")
+
+        yield k, ops, run
+
+
+@benchmark("counting_protocol")
+def bench_counting(sizes, ops):
+    for k in sizes:
+        pairs = [(i % k, None) for i in range(ops)]
+
+        def run(k=k, pairs=pairs):
+            net = CountingNetwork(k, eps=0.1)
+            for start in range(0, len(pairs), 4096):
+                net.feed(pairs[start:start + 4096])
+
+        yield k, ops, run
+
+
+###############################################################################
+#
+# Runner
+#
+###############################################################################
+def measure(func, repeat):
+    """
+    :param func: a function without arguments
+    :param repeat: the number of runs
+    :return: the best wall time of the runs in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(sizes, ops, repeat=3, only=None):
+    """
+    Runs the registered benchmarks.
+
+    :param sizes: the network sizes (k) to benchmark
+    :param ops: about how many operations each measurement performs
+    :param repeat: the number of runs of each measurement
+    :param only: the names of the benchmarks to run (None for all)
+    :return: a list of result dicts
+    """
+    results = []
+    for name, bench in BENCHMARKS:
+        if only and name not in only:
+            continue
+        for k, count, func in bench(sizes, ops):
+            seconds = measure(func, repeat)
+            results.append({"name": name,
+                            "k": k,
+                            "ops": count,
+                            "seconds": seconds,
+                            "ops_per_sec": count / seconds if seconds else
+                            float("inf")})
+    return results
+
+
+def report(sizes, ops, repeat, only=None):
+    """
+    Runs the benchmarks and adds information about the environment.
+
+    :return: a JSON serializable dict
+    """
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "numpy": numpy.__version__ if numpy is not None else None,
+            "sizes": list(sizes),
+            "ops": ops,
+            "repeat": repeat,
+            "results": run_benchmarks(sizes, ops, repeat, only)}
+
+
+def compare(new, old, tolerance):
+    """
+    Finds the measurements that got slower.
+
+    :param new: the new report
+    :param old: the earlier report
+    :param tolerance: the accepted slowdown, e.g. 0.2 for 20%
+    :return: a list of (name, k, old ops/sec, new ops/sec)
+    """
+    before = {(r["name"], r["k"]): r["ops_per_sec"] for r in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        key = (result["name"], result["k"])
+        if key in before and \
+                result["ops_per_sec"] < before[key] * (1 - tolerance):
+            regressions.append((*key, before[key], result["ops_per_sec"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 100, 1000, 10000, 100000],
+                        help="the numbers of sites to benchmark")
+    parser.add_argument("--ops", type=int, default=100000,
+                        help="operations per measurement")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per measurement (the best is kept)")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes for a fast check")
+    parser.add_argument("--only", nargs="+", help="benchmarks to run")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="an earlier result file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="accepted slowdown before a regression")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.sizes = [10, 100, 1000]
+        args.ops = 10000
+
+    result = report(args.sizes, args.ops, args.repeat, args.only)
+
+    for r in result["results"]:
+        print(f"{r['name']:<22} k={r['k']:<8} {r['ops_per_sec']:>14.1f} "
+              f"ops/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(result, old, args.tolerance)
+        for name, k, before, after in regressions:
+            print(f"REGRESSION {name} k={k}: {before:.1f} -> {after:.1f} "
+                  f"ops/s")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,500 @@
+"""
+Checkpoints of a running simulation.
+
+A `Checkpointer` saves the state of a network to an append-only binary
+file: the state of the hosts, the columnar state of the host groups, the
+channel counters, the pending deliveries of the dispatcher and the offsets
+of the stream sources. A simulation that is interrupted can then be
+resumed from the last complete checkpoint into a freshly built network:
+
+    checkpoint = read_checkpoint(path)
+    net = build_network()
+    checkpoint.restore(net)
+    source = CsvSource(trace, start=checkpoint.offsets["source"])
+
+Checkpoints are incremental: only the hosts that sent or received a
+message since the previous checkpoint, or that were fed an item by the
+driver, are pickled, and only those whose state changed are written.
+
+The file is a magic string followed by frames. A frame is a header with
+its kind and length followed by a (compressed) pickled payload. A
+checkpoint is a run of frames that ends with a COMMIT frame; frames after
+the last COMMIT, e.g. of a checkpoint that was interrupted, are ignored.
+
+"""
+import array
+import os
+import pickle
+import struct
+import sys
+import time
+import zlib
+
+from components import *
+
+MAGIC = b"DDSCKPT1"
+
+# the kinds of frames
+HOSTS = 1
+GROUPS = 2
+COUNTERS = 3
+EVENTS = 4
+META = 5
+COMMIT = 6
+
+FRAME = struct.Struct("<BBQ")
+
+
+###############################################################################
+#
+# Hosts
+#
+###############################################################################
+def host_keys(net):
+    """
+    Names every host of a network, so that the same host of another build
+    of the network gets the same key.
+
+    The hosts of `net.hosts` are keyed by ("host", name), the sites of a
+    star network by ("site", sid) and other hosts by ("nid", nid).
+
+    :param net: the network
+    :return: a dict {key: host}
+    """
+    hosts = {}
+    seen = set()
+
+    def add(key, host):
+        if id(host) not in seen:
+            seen.add(id(host))
+            hosts[key] = host
+
+    for name, host in net.hosts.items():
+        add(("host", name), host)
+    for sid, site in getattr(net, "sites", {}).items():
+        add(("site", sid), site)
+    for group in net.groups:
+        for member in group.members:
+            add(("nid", member.nid), member)
+    for channel in net.channels:
+        for host in (channel.src, channel.dst):
+            if not isinstance(host, HostGroup):
+                add(("nid", host.nid), host)
+    return hosts
+
+
+def host_ends(channel, keys):
+    """
+    :param channel: a channel
+    :param keys: a dict {id(host): key}
+    :return: the keys of the hosts at the ends of the channel
+    """
+    ends = []
+    for host in (channel.src, channel.dst):
+        members = host.members if isinstance(host, HostGroup) else (host,)
+        ends.extend(keys[id(member)] for member in members
+                    if id(member) in keys)
+    return ends
+
+
+def host_state(host):
+    """
+    :param host: a host
+    :return: the attributes of the host that are not set by the simulator
+    """
+    return {name: value for name, value in vars(host).items()
+            if name not in Checkpointer.EXCLUDE}
+
+
+###############################################################################
+#
+# Writer
+#
+###############################################################################
+class Checkpointer:
+    """
+    Writes checkpoints of a network.
+
+    `save` writes a checkpoint whenever it is called; `maybe_save` only
+    when `every_items` items were fed or `every_seconds` seconds passed
+    since the last one. Checkpoints should be taken between deliveries,
+    e.g. after a chunk of a `StreamDriver`, which takes them by itself when
+    it is given a checkpointer.
+
+    Host state must be picklable and must not refer to other hosts or to
+    the network. A host is saved again only if it sent or received a
+    message since the last checkpoint or was passed to `mark`; code that
+    changes hosts in other ways must mark them.
+    """
+
+    # the host attributes that the simulator sets
+    EXCLUDE = frozenset(("net", "nid", "proxy", "proxies", "send",
+                         "send_batch"))
+
+    def __init__(self, net, path, every_items=None, every_seconds=None,
+                 compress=True, batch=4096, resume=None):
+        """
+        A basic constructor.
+
+        :param net: the network to save
+        :param path: the path of the checkpoint file
+        :param every_items: the items between checkpoints of maybe_save
+        :param every_seconds: the wall time between checkpoints of
+            maybe_save
+        :param compress: if true the frames are compressed with zlib
+        :param batch: the number of hosts per frame
+        :param resume: a Checkpoint read from the same file; new
+            checkpoints are appended to it and only the hosts that changed
+            since it are written
+        """
+        self.net = net
+        self.path = path
+        self.every_items = every_items
+        self.every_seconds = every_seconds
+        self.compress = compress
+        self.batch = batch
+        self.keys = None
+        self.host_ids = None
+        # {cid: keys of the hosts at its ends}
+        self.ends = None
+        # the message counters at the last checkpoint (None to save all)
+        self.msgs = None
+        self.dirty = set()
+
+        if resume is not None:
+            self.previous = dict(resume.hosts)
+            self.groups = dict(resume.groups)
+            self.number = resume.number
+            self.items = resume.offsets.get("fed", 0)
+            # drop what an interrupted checkpoint left after the last one
+            with open(path, "r+b") as f:
+                f.truncate(resume.end)
+        else:
+            self.previous = {}
+            self.groups = {}
+            self.number = 0
+            self.items = 0
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+        self.last_time = time.monotonic()
+
+    def frame(self, f, kind, payload):
+        """
+        Writes a frame.
+
+        :param f: the file
+        :param kind: the kind of the frame
+        :param payload: a picklable object
+        :return: None
+        """
+        data = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        if self.compress:
+            data = zlib.compress(data, 1)
+        f.write(FRAME.pack(kind, self.compress, len(data)))
+        f.write(data)
+
+    def mark(self, hosts):
+        """
+        Marks hosts whose state changed outside of their handlers, e.g.
+        the sites a driver fed, so that the next checkpoint saves them.
+
+        :param hosts: an iterable of hosts
+        :return: None
+        """
+        if self.keys is None:
+            self.index()
+        keys = self.host_ids
+        self.dirty.update(keys[id(host)] for host in hosts
+                          if id(host) in keys)
+
+    def index(self):
+        """
+        Names the hosts and the ends of the channels of the network.
+
+        :return: None
+        """
+        self.keys = host_keys(self.net)
+        self.host_ids = {id(host): key for key, host in self.keys.items()}
+        self.ends = {channel.cid: host_ends(channel, self.host_ids)
+                     for channel in self.net.channels}
+
+    def touched(self):
+        """
+        :return: the keys of the hosts at the ends of the channels that
+            carried messages since the last checkpoint (all the hosts for
+            the first one)
+        """
+        msgs = self.net.counters.msgs
+        last = self.msgs
+        if numpy is not None:
+            current = numpy.array(msgs, dtype=numpy.int64)
+        else:
+            current = array.array("q", msgs)
+        self.msgs = current
+        if last is None:
+            return set(self.keys)
+
+        if numpy is not None:
+            cids = numpy.flatnonzero(current[:len(last)] != last).tolist()
+        else:
+            cids = [cid for cid, (new, old) in enumerate(zip(current, last))
+                    if new != old]
+        cids.extend(range(len(last), len(current)))
+        ends = self.ends
+        touched = set()
+        for cid in cids:
+            touched.update(ends.get(cid, ()))
+        return touched
+
+    def maybe_save(self, items, offsets=None):
+        """
+        Saves a checkpoint if the interval has passed.
+
+        :param items: the number of items fed so far
+        :param offsets: see save
+        :return: True if a checkpoint was saved
+        """
+        due = (self.every_items is not None and
+               items - self.items >= self.every_items) or \
+              (self.every_seconds is not None and
+               time.monotonic() - self.last_time >= self.every_seconds)
+        if due:
+            self.save(dict(offsets or {}, fed=items))
+        return due
+
+    def save(self, offsets=None):
+        """
+        Appends a checkpoint to the file.
+
+        :param offsets: a dict with the positions of the stream sources,
+            e.g. {"source": source.offset}
+        :return: the number of hosts written
+        """
+        net = self.net
+        if self.keys is None or len(self.ends) != len(net.channels):
+            self.index()
+        touched = self.touched()
+        touched.update(self.dirty)
+        self.dirty = set()
+
+        written = 0
+        with open(self.path, "ab", buffering=1 << 20) as f:
+            # hosts, a batch at a time so the file is written as we go
+            dumps = pickle.dumps
+            previous = self.previous
+            dirty = []
+            for key, host in self.keys.items():
+                if key not in touched:
+                    continue
+                state = dumps(host_state(host), pickle.HIGHEST_PROTOCOL)
+                if previous.get(key) != state:
+                    previous[key] = state
+                    dirty.append((key, state))
+                    if len(dirty) == self.batch:
+                        self.frame(f, HOSTS, dirty)
+                        written += len(dirty)
+                        dirty = []
+            if dirty:
+                self.frame(f, HOSTS, dirty)
+                written += len(dirty)
+
+            groups = {}
+            for index, group in enumerate(net.groups):
+                if group.state is not None:
+                    state = dumps(group.state.columns,
+                                  pickle.HIGHEST_PROTOCOL)
+                    if self.groups.get(index) != state:
+                        self.groups[index] = groups[index] = state
+            if groups:
+                self.frame(f, GROUPS, groups)
+
+            self.frame(f, COUNTERS,
+                       {name: column.tobytes()
+                        for name, column in net.counters.columns().items()})
+
+            dispatcher = net.dispatcher
+            self.frame(f, EVENTS,
+                       [(time, channel.cid, is_batch(channel, func), msg)
+                        for time, channel, func, msg in
+                        dispatcher.pending_events()])
+
+            # the links of a timed run, so that it resumes with the same
+            # jitter and delays
+            models = {}
+            histograms = {}
+            for channel in net.channels:
+                model = channel.model
+                if model is not None:
+                    if id(model) not in models:
+                        models[id(model)] = (channel.cid,
+                                             model.rng.getstate())
+                    histograms[channel.cid] = (channel.queue_delay,
+                                               channel.latency)
+
+            self.number += 1
+            self.frame(f, META,
+                       {"number": self.number,
+                        "byteorder": sys.byteorder,
+                        "channels": len(net.channels),
+                        "now": dispatcher.now,
+                        "delivered": getattr(dispatcher, "delivered", 0),
+                        "busy_until": array.array(
+                            "d", (channel.busy_until
+                                  for channel in net.channels)).tobytes(),
+                        "links": list(models.values()),
+                        "histograms": histograms,
+                        "offsets": dict(offsets or {})})
+            self.frame(f, COMMIT, self.number)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.items = (offsets or {}).get("fed", self.items)
+        self.last_time = time.monotonic()
+        return written
+
+
+###############################################################################
+#
+# Reader
+#
+###############################################################################
+class Checkpoint:
+    """
+    The last complete checkpoint of a file.
+    """
+
+    def __init__(self):
+        self.number = 0
+        # {key: pickled state} of every host ever written
+        self.hosts = {}
+        # {group index: pickled columns}
+        self.groups = {}
+        self.counters = None
+        self.events = []
+        self.meta = {}
+        self.offsets = {}
+        # the file offset after the checkpoint
+        self.end = len(MAGIC)
+
+    def restore(self, net, driver=None):
+        """
+        Loads the checkpoint into a freshly built network.
+
+        The network must be built like the saved one: the same hosts,
+        groups, channels and link models in the same order.
+
+        :param net: the network
+        :param driver: the StreamDriver of the resumed run, which continues
+            counting from the items fed before the checkpoint
+        :return: None
+        """
+        if self.meta.get("channels") != len(net.channels):
+            raise TypeError("The checkpoint has a different number of "
+                            "channels")
+
+        hosts = host_keys(net)
+        for key, state in self.hosts.items():
+            if key not in hosts:
+                raise TypeError(f"There is no {key!r} host")
+            vars(hosts[key]).update(pickle.loads(state))
+
+        for index, state in self.groups.items():
+            group = net.groups[index]
+            if group.state is None:
+                GroupState(group)
+            group.state.columns = pickle.loads(state)
+
+        snapshot = {}
+        for name, data in self.counters.items():
+            column = array.array("q")
+            column.frombytes(data)
+            if self.meta["byteorder"] != sys.byteorder:
+                column.byteswap()
+            snapshot[name] = column
+        net.load_counters(snapshot)
+
+        busy = array.array("d")
+        busy.frombytes(self.meta["busy_until"])
+        if self.meta["byteorder"] != sys.byteorder:
+            busy.byteswap()
+        for channel, value in zip(net.channels, busy):
+            channel.busy_until = value
+        channels = {channel.cid: channel for channel in net.channels}
+        for cid, state in self.meta.get("links", ()):
+            if channels[cid].model is None:
+                raise TypeError(f"Channel {cid} has no link model")
+            channels[cid].model.rng.setstate(state)
+        for cid, (queue_delay, latency) in \
+                self.meta.get("histograms", {}).items():
+            channels[cid].queue_delay = queue_delay
+            channels[cid].latency = latency
+
+        dispatcher = net.dispatcher
+        dispatcher.now = self.meta["now"]
+        if hasattr(dispatcher, "delivered"):
+            dispatcher.delivered = self.meta["delivered"]
+        events = []
+        for time, cid, batch, msg in self.events:
+            channel = channels[cid]
+            proxy = channel.src.proxy_to(channel.dst)
+            endpoint = proxy.endpoints[channel.endpoint]
+            func = endpoint.send_batch if batch else endpoint.send
+            events.append((time, channel, func, msg))
+        dispatcher.load_events(events)
+
+        if driver is not None:
+            driver.fed = self.offsets.get("fed", 0)
+
+
+def frames(path):
+    """
+    Reads the frames of a checkpoint file.
+
+    :param path: the path of the file
+    :return: an iterator of (kind, payload, offset after the frame); a
+        truncated last frame ends the iteration
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise TypeError(f"{path!r} is not a checkpoint file")
+        while True:
+            header = f.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            kind, compressed, length = FRAME.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if compressed:
+                data = zlib.decompress(data)
+            yield kind, pickle.loads(data), f.tell()
+
+
+def read_checkpoint(path):
+    """
+    Reads the last complete checkpoint of a file.
+
+    :param path: the path of the file
+    :return: a Checkpoint (number 0 if the file has none)
+    """
+    checkpoint = Checkpoint()
+    # the frames of the checkpoint being read, applied at its COMMIT
+    hosts, groups, current = [], {}, {}
+    for kind, payload, end in frames(path):
+        if kind == HOSTS:
+            hosts.extend(payload)
+        elif kind == GROUPS:
+            groups.update(payload)
+        elif kind in (COUNTERS, EVENTS, META):
+            current[kind] = payload
+        elif kind == COMMIT:
+            checkpoint.hosts.update(hosts)
+            checkpoint.groups.update(groups)
+            checkpoint.counters = current[COUNTERS]
+            checkpoint.events = current[EVENTS]
+            checkpoint.meta = current[META]
+            checkpoint.offsets = checkpoint.meta["offsets"]
+            checkpoint.number = payload
+            checkpoint.end = end
+            hosts, groups, current = [], {}, {}
+    return checkpoint
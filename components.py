@@ -4,8 +4,19 @@ independent of the particular algorithm, and report them in a standardized
 manner.
 
 """
+import array
+import heapq
+import inspect
+import random
+from collections import deque
+
 from tools import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 ###############################################################################
 #
@@ -53,6 +64,10 @@ class HostGroup:
     def __init__(self):
         self.members = {}
         self.channel = None
+        # the columnar state of the members, for vectorized group handlers
+        self.state = None
+        # changes every time the membership changes
+        self.version = 0
 
     def join(self, h):
         """
@@ -62,6 +77,111 @@ class HostGroup:
         :return: NOne
         """
         self.members[h] = h
+        self.version += 1
+
+
+class GroupState:
+    """
+    Columnar state of the members of a host group.
+
+    Instead of one attribute per member object, every piece of state is a
+    column (a NumPy array when NumPy is installed, an array.array
+    otherwise) with one entry per member, in the order the members joined.
+    A vectorized group handler can then update the state of all the members
+    of a group with a few array operations.
+    """
+
+    def __init__(self, group):
+        """
+        A basic constructor.
+
+        :param group: the HostGroup whose members the state describes
+        """
+        self.group = group
+        self.index = {member: i for i, member in enumerate(group.members)}
+        self.columns = {}
+        group.state = self
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __setitem__(self, name, column):
+        if len(column) != len(self.index):
+            raise TypeError(f"The column {name!r} must have one value per "
+                            f"member")
+        self.columns[name] = column
+
+    def add_column(self, name, value=0, typecode="d"):
+        """
+        Adds a column with the same initial value for all the members.
+
+        :param name: the name of the column
+        :param value: the initial value
+        :param typecode: the array.array typecode of the column
+        :return: the new column
+        """
+        if numpy is not None:
+            column = numpy.full(len(self.index), value,
+                                dtype=numpy.dtype(typecode))
+        else:
+            column = array.array(typecode, [value]) * len(self.index)
+        self.columns[name] = column
+        return column
+
+    def fill(self, name, value, mask=None):
+        """
+        Sets the value of all the members in a column.
+
+        :param name: the name of the column
+        :param value: the new value
+        :param mask: a boolean per member; only the members whose value is
+            true are set (None for all)
+        :return: None
+        """
+        column = self.columns[name]
+        if numpy is not None and isinstance(column, numpy.ndarray):
+            if mask is None:
+                column[:] = value
+            else:
+                column[numpy.asarray(mask, dtype=bool)] = value
+        elif mask is None:
+            column[:] = array.array(column.typecode, [value]) * len(column)
+        else:
+            for index, keep in enumerate(mask):
+                if keep:
+                    column[index] = value
+
+    def assign(self, name, values, mask=None):
+        """
+        Sets the values of the members in a column.
+
+        :param name: the name of the column
+        :param values: a value per member
+        :param mask: a boolean per member; only the members whose value is
+            true are set (None for all)
+        :return: None
+        """
+        column = self.columns[name]
+        if mask is None:
+            column[:] = values
+        elif numpy is not None and isinstance(column, numpy.ndarray):
+            mask = numpy.asarray(mask, dtype=bool)
+            column[mask] = numpy.asarray(values)[mask]
+        else:
+            for index, keep in enumerate(mask):
+                if keep:
+                    column[index] = values[index]
+
+    def get(self, member, name):
+        """
+        :param member: a member of the group
+        :param name: the name of a column
+        :return: the value of the member in the column
+        """
+        return self.columns[name][self.index[member]]
 
 
 ###############################################################################
@@ -69,6 +189,200 @@ class HostGroup:
 # Channels
 #
 ###############################################################################
+class LinkModel:
+    """
+    Timing model of a channel.
+
+    A link model describes how long a message needs to reach its
+    destination. The delay of a message of `size` bytes is
+
+        queueing delay + size / bandwidth + latency + jitter
+
+    where the queueing delay is the time the message waits for the
+    previous messages of the same channel to leave the link, and the jitter
+    is drawn uniformly from [0, jitter). Time is measured in the simulated
+    time units of the network's clock and bandwidth in bytes per unit.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, jitter=0.0, seed=None):
+        """
+        A basic constructor.
+
+        :param latency: the propagation delay of every message
+        :param bandwidth: bytes per time unit (None for infinite)
+        :param jitter: the upper bound of the random extra delay
+        :param seed: the seed of the jitter generator
+        """
+        if latency < 0 or jitter < 0:
+            raise TypeError("Latency and jitter must be non negative")
+        if bandwidth is not None and bandwidth <= 0:
+            raise TypeError("Bandwidth must be positive")
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.random = self.rng.random
+
+    def transfer_time(self, size):
+        """
+        :param size: the size of the message in bytes
+        :return: the time the message occupies the link
+        """
+        if self.bandwidth is None:
+            return 0.0
+        return size / self.bandwidth
+
+    def propagation_time(self):
+        """
+        :return: the time from leaving the link to reaching the destination
+        """
+        if self.jitter:
+            return self.latency + self.jitter * self.random()
+        return self.latency
+
+
+def _int64_array(values):
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=numpy.int64).tobytes()
+    return array.array("q", values)
+
+
+class ChannelStore:
+    """
+    The counters of all the channels of a network.
+
+    Counters are kept as a struct of arrays: one contiguous int64 array per
+    counter, indexed by the channel id. A channel only remembers its id and
+    reads and writes its counters through the store.
+
+    Snapshots copy the arrays, so they are cheap even with many thousands
+    of channels. When NumPy is installed snapshots are NumPy arrays, and
+    diffs and sums are vectorized.
+    """
+
+    COLUMNS = ("msgs", "bytes", "rx_msgs", "rx_bytes", "enc_bytes")
+
+    def __init__(self):
+        self.msgs = array.array("q")
+        self.bytes = array.array("q")
+        self.rx_msgs = array.array("q")
+        self.rx_bytes = array.array("q")
+        # the bytes after encoding, for the channels with an encoder
+        self.enc_bytes = array.array("q")
+
+    def __len__(self):
+        return len(self.msgs)
+
+    def columns(self):
+        """
+        :return: a dict with the array of every counter
+        """
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def allocate(self, n=1):
+        """
+        Allocates counters for new channels.
+
+        :param n: the number of channels
+        :return: the id of the first new channel
+        """
+        cid = len(self.msgs)
+        if n == 1:
+            self.msgs.append(0)
+            self.bytes.append(0)
+            self.rx_msgs.append(0)
+            self.rx_bytes.append(0)
+            self.enc_bytes.append(0)
+        else:
+            zeros = array.array("q", bytes(8 * n))
+            for column in self.columns().values():
+                column.extend(zeros)
+        return cid
+
+    def snapshot(self):
+        """
+        Copies all the counters.
+
+        :return: a dict with a copy of the array of every counter
+        """
+        if numpy is not None:
+            return {name: numpy.array(column, dtype=numpy.int64)
+                    for name, column in self.columns().items()}
+        return {name: array.array("q", column)
+                for name, column in self.columns().items()}
+
+    @staticmethod
+    def diff(new, old):
+        """
+        Calculates the traffic between two snapshots.
+
+        Channels created after the old snapshot count from zero.
+
+        :param new: the later snapshot
+        :param old: the earlier snapshot
+        :return: a snapshot with the counter differences
+        """
+        result = {}
+        for name, column in new.items():
+            before = old[name]
+            if numpy is not None:
+                delta = numpy.array(column, dtype=numpy.int64)
+                delta[:len(before)] -= numpy.asarray(before)
+            else:
+                delta = array.array("q", column)
+                for cid, value in enumerate(before):
+                    delta[cid] -= value
+            result[name] = delta
+        return result
+
+    @staticmethod
+    def sum(snapshot):
+        """
+        :param snapshot: a snapshot or the store itself
+        :return: a dict with the sum of every counter
+        """
+        if isinstance(snapshot, ChannelStore):
+            snapshot = snapshot.columns()
+        if numpy is not None:
+            return {name: int(numpy.asarray(column).sum())
+                    for name, column in snapshot.items()}
+        return {name: sum(column) for name, column in snapshot.items()}
+
+    def add(self, snapshot):
+        """
+        Adds the counters of a snapshot to the counters of the store.
+
+        :param snapshot: a snapshot of a store with the same channels
+        :return: None
+        """
+        for name, column in self.columns().items():
+            values = snapshot[name]
+            if len(values) != len(column):
+                raise TypeError("The snapshot has a different number of "
+                                "channels")
+            if numpy is not None:
+                total = numpy.array(column, dtype=numpy.int64)
+                total += numpy.asarray(values)
+                column[:] = _int64_array(total)
+            else:
+                for cid, value in enumerate(values):
+                    column[cid] += value
+
+    def restore(self, snapshot):
+        """
+        Overwrites the counters of the store with a snapshot.
+
+        :param snapshot: a snapshot of a store with the same channels
+        :return: None
+        """
+        for name, column in self.columns().items():
+            values = snapshot[name]
+            if len(values) != len(column):
+                raise TypeError("The snapshot has a different number of "
+                                "channels")
+            column[:] = _int64_array(values)
+
+
 class Channel:
     """
     Point to point unidirectional Channel
@@ -77,39 +391,194 @@ class Channel:
     number of messages and the total message size (in bytes). A channel is
     defined by the source host, the destination host and the endpoint in
     which is included.
+
+    The counters themselves live in the `ChannelStore` of the network; the
+    channel is a small view that knows its id in the store.
+
+    A channel may also have a `LinkModel`. In that case the timed dispatcher
+    asks the channel when each message arrives, and the channel records the
+    queueing delay and the end-to-end latency of its messages.
+
+    A channel may also have an encoder (see the encoders module), which
+    estimates the size of every message under a real encoding. The
+    encoded bytes are counted next to the raw bytes.
+
+    The request channel of an endpoint may have a fault model (see the
+    faults module), which then decides which messages are delivered.
     """
 
-    def __init__(self, src, dst, endpoint):
+    __slots__ = ("src", "dst", "endpoint", "store", "cid", "buckets",
+                 "model", "busy_until", "queue_delay", "latency",
+                 "encoder", "enc_buckets", "faults")
+
+    def __init__(self, src, dst, endpoint, store=None, cid=None):
         """
         A basic constructor.
 
         :param src: the source host
         :param dst: the destination host
+        :param store: the ChannelStore of the counters (by default the
+            store of the source host's network)
+        :param cid: the id of counters already allocated in the store
         """
         self.src = src
         self.dst = dst
         self.endpoint = endpoint
 
-        self.msgs = 0
-        self.bytes = 0
+        if store is None:
+            net = getattr(src, "net", None)
+            store = net.counters if net is not None else ChannelStore()
+        self.store = store
+        self.cid = store.allocate() if cid is None else cid
+        # the aggregates of the network this channel adds its traffic to
+        self.buckets = ()
 
-    def transmit(self, msg):
+        self.model = None
+        self.busy_until = 0.0
+        self.queue_delay = None
+        self.latency = None
+
+        self.encoder = None
+        # the [raw bytes, encoded bytes] aggregates of the encoded traffic
+        self.enc_buckets = ()
+
+        self.faults = None
+
+    def transmit(self, msg, size=None):
         """
         Adds transmitted msg and its bytes to the channel metrics
 
         :param msg:  the transmitted message
+        :param size: the size of the message, if already known
+        :return: the size of the message
+        """
+        if size is None:
+            size = msg_size(msg)
+        store = self.store
+        store.msgs[self.cid] += 1
+        store.bytes[self.cid] += size
+        for bucket in self.buckets:
+            bucket[0] += 1
+            bucket[1] += size
+        if self.encoder is not None:
+            self.account_encoded(size, self.encoder(self, msg, size))
+        return size
+
+    def transmit_many(self, msgs, size=None):
+        """
+        Adds a batch of transmitted msgs and their bytes to the channel
+        metrics.
+
+        :param msgs: a list of transmitted messages
+        :param size: the total size of the messages, if already known
+        :return: the total size of the messages
+        """
+        if size is None:
+            size = msg_size(msgs)
+        n = len(msgs)
+        store = self.store
+        store.msgs[self.cid] += n
+        store.bytes[self.cid] += size
+        for bucket in self.buckets:
+            bucket[0] += n
+            bucket[1] += size
+        if self.encoder is not None:
+            self.account_encoded(size,
+                                 self.encoder.encode_many(self, msgs, size))
+        return size
+
+    def account_encoded(self, size, encoded):
+        """
+        Adds the encoded size of transmitted messages to the channel
+        metrics.
+
+        :param size: the raw size of the messages
+        :param encoded: their encoded size
+        :return: None
+        """
+        self.store.enc_bytes[self.cid] += encoded
+        for bucket in self.enc_buckets:
+            bucket[0] += size
+            bucket[1] += encoded
+
+    def set_encoder(self, encoder):
+        """
+        Sets the encoder of the channel.
+
+        :param encoder: an Encoder, or None to stop counting encoded bytes
+        :return: None
+        """
+        self.encoder = encoder
+
+    @property
+    def enc_bytes(self):
+        """
+        The bytes of the channel after encoding (the raw bytes if the
+        channel has never had an encoder).
+        """
+        if self.encoder is None and not self.enc_buckets:
+            return self.bytes
+        return self.store.enc_bytes[self.cid]
+
+    @property
+    def msgs(self):
+        return self.store.msgs[self.cid]
+
+    @msgs.setter
+    def msgs(self, value):
+        self.store.msgs[self.cid] = value
+
+    @property
+    def bytes(self):
+        return self.store.bytes[self.cid]
+
+    @bytes.setter
+    def bytes(self, value):
+        self.store.bytes[self.cid] = value
+
+    def set_model(self, model):
+        """
+        Sets the timing model of the channel.
+
+        :param model: a LinkModel, or None for instant delivery
         :return: None
         """
-        self.msgs += 1
-        self.bytes += msg_size(msg)
+        self.model = model
+        self.busy_until = 0.0
+        if model is None:
+            self.queue_delay = None
+            self.latency = None
+        else:
+            self.queue_delay = Histogram()
+            self.latency = Histogram()
+
+    def schedule(self, now, size):
+        """
+        Calculates the arrival time of a message sent at time `now`.
+
+        :param now: the time the message is sent
+        :param size: the size of the message in bytes
+        :return: the arrival time
+        """
+        model = self.model
+        if model is None:
+            return now
+
+        start = now if now > self.busy_until else self.busy_until
+        self.busy_until = start + model.transfer_time(size)
+        arrival = self.busy_until + model.propagation_time()
+
+        self.queue_delay.add(start - now)
+        self.latency.add(arrival - now)
+        return arrival
 
 
 class MulticastChannel(Channel):
     """
     Broadcast unidirectional Channel
 
-    A channel can be a multicast channel. This is always associated with
-    some one-way rpc method, sending data from a single source host A to a
+    A channel can be a multicast channel. This is associated with some
+    rpc method, sending data from a single source host A to a
     destination host group B. Again, there are two channels associated with
     A and B. One channel counts the traffic sent by A, and the second
     channel counts the traffic received by all the hosts in host group B.
@@ -119,31 +588,96 @@ class MulticastChannel(Channel):
     300 additional bytes.
     """
 
-    def __init__(self, src, dst: HostGroup, endpoint):
+    __slots__ = ("rx_buckets",)
+
+    def __init__(self, src, dst: HostGroup, endpoint, store=None):
         """
          A basic constructor.
 
         :param src: the source host
         :param dst: the destination host
+        :param store: the ChannelStore of the counters
         """
-        super().__init__(src, dst, endpoint)
-        self.rx_msgs = 0
-        self.rx_bytes = 0
+        super().__init__(src, dst, endpoint, store)
+        self.rx_buckets = ()
 
-    def transmit(self, msg):
+    def transmit(self, msg, size=None):
         """
         Same as Channel.transmit but also calculates the messages that sites
         received from broadcast.
 
         :param msg: the transmitted message
-        :return: None
+        :param size: the size of the message, if already known
+        :return: the size of the message
+        """
+        if size is None:
+            size = msg_size(msg)
+        store = self.store
+        cid = self.cid
+        store.msgs[cid] += 1
+        store.bytes[cid] += size
+        for bucket in self.buckets:
+            bucket[0] += 1
+            bucket[1] += size
+        if self.encoder is not None:
+            self.account_encoded(size, self.encoder(self, msg, size))
+
+        group_size = len(self.dst.members)
+        store.rx_msgs[cid] += group_size
+        store.rx_bytes[cid] += group_size * size
+        for bucket in self.rx_buckets:
+            bucket[0] += group_size
+            bucket[1] += group_size * size
+        return size
+
+    def transmit_many(self, msgs, size=None):
+        """
+        Same as Channel.transmit_many but also calculates the messages that
+        sites received from broadcast.
+
+        :param msgs: a list of transmitted messages
+        :param size: the total size of the messages, if already known
+        :return: the total size of the messages
         """
-        self.msgs += 1
-        self.bytes += msg_size(msg)
+        size = super().transmit_many(msgs, size)
 
         group_size = len(self.dst.members)
-        self.rx_msgs += group_size
-        self.rx_bytes += group_size * msg_size(msg)
+        store = self.store
+        store.rx_msgs[self.cid] += group_size * len(msgs)
+        store.rx_bytes[self.cid] += group_size * size
+        for bucket in self.rx_buckets:
+            bucket[0] += group_size * len(msgs)
+            bucket[1] += group_size * size
+        return size
+
+    @property
+    def rx_msgs(self):
+        return self.store.rx_msgs[self.cid]
+
+    @rx_msgs.setter
+    def rx_msgs(self, value):
+        self.store.rx_msgs[self.cid] = value
+
+    @property
+    def rx_bytes(self):
+        return self.store.rx_bytes[self.cid]
+
+    @rx_bytes.setter
+    def rx_bytes(self, value):
+        self.store.rx_bytes[self.cid] = value
+
+
+class FanInChannel(Channel):
+    """
+    The response channel of a broadcast endpoint.
+
+    It counts the replies of all the members of a host group to a single
+    host, e.g. the coordinator that polls its sites. The replies of one
+    poll are accounted together, as a batch. The source of the channel is
+    the host group, so its traffic is not counted per source host.
+    """
+
+    __slots__ = ()
 
 
 ###############################################################################
@@ -169,6 +703,7 @@ class Interface:
         """
         self.name = name
         self.methods = {}
+        self._specs = None
 
     def add_method(self, name, one_way):
         """
@@ -180,6 +715,51 @@ class Interface:
         """
         if name not in self.methods:
             self.methods[name] = one_way
+            self._specs = None
+
+    def specs(self):
+        """
+        The endpoint metadata of the interface.
+
+        The tuple is built once and shared by all the proxies of the
+        interface.
+
+        :return: a tuple of (name, one_way, batch name) tuples
+        """
+        if self._specs is None:
+            self._specs = tuple((name, one_way, batch_name(name))
+                                for name, one_way in self.methods.items())
+        return self._specs
+
+
+def batch_name(name):
+    """
+    :param name: the name of a remote method
+    :return: the name of its `<method>_batch` remote method
+    """
+    return name + "_batch"
+
+
+def is_batch(channel, func):
+    """
+    Tells if a delivery on a channel calls the `<method>_batch` remote
+    method, i.e. if its message is a list of messages.
+
+    Wrappers of the remote method, a WrappedCall or a call of a GroupCall
+    (e.g. a faults.PartialCall), are looked through.
+
+    :param channel: the channel of the delivery
+    :param func: the remote method, possibly wrapped
+    :return: True for a batch delivery
+    """
+    while True:
+        inner = getattr(func, "func", None)
+        if inner is None:
+            inner = getattr(func, "group_call", None)
+        if inner is None:
+            break
+        func = inner
+    return getattr(func, "__name__", None) == batch_name(channel.endpoint)
 
 
 class Protocol:
@@ -219,6 +799,138 @@ class Protocol:
         self.interfaces[ifc].add_method(name, one_way)
 
 
+class GroupCall:
+    """
+    The remote method of a broadcast endpoint.
+
+    Calling it delivers a message to all the members of a host group. If
+    the members implement a vectorized group handler `<method>_group`, a
+    class or static method with arguments (group, msg), it is called once
+    for the whole group. Otherwise the remote method of every member is
+    called in turn; the bound methods are looked up at the first delivery,
+    so nothing per member is built before the endpoint is used.
+
+    A group handler that also accepts a `mask` keyword argument can receive
+    a broadcast that only reached some of the members (see the faults
+    module): mask has a boolean per member, true for the members that
+    received it.
+    """
+
+    __slots__ = ("group", "__name__", "group_name", "version", "handler",
+                 "masked", "complete", "funcs")
+
+    def __init__(self, group, name):
+        """
+        A basic constructor.
+
+        :param group: the HostGroup
+        :param name: the name of the remote method
+        """
+        self.group = group
+        self.__name__ = name
+        self.group_name = name + "_group"
+        self.version = None
+        self.handler = None
+        # True if the group handler accepts a mask of the members
+        self.masked = False
+        self.complete = False
+        self.funcs = None
+
+    def resolve(self):
+        """
+        Finds the group handler and checks that every member implements
+        the remote method. The result is kept until the membership changes.
+
+        :return: None
+        """
+        members = self.group.members
+        name = self.__name__
+        types = {type(member) for member in members}
+        handler = None
+        if len(types) == 1:
+            handler = getattr(types.pop(), self.group_name, None)
+        self.handler = handler
+        self.masked = handler is not None and \
+            "mask" in inspect.signature(handler).parameters
+        self.funcs = [getattr(member, name, None) for member in members]
+        self.complete = all(callable(func) for func in self.funcs)
+        self.version = self.group.version
+
+    def supported(self):
+        """
+        :return: True if the members can receive calls of this method
+        """
+        if self.version != self.group.version:
+            self.resolve()
+        return self.handler is not None or self.complete
+
+    def replies(self, msg):
+        """
+        Calls the remote method of all the members and collects their
+        results.
+
+        :param msg: the message
+        :return: the results of the members, in the order they joined
+        """
+        if not self.supported():
+            raise TypeError(f"Not every member implements {self.__name__!r}")
+        if self.handler is not None:
+            return self.handler(self.group, msg)
+        return [func(msg) for func in self.funcs]
+
+    def __call__(self, msg):
+        if self.version != self.group.version:
+            self.resolve()
+        if self.handler is not None:
+            self.handler(self.group, msg)
+        else:
+            if not self.complete:
+                raise TypeError(f"Not every member implements "
+                                f"{self.__name__!r}")
+            for func in self.funcs:
+                func(msg)
+
+
+class WrappedCall:
+    """
+    A remote method with code that runs before and after it, e.g. to check
+    or record its messages.
+
+    The dispatchers see through the wrapper: a wrapped GroupCall is still
+    delivered as a broadcast, and when the remote method is a coroutine
+    `after` runs once it has finished.
+    """
+
+    __slots__ = ("func", "__name__")
+
+    def __init__(self, func):
+        """
+        A basic constructor.
+
+        :param func: the wrapped remote method
+        """
+        self.func = func
+        self.__name__ = getattr(func, "__name__", None)
+
+    def before(self, msg):
+        """
+        Called before the remote method with its message.
+        """
+        pass
+
+    def after(self, msg):
+        """
+        Called after the remote method with its message.
+        """
+        pass
+
+    def __call__(self, msg):
+        self.before(msg)
+        result = self.func(msg)
+        self.after(msg)
+        return result
+
+
 class Endpoint:
     """
     Represents an rpc endpoint
@@ -227,18 +939,24 @@ class Endpoint:
     it is not one way---with a response channel.
     """
 
-    def __init__(self, name, func, req_channel, resp_channel=None):
+    __slots__ = ("name", "send", "req_channel", "resp_channel", "send_batch")
+
+    def __init__(self, name, func, req_channel, resp_channel=None,
+                 batch_func=None):
         """
         A basic constructor.
 
         :param func: the remote method
         :param req_channel:  the request channel
         :param resp_channel:  the response channel
+        :param batch_func: the remote method that accepts a list of
+            messages, if the receiver implements one
         """
         self.name = name
         self.send = func
         self.req_channel = req_channel
         self.resp_channel = resp_channel
+        self.send_batch = batch_func
 
 
 ###############################################################################
@@ -266,55 +984,65 @@ class Proxy:
         self.ifc = ifc
         self.owner = None
         self.proxied = None
+        self.multicast = False
         self.endpoints = {}
 
     def create_endpoints(self):
         """
         Creates the proxy's endpoints.
 
-        If the owner has a proxied host group send will be a collection of
-        remote methods.Also in this case there will be a broadcast so there
-        are not constructed response channels.
+        If the owner has a proxied host group send will be a GroupCall that
+        delivers to all the members. The replies of the members to a
+        broadcast that is not one way are counted by a FanInChannel.
+
+        A receiver can opt in to batched delivery of a remote method `m` by
+        implementing a method `m_batch` that takes a list of messages.
 
         :return: None
         """
         ifc_obj = self.owner.net.protocol.interfaces[self.ifc]
+        self.multicast = self.proxied in self.owner.net.group_set
 
-        for name, one_way in ifc_obj.methods.items():
+        for name, one_way, batch_name in ifc_obj.specs():
             # if proxied is a host group create a multichannel
-            if self.proxied in self.owner.net.groups:
+            if self.multicast:
 
-                send = []
-                for member in self.proxied.members:
-                    func = getattr(member, name)
-                    # here send is a collection of remote methods
-                    send.append(func)
+                # here send delivers to all the members of the group
+                send = GroupCall(self.proxied, name)
+                batch = GroupCall(self.proxied, batch_name)
 
                 req_channel = MulticastChannel(self.owner, self.proxied, name)
+                self.owner.net.add_channel(req_channel)
 
-                # broadcast is always one way channel
+                resp_channel = None
                 if not one_way:
-                    raise AttributeError("Broadcast must always be one way.")
-
-                self.owner.net.channels.append(req_channel)
-                self.endpoints[name] = Endpoint(name, send, req_channel)
+                    # the source is the group, which has no network
+                    resp_channel = FanInChannel(self.proxied, self.owner,
+                                                name,
+                                                self.owner.net.counters)
+                    self.owner.net.add_channel(resp_channel)
+
+                self.endpoints[name] = Endpoint(name, send, req_channel,
+                                                resp_channel, batch)
             # here proxied is a single host
             else:
                 send = (getattr(self.proxied, name))
+                batch = getattr(self.proxied, batch_name, None)
 
                 req_channel = Channel(self.owner, self.proxied, name)
 
                 if one_way:
-                    self.owner.net.channels.append(req_channel)
-                    self.endpoints[name] = Endpoint(name, send, req_channel)
+                    self.owner.net.add_channel(req_channel)
+                    self.endpoints[name] = Endpoint(name, send, req_channel,
+                                                    batch_func=batch)
                 else:
                     # create a response channel
                     resp_channel = Channel(self.proxied, self.owner, name)
 
-                    self.owner.net.channels.append(req_channel)
-                    self.owner.net.channels.append(resp_channel)
+                    self.owner.net.add_channel(req_channel)
+                    self.owner.net.add_channel(resp_channel)
                     self.endpoints[name] = Endpoint(name, send, req_channel,
-                                                    resp_channel)
+                                                    resp_channel, batch)
 
 
 class Sender(Host):
@@ -336,44 +1064,513 @@ class Sender(Host):
         super().__init__(net, nid, )
         if ifc not in self.net.protocol.interfaces:
             raise TypeError(f"There is no {ifc!r} interface")
+        # the proxy of the first link, used when send is not given a peer
         self.proxy = Proxy(ifc)
+        # the proxies of the other links by proxied host (None if none)
+        self.proxies = None
 
-    def connect_proxy(self, proxied):
+    def open_proxy(self, proxied, ifc=None):
         """
-        Connects the proxy given a destination
+        Gets the proxy of a new link: the default proxy if it is not
+        connected yet and has the same interface, otherwise a new one.
+
+        :param proxied: the host (or host group) to be proxied
+        :param ifc: the name of the interface of the link (by default the
+            interface of the default proxy)
+        :return: the proxy, with its owner and proxied host set
+        """
+        proxy = self.proxy
+        if proxy.proxied is not None or (ifc is not None and
+                                         ifc != proxy.ifc):
+            if proxied is proxy.proxied or \
+                    (self.proxies is not None and proxied in self.proxies):
+                raise TypeError(f"There is already a link to {proxied!r}")
+            if ifc is not None and ifc not in self.net.protocol.interfaces:
+                raise TypeError(f"There is no {ifc!r} interface")
+            proxy = Proxy(proxy.ifc if ifc is None else ifc)
+            if self.proxies is None:
+                self.proxies = {}
+            self.proxies[proxied] = proxy
+        proxy.owner = self
+        proxy.proxied = proxied
+        return proxy
+
+    def connect_proxy(self, proxied, ifc=None):
+        """
+        Connects a proxy given a destination
 
         :param proxied: the host to be proxied
+        :param ifc: the name of the interface of the link (by default the
+            interface of the host)
         :return: None
         """
         if proxied not in self.net.hosts or self.net.groups:
             TypeError(f"There is no {proxied!r} host")
 
-        self.proxy.owner = self
-        self.proxy.proxied = proxied
+        self.open_proxy(proxied, ifc).create_endpoints()
+
+    def proxy_to(self, peer):
+        """
+        :param peer: a linked host or host group (None for the default)
+        :return: the proxy of the link to the peer
+        """
+        if peer is None or peer is self.proxy.proxied:
+            return self.proxy
+        if self.proxies is not None and peer in self.proxies:
+            return self.proxies[peer]
+        raise TypeError(f"There is no link to {peer!r}")
 
-        self.proxy.create_endpoints()
+    def all_proxies(self):
+        """
+        :return: the connected proxies of the host
+        """
+        proxies = [self.proxy] if self.proxy.proxied is not None else []
+        if self.proxies is not None:
+            proxies.extend(self.proxies.values())
+        return proxies
 
-    def send(self, method: str, msg):
+    def send(self, method: str, msg, to=None):
         """
         A method which is called from the user when a host sends a msg.
 
+        The remote call is not executed here; it is handed to the network's
+        dispatcher, which decides when the remote method runs.
+
         :param method: the remote method name the  will be called
         :param msg: the message that will be sent
+        :param to: the linked host or host group to send to (by default
+            the destination of the first link)
+        :return: what the dispatcher returns for the delivery: None, or an
+            awaitable of it with an AsyncDispatcher (None if the fault model
+            of the channel lost or held back the message)
+        """
+        proxy = self.proxy if to is None else self.proxy_to(to)
+        try:
+            endpoint = proxy.endpoints[method]
+        except KeyError:
+            raise TypeError(f"There is no {method!r} remote method")
+
+        size = endpoint.req_channel.transmit(msg)
+        if self.net.taps:
+            for tap in self.net.taps:
+                tap(endpoint.req_channel, msg, size, 1)
+        if endpoint.req_channel.faults is not None:
+            return endpoint.req_channel.faults.deliver(
+                self.net.dispatcher, endpoint, msg, size, proxy.multicast)
+        elif proxy.multicast:
+            return self.net.dispatcher.broadcast(endpoint.req_channel,
+                                                 endpoint.send, msg, size)
+        else:
+            return self.net.dispatcher.deliver(endpoint.req_channel,
+                                               endpoint.send, msg, size)
+
+    def send_batch(self, method: str, msgs, to=None):
+        """
+        Sends many messages to the same remote method with one call.
+
+        The channel accounts the whole batch at once, with exactly the
+        counters that sending the messages one by one would give. If the
+        receiver implements `<method>_batch`, it gets the whole list in a
+        single call; otherwise `<method>` is called once per message.
+
+        :param method: the remote method name the  will be called
+        :param msgs: the messages that will be sent
+        :param to: the linked host or host group to send to (by default
+            the destination of the first link)
+        :return: None
+        """
+        proxy = self.proxy if to is None else self.proxy_to(to)
+        try:
+            endpoint = proxy.endpoints[method]
+        except KeyError:
+            raise TypeError(f"There is no {method!r} remote method")
+
+        msgs = list(msgs)
+        if not msgs:
+            return
+
+        dispatcher = self.net.dispatcher
+        channel = endpoint.req_channel
+        size = channel.transmit_many(msgs)
+        if self.net.taps:
+            for tap in self.net.taps:
+                tap(channel, msgs, size, len(msgs))
+        if channel.faults is not None:
+            # every message of the batch is lost or delivered on its own
+            for msg in msgs:
+                channel.faults.deliver(dispatcher, endpoint, msg, None,
+                                       proxy.multicast)
+        elif proxy.multicast:
+            if endpoint.send_batch.supported():
+                dispatcher.broadcast(channel, endpoint.send_batch, msgs, size)
+            else:
+                for msg in msgs:
+                    dispatcher.broadcast(channel, endpoint.send, msg)
+        else:
+            if endpoint.send_batch is not None:
+                dispatcher.deliver(channel, endpoint.send_batch, msgs, size)
+            else:
+                dispatcher.deliver_many(channel, endpoint.send, msgs)
+
+    def call(self, method: str, msg, to=None):
+        """
+        Calls a remote method that is not one way and returns its result.
+
+        Unlike send, the remote method is executed immediately, whatever
+        the dispatcher, and the fault model of the channel is not applied.
+        The request is accounted on the request channel and the result on
+        the response channel of the endpoint.
+
+        :param method: the remote method name
+        :param msg: the message
+        :param to: the linked host to call (by default the destination of
+            the first link)
+        :return: the result of the remote method
+        """
+        proxy = self.proxy if to is None else self.proxy_to(to)
+        try:
+            endpoint = proxy.endpoints[method]
+        except KeyError:
+            raise TypeError(f"There is no {method!r} remote method")
+        if endpoint.resp_channel is None or proxy.multicast:
+            raise TypeError(f"{method!r} has no response to a single call")
+
+        taps = self.net.taps
+        size = endpoint.req_channel.transmit(msg)
+        for tap in taps:
+            tap(endpoint.req_channel, msg, size, 1)
+
+        result = endpoint.send(msg)
+
+        size = endpoint.resp_channel.transmit(result)
+        for tap in taps:
+            tap(endpoint.resp_channel, result, size, 1)
+        return result
+
+    def gather(self, method: str, msg, to=None):
+        """
+        Polls many hosts with the same message and collects their replies.
+
+        If `to` is a linked host group (by default the destination of the
+        first link), the request is one broadcast and the replies of all the
+        members are accounted at once on the FanInChannel of the endpoint.
+        If the members implement a group handler `<method>_group`, it is
+        called once and must return the replies of all the members, in the
+        order they joined. If `to` is a list of linked hosts, every host is
+        called in turn.
+
+        :param method: the remote method name
+        :param msg: the message
+        :param to: a linked host group, or a list of linked hosts
+        :return: the list of replies, in member order
+        """
+        if isinstance(to, (list, tuple)):
+            return [self.call(method, msg, peer) for peer in to]
+
+        proxy = self.proxy if to is None else self.proxy_to(to)
+        if not proxy.multicast:
+            return [self.call(method, msg, to)]
+        try:
+            endpoint = proxy.endpoints[method]
+        except KeyError:
+            raise TypeError(f"There is no {method!r} remote method")
+        if endpoint.resp_channel is None:
+            raise TypeError(f"{method!r} is a one way method")
+
+        taps = self.net.taps
+        size = endpoint.req_channel.transmit(msg)
+        for tap in taps:
+            tap(endpoint.req_channel, msg, size, 1)
+
+        replies = endpoint.send.replies(msg)
+
+        if len(replies):
+            size = endpoint.resp_channel.transmit_many(replies)
+            for tap in taps:
+                tap(endpoint.resp_channel, replies, size, len(replies))
+        return replies
+
+
+###############################################################################
+#
+# Dispatchers
+#
+###############################################################################
+class Dispatcher:
+    """
+    Delivers remote calls to their destination hosts.
+
+    Every `Sender.send` ends up in the dispatcher of the network. A
+    dispatcher decides when the remote method is executed: immediately,
+    or later from an event queue. Channel accounting is done by the sender
+    and is the same for every dispatcher.
+    """
+
+    # the simulated time; only timed dispatchers advance it
+    now = 0.0
+
+    def deliver(self, channel, func, msg, size=None):
+        """
+        Delivers a message to a single remote method.
+
+        :param channel: the channel the message travels on
+        :param func: the remote method
+        :param msg: the message
+        :param size: the size of the message, if already known
         :return: None
         """
-        # TODO: call transmit to calculate metrics
-        if self.proxy.proxied in self.net.groups:
-            try:
-                for send in self.proxy.endpoints[method].send:
-                    send(msg)
-            except KeyError:
-                raise TypeError(f"There is no {method!r} remote method")
+        raise NotImplementedError
+
+    def broadcast(self, channel, group_call, msg, size=None):
+        """
+        Delivers a message to all the members of a host group.
+
+        The whole broadcast is a single delivery of the GroupCall, which
+        calls the members in turn (or their vectorized group handler).
+
+        :param channel: the multicast channel the message travels on
+        :param group_call: the GroupCall of the remote method
+        :param msg: the message
+        :param size: the size of the message, if already known
+        :return: None
+        """
+        return self.deliver(channel, group_call, msg, size)
+
+    def deliver_many(self, channel, func, msgs):
+        """
+        Delivers a list of messages, one by one, to a single remote method.
+
+        :param channel: the channel the messages travel on
+        :param func: the remote method
+        :param msgs: the messages
+        :return: None
+        """
+        for msg in msgs:
+            self.deliver(channel, func, msg)
+
+    def pending(self):
+        """
+        :return: the number of deliveries that have not been executed yet
+        """
+        return 0
+
+    def pending_events(self):
+        """
+        :return: the deliveries that have not been executed yet, in
+            execution order, as (time, channel, func, msg) tuples
+        """
+        return []
+
+    def load_events(self, events):
+        """
+        Queues deliveries, e.g. the pending events of a checkpoint.
+
+        :param events: (time, channel, func, msg) tuples in execution order
+        :return: None
+        """
+        if events:
+            raise TypeError(f"{type(self).__name__} can not queue "
+                            f"deliveries")
+
+    def run(self, max_events=None):
+        """
+        Executes the pending deliveries.
+
+        :param max_events: stop after that many deliveries (None for all)
+        :return: the number of executed deliveries
+        """
+        if max_events is None:
+            return self.run_until(None)
+
+        remaining = [max_events]
+
+        # run_until checks the condition once before every delivery
+        def stop():
+            remaining[0] -= 1
+            return remaining[0] < 0
+
+        return self.run_until(stop)
+
+    def run_until(self, stop):
+        """
+        Executes pending deliveries until `stop()` returns True.
+
+        :param stop: a callable without arguments
+        :return: the number of executed deliveries
+        """
+        return 0
+
+
+class DirectDispatcher(Dispatcher):
+    """
+    Executes every remote method at the moment it is sent.
+
+    This is the original behaviour of the simulator. A remote method that
+    sends a message calls the next remote method recursively, so long
+    protocols grow the Python stack by one frame chain per round.
+    """
+
+    def deliver(self, channel, func, msg, size=None):
+        func(msg)
+
+
+class FifoDispatcher(Dispatcher):
+    """
+    Executes remote methods from a FIFO event queue.
+
+    Deliveries are appended to the queue and executed by a flat loop, so
+    a handler that sends a message never calls the next handler itself.
+
+    When `auto_run` is True, a send issued outside the loop runs the queue
+    until it is empty, so the user code keeps its synchronous look. With
+    `auto_run` set to False messages are only queued, and the user has to
+    call `run` or `run_until`.
+    """
+
+    def __init__(self, auto_run=True):
+        """
+        A basic constructor.
+
+        :param auto_run: if true the queue is run on every outer send
+        """
+        self.queue = deque()
+        self.auto_run = auto_run
+        self.running = False
+        self.delivered = 0
+
+    def deliver(self, channel, func, msg, size=None):
+        self.queue.append((channel, func, msg))
+        if self.auto_run and not self.running:
+            self.run()
+
+    def deliver_many(self, channel, func, msgs):
+        self.queue.extend([(channel, func, msg) for msg in msgs])
+        if self.auto_run and not self.running:
+            self.run()
+
+    def pending(self):
+        return len(self.queue)
+
+    def pending_events(self):
+        return [(self.now, channel, func, msg)
+                for channel, func, msg in self.queue]
+
+    def load_events(self, events):
+        self.queue.extend([(channel, func, msg)
+                           for _, channel, func, msg in events])
+
+    def run_until(self, stop):
+        # a handler that calls run() must not start a second loop
+        if self.running:
+            return 0
+
+        queue = self.queue
+        popleft = queue.popleft
+        executed = 0
+        self.running = True
+        try:
+            if stop is None:
+                while queue:
+                    channel, func, msg = popleft()
+                    executed += 1
+                    func(msg)
+            else:
+                while queue and not stop():
+                    channel, func, msg = popleft()
+                    executed += 1
+                    func(msg)
+        finally:
+            self.running = False
+            self.delivered += executed
+        return executed
+
+
+class TimedDispatcher(Dispatcher):
+    """
+    A discrete-event dispatcher with a simulated clock.
+
+    Every delivery is pushed in a priority queue with its arrival time,
+    which the channel calculates from its `LinkModel`. The loop pops the
+    deliveries in time order (ties in send order) and advances the clock to
+    the arrival time before calling the remote method. Channels without a
+    model deliver at the current time.
+    """
+
+    def __init__(self, auto_run=True):
+        """
+        A basic constructor.
+
+        :param auto_run: if true the queue is run on every outer send
+        """
+        self.heap = []
+        self.seq = 0
+        self.now = 0.0
+        self.auto_run = auto_run
+        self.running = False
+        self.delivered = 0
+
+    def deliver(self, channel, func, msg, size=None):
+        if channel.model is not None:
+            if size is None:
+                size = msg_size(msg)
+            time = channel.schedule(self.now, size)
         else:
-            try:
-                self.proxy.endpoints[method].send(msg)
-                self.proxy.endpoints[method].req_channel.transmit(msg)
-            except KeyError:
-                raise TypeError(f"There is no {method!r} remote method")
+            time = self.now
+        self.seq += 1
+        heapq.heappush(self.heap, (time, self.seq, channel, func, msg))
+        if self.auto_run and not self.running:
+            self.run()
+
+    def pending(self):
+        return len(self.heap)
+
+    def pending_events(self):
+        return [(time, channel, func, msg)
+                for time, _, channel, func, msg in sorted(self.heap)]
+
+    def load_events(self, events):
+        for time, channel, func, msg in events:
+            self.seq += 1
+            heapq.heappush(self.heap, (time, self.seq, channel, func, msg))
+
+    def run_until(self, stop):
+        """
+        Executes pending deliveries until `stop` is reached.
+
+        :param stop: a callable without arguments that returns True to
+            stop, or a simulated time. In the second case every delivery
+            up to that time is executed and the clock is set to it.
+        :return: the number of executed deliveries
+        """
+        if self.running:
+            return 0
+
+        horizon = None
+        if stop is not None and not callable(stop):
+            horizon = stop
+            stop = None
+
+        heap = self.heap
+        heappop = heapq.heappop
+        executed = 0
+        self.running = True
+        try:
+            while heap:
+                if horizon is not None and heap[0][0] > horizon:
+                    break
+                if stop is not None and stop():
+                    break
+                time, _, channel, func, msg = heappop(heap)
+                self.now = time
+                func(msg)
+                executed += 1
+        finally:
+            self.running = False
+            self.delivered += executed
+
+        if horizon is not None and horizon > self.now:
+            self.now = horizon
+        return executed
 
 
 ###############################################################################
@@ -381,6 +1578,122 @@ class Sender(Host):
 # Networks
 #
 ###############################################################################
+class TrafficIndex:
+    """
+    Running traffic aggregates of a network.
+
+    Every aggregate is a [msgs, bytes] list. When a channel is added to the
+    network it gets references to the aggregates it contributes to, and
+    `Channel.transmit` updates them together with its own counters. So all
+    the queries of the statistics module are dictionary lookups, no matter
+    how many channels the network has.
+
+    Broadcasts are not indexed per receiving host, since that would cost
+    O(k) per broadcast. Instead each host knows the multicast channels of
+    the groups it belongs to, and every message of such a channel is one
+    message received by each member.
+    """
+
+    def __init__(self):
+        self.total = [0, 0]
+        self.broadcast = [0, 0]
+        self.by_src = {}
+        self.by_dst = {}
+        self.by_endpoint = {}
+        self.by_type = {}
+        self.multicasts_of = {}
+
+        # [raw bytes, encoded bytes] of the channels with an encoder
+        self.encoded = [0, 0]
+        self.encoded_by_src = {}
+        self.encoded_by_endpoint = {}
+
+    def add_channel(self, channel):
+        """
+        Indexes a channel and connects it to its aggregates.
+
+        :param channel: the channel to be indexed
+        :return: None
+        """
+        buckets = [self.total,
+                   self.by_endpoint.setdefault(channel.endpoint, [0, 0]),
+                   self.by_type.setdefault(type(channel), [0, 0])]
+        if not isinstance(channel, FanInChannel):
+            buckets.append(self.by_src.setdefault(channel.src.nid, [0, 0]))
+
+        if isinstance(channel, MulticastChannel):
+            channel.rx_buckets = (self.broadcast,)
+            for member in channel.dst.members:
+                self.multicasts_of.setdefault(member.nid, []).append(channel)
+        else:
+            buckets.append(self.by_dst.setdefault(channel.dst.nid, [0, 0]))
+
+        channel.buckets = tuple(buckets)
+
+    def add_encoded(self, channel):
+        """
+        Connects a channel with an encoder to the encoded aggregates.
+
+        :param channel: the channel
+        :return: None
+        """
+        if not channel.enc_buckets:
+            buckets = [self.encoded,
+                       self.encoded_by_endpoint.setdefault(channel.endpoint,
+                                                           [0, 0])]
+            if not isinstance(channel, FanInChannel):
+                buckets.append(
+                    self.encoded_by_src.setdefault(channel.src.nid, [0, 0]))
+            channel.enc_buckets = tuple(buckets)
+
+    def rebuild(self, channels):
+        """
+        Recomputes all the aggregates from the counters of the channels.
+
+        The raw bytes of an encoded channel are taken as all its bytes, so
+        channels should not change encoder during a run that is rebuilt.
+
+        :param channels: the channels of the network
+        :return: None
+        """
+        for aggregate in self.aggregates():
+            aggregate[0] = aggregate[1] = 0
+
+        for channel in channels:
+            for bucket in channel.buckets:
+                bucket[0] += channel.msgs
+                bucket[1] += channel.bytes
+            for bucket in channel.enc_buckets:
+                bucket[0] += channel.bytes
+                bucket[1] += channel.enc_bytes
+            if isinstance(channel, MulticastChannel):
+                for bucket in channel.rx_buckets:
+                    bucket[0] += channel.rx_msgs
+                    bucket[1] += channel.rx_bytes
+
+    def aggregates(self):
+        """
+        :return: a list of all the aggregates
+        """
+        aggregates = [self.total, self.broadcast, self.encoded]
+        for index in (self.by_src, self.by_dst, self.by_endpoint,
+                      self.by_type, self.encoded_by_src,
+                      self.encoded_by_endpoint):
+            aggregates.extend(index.values())
+        return aggregates
+
+    def received(self, nid):
+        """
+        :param nid: the id of a host
+        :return: [msgs, bytes] received by the host, broadcasts included
+        """
+        msgs, size = self.by_dst.get(nid, (0, 0))
+        for channel in self.multicasts_of.get(nid, ()):
+            msgs += channel.msgs
+            size += channel.bytes
+        return [msgs, size]
+
+
 class Network:
     """
     A collection of hosts and channels.
@@ -388,13 +1701,31 @@ class Network:
     This class manages the network elements: hosts, groups,
     channels, rpc endpoints.
 
+    Remote calls are executed by the network's dispatcher. By default this
+    is a `FifoDispatcher`, which keeps the stack flat no matter how long a
+    protocol runs.
+
     """
 
-    def __init__(self):
+    def __init__(self, dispatcher=None):
+        """
+        A basic constructor.
+
+        :param dispatcher: the dispatcher of the network (by default a
+            FifoDispatcher)
+        """
         self.protocol = Protocol()
         self.hosts = {}
         self.groups = []
+        self.group_set = set()
         self.channels = []
+        self.counters = ChannelStore()
+        self.traffic = TrafficIndex()
+        # functions called as tap(channel, msg, size, count) after every
+        # send; for a batch msg is the list of messages and count its length
+        self.taps = []
+        self.dispatcher = dispatcher if dispatcher is not None \
+            else FifoDispatcher()
 
     def add_interface(self, ifc, methods):
         """
@@ -444,17 +1775,220 @@ class Network:
             raise TypeError("Interfaces must be added before host "
                             "initialization")
         self.groups.append(g)
+        self.group_set.add(g)
+
+    def add_channel(self, channel):
+        """
+        Adds a channel in the network and indexes its traffic.
+
+        :param channel: the Channel to be added
+        :return: None
+        """
+        self.channels.append(channel)
+        self.traffic.add_channel(channel)
+
+    def transmit(self, channel, msg, size=None):
+        """
+        Accounts a message on a channel and passes it to the taps, like a
+        send does, e.g. for the retransmits of a fault model.
+
+        :param channel: a channel of the network
+        :param msg: the transmitted message
+        :param size: the size of the message, if already known
+        :return: the size of the message
+        """
+        size = channel.transmit(msg, size)
+        for tap in self.taps:
+            tap(channel, msg, size, 1)
+        return size
+
+    def load_counters(self, snapshot):
+        """
+        Overwrites the channel counters with a snapshot and recomputes the
+        traffic aggregates.
+
+        :param snapshot: a snapshot of the counters of the same network
+        :return: None
+        """
+        self.counters.restore(snapshot)
+        self.traffic.rebuild(self.channels)
+
+    def set_counters(self, store):
+        """
+        Moves the channel counters to another store, e.g. a
+        SharedChannelStore (see the shared module).
+
+        The counters of the existing channels are copied to the new store,
+        which must be empty.
+
+        :param store: an empty ChannelStore
+        :return: None
+        """
+        if len(store):
+            raise TypeError("The new counter store is not empty")
+        store.allocate(len(self.counters))
+        store.restore(self.counters.snapshot())
+        for channel in self.channels:
+            channel.store = store
+        self.counters = store
 
     @staticmethod
-    def link(src, dst):
+    def link(src, dst, ifc=None):
         """
         Links two hosts or a host with a host group.
 
         :param src: the source host
         :param dst: the destination host
+        :param ifc: the interface of the link (by default the interface of
+            the source)
         :return: None
         """
-        src.connect_proxy(dst)
+        src.connect_proxy(dst, ifc)
+
+    def link_many(self, srcs, dst, ifc=None):
+        """
+        Links many hosts with the same destination host.
+
+        This is the bulk version of `link`. The remote methods of the
+        destination are looked up once, the counters of all the channels
+        are allocated at once, and the channels of all the sources are
+        indexed in one pass.
+
+        :param srcs: the source hosts (Senders)
+        :param dst: the destination host (not a host group)
+        :param ifc: the interface of the links (by default the interface of
+            every source)
+        :return: None
+        """
+        srcs = list(srcs)
+        if dst in self.group_set:
+            for src in srcs:
+                self.link(src, dst, ifc)
+            return
+
+        by_ifc = {}
+        for src in srcs:
+            proxy = src.open_proxy(dst, ifc)
+            by_ifc.setdefault(proxy.ifc, []).append(proxy)
+
+        traffic = self.traffic
+        channels = self.channels
+        store = self.counters
+        for ifc, proxies in by_ifc.items():
+            specs = self.protocol.interfaces[ifc].specs()
+            methods = [(name, one_way, getattr(dst, name),
+                        getattr(dst, batch_name, None))
+                       for name, one_way, batch_name in specs]
+            per_src = sum(1 if one_way else 2 for _, one_way, _ in specs)
+            cid = store.allocate(per_src * len(proxies))
+
+            # the aggregates that all the new channels share
+            req_shared = [(traffic.by_endpoint.setdefault(name, [0, 0]),
+                           traffic.by_dst.setdefault(dst.nid, [0, 0]))
+                          for name, _, _ in specs]
+            type_bucket = traffic.by_type.setdefault(Channel, [0, 0])
+
+            for proxy in proxies:
+                src = proxy.owner
+                proxy.multicast = False
+                endpoints = proxy.endpoints
+                src_bucket = traffic.by_src.setdefault(src.nid, [0, 0])
+
+                for (name, one_way, send, batch), (ep_bucket, dst_bucket) in \
+                        zip(methods, req_shared):
+                    req_channel = Channel(src, dst, name, store, cid)
+                    req_channel.buckets = (traffic.total, src_bucket,
+                                           ep_bucket, type_bucket, dst_bucket)
+                    channels.append(req_channel)
+                    cid += 1
+                    if one_way:
+                        endpoints[name] = Endpoint(name, send, req_channel,
+                                                   batch_func=batch)
+                    else:
+                        resp_channel = Channel(dst, src, name, store, cid)
+                        traffic.add_channel(resp_channel)
+                        channels.append(resp_channel)
+                        cid += 1
+                        endpoints[name] = Endpoint(name, send, req_channel,
+                                                   resp_channel, batch)
+
+    @property
+    def now(self):
+        """
+        The simulated time of the network.
+
+        Only a `TimedDispatcher` advances the clock; with the other
+        dispatchers it stays at zero.
+        """
+        return self.dispatcher.now
+
+    def set_link_model(self, model, endpoint=None):
+        """
+        Sets the timing model of the network's channels.
+
+        This has to be called after the connections are set up, since it
+        only affects existing channels.
+
+        :param model: a LinkModel, or None for instant delivery
+        :param endpoint: if given only the channels of this endpoint change
+        :return: None
+        """
+        for channel in self.channels:
+            if endpoint is None or channel.endpoint == endpoint:
+                channel.set_model(model)
+
+    def set_faults(self, faults, endpoint=None):
+        """
+        Sets the fault model of the network's channels.
+
+        This has to be called after the connections are set up, since it
+        only affects existing channels.
+
+        :param faults: a FaultModel, or None for reliable delivery
+        :param endpoint: if given only the channels of this endpoint change
+        :return: None
+        """
+        for channel in self.channels:
+            if endpoint is None or channel.endpoint == endpoint:
+                channel.faults = faults
+
+    def set_encoder(self, encoder, endpoint=None):
+        """
+        Sets the encoder of the network's channels, which estimates the
+        size of their messages under a real encoding.
+
+        This has to be called after the connections are set up, since it
+        only affects existing channels.
+
+        :param encoder: an Encoder, or None to stop counting encoded bytes
+        :param endpoint: if given only the channels of this endpoint change
+        :return: None
+        """
+        for channel in self.channels:
+            if endpoint is None or channel.endpoint == endpoint:
+                channel.set_encoder(encoder)
+                if encoder is not None:
+                    self.traffic.add_encoded(channel)
+
+    def run(self, max_events=None):
+        """
+        Executes the messages waiting in the dispatcher.
+
+        :param max_events: stop after that many deliveries (None for all)
+        :return: the number of executed deliveries
+        """
+        return self.dispatcher.run(max_events)
+
+    def run_until(self, stop):
+        """
+        Executes the messages waiting in the dispatcher until `stop()`
+        returns True or there is nothing left to deliver. With a
+        `TimedDispatcher`, `stop` can also be a simulated time.
+
+        :param stop: a callable without arguments, or a simulated time
+        :return: the number of executed deliveries
+        """
+        return self.dispatcher.run_until(stop)
 
 
 class StarNetwork(Network):
@@ -466,15 +2000,17 @@ class StarNetwork(Network):
         coordinator only broadcasts messages to its sites.
     """
 
-    def __init__(self, k, site_type=Sender, coord_type=Sender):
+    def __init__(self, k, site_type=Sender, coord_type=Sender,
+                 dispatcher=None):
         """
         A simple constructor.
 
         :param k: the number of sites
         :param site_type: the type of sites (by default Sender)
         :param coord_type: the type of coordinator (by default Sender)
+        :param dispatcher: the dispatcher of the network
         """
-        super().__init__()
+        super().__init__(dispatcher)
         self.k = k
         self.site_type = site_type
         self.coord_type = coord_type
@@ -500,9 +2036,12 @@ class StarNetwork(Network):
         :return: None
         """
         new_group = HostGroup()
-        for i in range(k):
-            self.sites[i] = self.site_type(net=self, nid=i, ifc=ifc)
-            new_group.join(self.sites[i])
+        site_type = self.site_type
+        sites = self.sites
+        with gc_paused():
+            for i in range(k):
+                site = sites[i] = site_type(net=self, nid=i, ifc=ifc)
+                new_group.join(site)
         self.add_group(new_group)
 
     def setup_connections(self):
@@ -511,6 +2050,6 @@ class StarNetwork(Network):
 
         :return: None
         """
-        for site in self.sites.values():
-            self.link(site, self.coord)
-        self.link(self.coord, self.groups[0])
+        with gc_paused():
+            self.link_many(self.sites.values(), self.coord)
+            self.link(self.coord, self.groups[0])
@@ -0,0 +1,505 @@
+"""
+Coroutine remote methods on an asyncio event loop.
+
+With an `AsyncDispatcher` remote methods may be coroutines, and `send`
+returns an awaitable of the delivery, so a coordinator can wait for the
+replies of its sites and a site can interleave reading its stream with
+protocol work:
+
+    class Coordinator(AsyncSender):
+        async def start(self):
+            while True:
+                counts = await self.gather_async("poll", None)
+                ...
+                await self.sleep(1.0)
+
+    net = StarNetwork(k, coord_type=Coordinator, site_type=Site,
+                      dispatcher=AsyncDispatcher())
+    ...
+    net.dispatcher.spawn(net.coord.start())
+    net.run_until(100.0)
+
+All the hosts run on one event loop whose clock is the simulated time:
+`asyncio.sleep` and the deliveries on channels with a `LinkModel` wait for
+simulated time, and the clock jumps ahead whenever every task waits.
+Deliveries are executed in arrival time order, ties in send order, like
+with a `TimedDispatcher`. The accounting is done by the sender, so it is
+the same as with the other dispatchers.
+
+"""
+import asyncio
+import functools
+import heapq
+import selectors
+
+from components import *
+
+
+###############################################################################
+#
+# Event loop
+#
+###############################################################################
+class SimulatedSelector(selectors.DefaultSelector):
+    """
+    A selector that advances the simulated clock instead of sleeping.
+
+    While blocking calls run in the executor of the dispatcher the clock
+    stands still and the selector waits for them for real, so the calls
+    take no simulated time.
+    """
+
+    def __init__(self, dispatcher):
+        super().__init__()
+        self.dispatcher = dispatcher
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or (timeout is not None and timeout <= 0):
+            return events
+
+        dispatcher = self.dispatcher
+        if dispatcher.io_pending:
+            return super().select(timeout)
+        if timeout is None:
+            # nothing is ready and no timer is set: every task is blocked
+            dispatcher.finish()
+        else:
+            dispatcher.advance(timeout)
+        return []
+
+
+class SimulatedLoop(asyncio.SelectorEventLoop):
+    """
+    An event loop whose clock is the simulated time of a dispatcher.
+    """
+
+    def __init__(self, dispatcher):
+        super().__init__(SimulatedSelector(dispatcher))
+        self.dispatcher = dispatcher
+
+    def time(self):
+        return self.dispatcher.now
+
+
+###############################################################################
+#
+# Dispatcher
+#
+###############################################################################
+class AsyncDispatcher(Dispatcher):
+    """
+    A discrete-event dispatcher that runs remote methods on an event loop.
+
+    A remote method that returns a coroutine is run as a task of the loop.
+    `deliver` returns a future with the result of the remote method, which
+    a coroutine can await. Tasks that do not come from a delivery, e.g. the
+    main loop of a host, are started with `spawn`.
+
+    A run ends when there is nothing left to do: no deliveries, no timers
+    and no runnable tasks. Tasks that still wait for something that never
+    comes are left in `tasks`.
+    """
+
+    def __init__(self, auto_run=True):
+        """
+        A basic constructor.
+
+        :param auto_run: if true the loop is run on every outer send
+        """
+        self.heap = []
+        self.seq = 0
+        self.now = 0.0
+        self.auto_run = auto_run
+        self.running = False
+        self.delivered = 0
+        # the tasks of the loop that have not finished
+        self.tasks = set()
+        # the blocking calls running in the executor
+        self.io_pending = 0
+        self.loop = SimulatedLoop(self)
+        # the future that ends the current run, its stop condition and
+        # its horizon
+        self.done = None
+        self.stop = None
+        self.horizon = None
+        self.error = None
+
+    def deliver(self, channel, func, msg, size=None):
+        if channel.model is not None:
+            if size is None:
+                size = msg_size(msg)
+            time = channel.schedule(self.now, size)
+        else:
+            time = self.now
+        future = self.loop.create_future()
+        self.seq += 1
+        heapq.heappush(self.heap, (time, self.seq, channel, func, msg,
+                                   future))
+        self.loop.call_at(time, self.execute)
+        if self.auto_run and not self.running:
+            self.run()
+        return future
+
+    def pending(self):
+        return len(self.heap)
+
+    def pending_events(self):
+        return [(time, channel, func, msg)
+                for time, _, channel, func, msg, _ in sorted(self.heap)]
+
+    def load_events(self, events):
+        for time, channel, func, msg in events:
+            self.seq += 1
+            heapq.heappush(self.heap, (time, self.seq, channel, func, msg,
+                                       self.loop.create_future()))
+            self.loop.call_at(time, self.execute)
+
+    def execute(self):
+        """
+        Executes the next delivery.
+
+        Every delivery sets a timer at its arrival time, and every timer
+        executes the first delivery of the heap, so deliveries with the
+        same time keep their send order.
+
+        :return: None
+        """
+        heap = self.heap
+        if self.stop is not None and self.stop():
+            # keep the delivery for the next run
+            self.loop.call_at(heap[0][0], self.execute)
+            self.finish()
+            return
+
+        _, _, channel, func, msg, future = heapq.heappop(heap)
+        self.delivered += 1
+        try:
+            result = self.invoke(func, msg)
+        except Exception as error:
+            self.fail(error, future)
+            return
+        if asyncio.iscoroutine(result):
+            self.track(self.loop.create_task(result), future)
+        elif not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def invoke(func, msg):
+        """
+        Calls a remote method, or all the members of a broadcast.
+
+        :return: the result of the remote method, or a coroutine
+        """
+        if isinstance(func, WrappedCall):
+            func.before(msg)
+            result = AsyncDispatcher.invoke(func.func, msg)
+            if asyncio.iscoroutine(result):
+                return finish_call(func, msg, result)
+            func.after(msg)
+            return result
+        if not isinstance(func, GroupCall):
+            return func(msg)
+
+        if not func.supported() or \
+                (func.handler is None and not func.complete):
+            raise TypeError(f"Not every member implements "
+                            f"{func.__name__!r}")
+        if func.handler is not None:
+            return func.handler(func.group, msg)
+
+        pending = []
+        for member_func in func.funcs:
+            result = member_func(msg)
+            if asyncio.iscoroutine(result):
+                pending.append(result)
+        if pending:
+            return gather_all(pending)
+        return None
+
+    def track(self, task, future=None):
+        """
+        Keeps a task until it finishes, and passes its result to a future.
+
+        :return: the task
+        """
+        self.tasks.add(task)
+        task.add_done_callback(functools.partial(self.task_done, future))
+        return task
+
+    def task_done(self, future, task):
+        self.tasks.discard(task)
+        if task.cancelled():
+            if future is not None:
+                future.cancel()
+        elif task.exception() is not None:
+            self.fail(task.exception(), future)
+        elif future is not None and not future.done():
+            future.set_result(task.result())
+
+    def fail(self, error, future=None):
+        """
+        Ends the run with the error of a remote method; the error is raised
+        by `run` and by the awaits of the delivery.
+
+        :return: None
+        """
+        if future is not None and not future.done():
+            future.set_exception(error)
+            # the error is raised by run, awaited or not
+            future.exception()
+        if self.error is None:
+            self.error = error
+        self.finish()
+
+    def finish(self):
+        """
+        Ends the current run.
+
+        :return: None
+        """
+        if self.done is not None and not self.done.done():
+            self.done.set_result(None)
+
+    def advance(self, delay):
+        """
+        Moves the simulated clock forward, up to the horizon of the run.
+
+        :param delay: the time until the next timer
+        :return: None
+        """
+        if self.stop is not None and self.stop():
+            self.finish()
+            return
+        time = self.now + delay
+        if self.horizon is not None and time > self.horizon:
+            self.now = max(self.now, self.horizon)
+            self.finish()
+        else:
+            self.now = time
+
+    def spawn(self, coro):
+        """
+        Starts a coroutine on the loop; it runs with the next run.
+
+        :param coro: a coroutine, e.g. the main loop of a host
+        :return: the task
+        """
+        return self.track(self.loop.create_task(coro))
+
+    def arrival(self, channel, size):
+        """
+        :param channel: the channel of a message sent now
+        :param size: the size of the message
+        :return: a future that is done when the message arrives
+        """
+        future = self.loop.create_future()
+        time = channel.schedule(self.now, size)
+        self.loop.call_at(time, resolve, future)
+        return future
+
+    def run_in_executor(self, func, *args):
+        """
+        Runs a blocking call, e.g. reading a file, in a thread. The
+        simulated clock stands still until it returns.
+
+        :param func: the function
+        :param args: its arguments
+        :return: a future with the result of the call
+        """
+        self.io_pending += 1
+        future = self.loop.run_in_executor(None, func, *args)
+        future.add_done_callback(self.io_done)
+        return future
+
+    def io_done(self, future):
+        self.io_pending -= 1
+
+    def run_until(self, stop):
+        """
+        Runs the loop until `stop` is reached or nothing is left to do.
+
+        :param stop: a callable without arguments that is checked before
+            every delivery and before the clock advances, and returns True
+            to stop, or a simulated time
+        :return: the number of executed deliveries
+        """
+        if self.running:
+            return 0
+
+        horizon = None
+        if stop is not None and not callable(stop):
+            horizon = stop
+            stop = None
+
+        start = self.delivered
+        self.stop = stop
+        self.horizon = horizon
+        self.done = self.loop.create_future()
+        self.running = True
+        try:
+            self.loop.run_until_complete(self.done)
+        finally:
+            self.running = False
+            self.done = None
+            self.stop = None
+            self.horizon = None
+
+        if horizon is not None and horizon > self.now:
+            self.now = horizon
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+        return self.delivered - start
+
+    def close(self):
+        """
+        Cancels the remaining tasks and closes the loop.
+
+        :return: None
+        """
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            self.loop.run_until_complete(
+                asyncio.gather(*self.tasks, return_exceptions=True))
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+
+def resolve(future, result=None):
+    if not future.done():
+        future.set_result(result)
+
+
+async def finish_call(wrapped, msg, coro):
+    """
+    Awaits a wrapped remote method and then runs the end of the wrapper.
+
+    :return: the result of the remote method
+    """
+    result = await coro
+    wrapped.after(msg)
+    return result
+
+
+async def gather_all(coros):
+    """
+    Awaits the coroutines of the members of a broadcast.
+
+    :return: None
+    """
+    await asyncio.gather(*coros)
+
+
+###############################################################################
+#
+# Hosts
+#
+###############################################################################
+class AsyncSender(Sender):
+    """
+    A host with awaitable request/response calls.
+
+    `call_async` and `gather_async` are the coroutine versions of `call`
+    and `gather`: the request and the replies travel on their channels,
+    so they take the simulated time of the link models, and the remote
+    methods may be coroutines. They need an AsyncDispatcher.
+    """
+
+    def sleep(self, delay):
+        """
+        :param delay: a simulated time
+        :return: an awaitable that is done after the delay
+        """
+        return asyncio.sleep(delay)
+
+    async def call_async(self, method: str, msg, to=None):
+        """
+        Calls a remote method that is not one way and awaits its result.
+
+        :param method: the remote method name
+        :param msg: the message
+        :param to: the linked host to call (by default the destination of
+            the first link)
+        :return: the result of the remote method
+        """
+        proxy = self.proxy if to is None else self.proxy_to(to)
+        try:
+            endpoint = proxy.endpoints[method]
+        except KeyError:
+            raise TypeError(f"There is no {method!r} remote method")
+        if endpoint.resp_channel is None or proxy.multicast:
+            raise TypeError(f"{method!r} has no response to a single call")
+
+        dispatcher = self.net.dispatcher
+        taps = self.net.taps
+        size = endpoint.req_channel.transmit(msg)
+        for tap in taps:
+            tap(endpoint.req_channel, msg, size, 1)
+        result = await dispatcher.deliver(endpoint.req_channel,
+                                          endpoint.send, msg, size)
+
+        size = endpoint.resp_channel.transmit(result)
+        for tap in taps:
+            tap(endpoint.resp_channel, result, size, 1)
+        await dispatcher.arrival(endpoint.resp_channel, size)
+        return result
+
+    async def gather_async(self, method: str, msg, to=None):
+        """
+        Polls many hosts with the same message and awaits their replies.
+
+        As with `gather`, the replies of a host group are accounted at once
+        on the FanInChannel of the endpoint, and its group handler
+        `<method>_group` is used if the members have one.
+
+        :param method: the remote method name
+        :param msg: the message
+        :param to: a linked host group, or a list of linked hosts
+        :return: the list of replies, in member order
+        """
+        if isinstance(to, (list, tuple)):
+            return list(await asyncio.gather(
+                *[self.call_async(method, msg, peer) for peer in to]))
+
+        proxy = self.proxy if to is None else self.proxy_to(to)
+        if not proxy.multicast:
+            return [await self.call_async(method, msg, to)]
+        try:
+            endpoint = proxy.endpoints[method]
+        except KeyError:
+            raise TypeError(f"There is no {method!r} remote method")
+        if endpoint.resp_channel is None:
+            raise TypeError(f"{method!r} is a one way method")
+
+        dispatcher = self.net.dispatcher
+        taps = self.net.taps
+        size = endpoint.req_channel.transmit(msg)
+        for tap in taps:
+            tap(endpoint.req_channel, msg, size, 1)
+        await dispatcher.arrival(endpoint.req_channel, size)
+
+        group_call = endpoint.send
+        if not group_call.supported():
+            raise TypeError(f"Not every member implements {method!r}")
+        if group_call.handler is not None:
+            replies = group_call.handler(group_call.group, msg)
+            if asyncio.iscoroutine(replies):
+                replies = await replies
+        else:
+            replies = [func(msg) for func in group_call.funcs]
+            pending = [index for index, reply in enumerate(replies)
+                       if asyncio.iscoroutine(reply)]
+            if pending:
+                results = await asyncio.gather(*[replies[index]
+                                                 for index in pending])
+                for index, result in zip(pending, results):
+                    replies[index] = result
+
+        if len(replies):
+            size = endpoint.resp_channel.transmit_many(replies)
+            for tap in taps:
+                tap(endpoint.resp_channel, replies, size, len(replies))
+            await dispatcher.arrival(endpoint.resp_channel, size)
+        return replies
@@ -0,0 +1,367 @@
+"""
+Cost models of message encodings.
+
+`msg_size` counts every int as INT bytes and every float as FLOAT bytes.
+An encoder estimates how many bytes a message would take under a real
+encoding, e.g. varints or compression, so that the traffic of a protocol
+can be compared with and without it:
+
+    net.set_encoder(ZlibEncoder(sample=0.05))
+    ...
+    print(total_bytes(net), encoded_bytes(net))
+
+An encoder is called by the channel for every message with the raw size of
+the message. Expensive encoders can be given a `sample` rate: only that
+fraction of the messages is encoded, and the size of the others is
+extrapolated from the ratio of encoded to raw bytes seen so far on the same
+endpoint.
+
+"""
+import array
+import bz2
+import lzma
+import math
+import pickle
+import random
+import zlib
+
+from tools import *
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+###############################################################################
+#
+# Base
+#
+###############################################################################
+class Encoder:
+    """
+    Base class of the encoders.
+
+    Subclasses implement `encoded_size`. Stateful encoders, which depend on
+    the previous messages of a channel, also implement `observe` so that
+    the messages that are not sampled still update their state.
+    """
+
+    def __init__(self, sample=1.0, seed=None):
+        """
+        A basic constructor.
+
+        :param sample: the fraction of the messages that are encoded
+        :param seed: the seed of the sampling
+        """
+        if not 0 < sample <= 1:
+            raise TypeError("The sample rate must be in (0, 1]")
+        self.sample = sample
+        self.rng = random.Random(seed)
+        # {endpoint: [raw bytes, encoded bytes]} of the sampled messages
+        self.ratios = {}
+
+    def encoded_size(self, channel, msg, raw):
+        """
+        :param channel: the channel the message is sent on
+        :param msg: the message
+        :param raw: the size of the message by msg_size
+        :return: the size of the encoded message
+        """
+        raise NotImplementedError
+
+    def observe(self, channel, msg):
+        """
+        Called for the messages that are not sampled.
+
+        :param channel: the channel the message is sent on
+        :param msg: the message
+        :return: None
+        """
+        pass
+
+    def __call__(self, channel, msg, raw):
+        """
+        :return: the (exact or extrapolated) encoded size of a message
+        """
+        if self.sample >= 1:
+            return self.encoded_size(channel, msg, raw)
+
+        ratio = self.ratios.get(channel.endpoint)
+        if ratio is None or self.rng.random() < self.sample:
+            size = self.encoded_size(channel, msg, raw)
+            if ratio is None:
+                ratio = self.ratios[channel.endpoint] = [0, 0]
+            ratio[0] += raw
+            ratio[1] += size
+            return size
+
+        self.observe(channel, msg)
+        return round(raw * ratio[1] / ratio[0]) if ratio[0] else raw
+
+    def encode_many(self, channel, msgs, raw):
+        """
+        :param channel: the channel the messages are sent on
+        :param msgs: a list of messages sent as a batch
+        :param raw: the total size of the messages by msg_size
+        :return: the encoded size of the batch
+        """
+        return self(channel, msgs, raw)
+
+
+###############################################################################
+#
+# Number encodings
+#
+###############################################################################
+def varint_size(value):
+    """
+    :param value: an int
+    :return: the bytes of the zigzag varint encoding of the value
+    """
+    zigzag = (value << 1) if value >= 0 else ((-value << 1) - 1)
+    return max(1, (zigzag.bit_length() + 6) // 7)
+
+
+def fixed_int_size(value):
+    """
+    :param value: an int
+    :return: the bytes of the value as a plain int
+    """
+    return INT
+
+
+def varint_sizes(values):
+    """
+    The vectorized varint_size.
+
+    :param values: a NumPy array of ints
+    :return: the total bytes of the zigzag varint encodings of the values
+    """
+    values = values.ravel()
+    if values.dtype.kind == "u":
+        # the zigzag of an unsigned value is twice the value
+        values = values.astype(numpy.uint64)
+        shift = 1
+    else:
+        values = values.astype(numpy.int64)
+        values = ((values << 1) ^ (values >> 63)).view(numpy.uint64)
+        shift = 0
+    total = values.size
+    for groups in range(1, 10):
+        total += int(numpy.count_nonzero(
+            values >= numpy.uint64(1 << (7 * groups - shift))))
+    return total
+
+
+def int_array_size(values, int_size):
+    """
+    :param values: a NumPy array of ints
+    :param int_size: a function of an int that returns its size
+    :return: the total size of the values
+    """
+    if int_size is varint_size:
+        return varint_sizes(values)
+    if int_size is fixed_int_size:
+        return INT * values.size
+    return sum(int_size(int(item)) for item in values.ravel())
+
+
+def value_size(msg, int_size, float_size):
+    """
+    Calculates a size like msg_size, with other sizes for the numbers.
+
+    Like msg_size, only the values of a dict are counted.
+
+    :param msg: the message
+    :param int_size: a function of an int that returns its size
+    :param float_size: the size of a float in bytes (may be fractional)
+    :return: the size, as a float
+    """
+    if isinstance(msg, bool):
+        return 1
+    if isinstance(msg, int):
+        return int_size(msg)
+    if isinstance(msg, float):
+        return float_size
+    if isinstance(msg, (tuple, list)):
+        return sum(value_size(item, int_size, float_size) for item in msg)
+    if isinstance(msg, dict):
+        return sum(value_size(value, int_size, float_size)
+                   for value in msg.values())
+    if isinstance(msg, array.array):
+        if msg.typecode in "fd":
+            return float_size * len(msg)
+        if msg.typecode == "u":
+            return msg_size(msg)
+        if numpy is not None:
+            return int_array_size(
+                numpy.frombuffer(msg, dtype=numpy.dtype(msg.typecode)),
+                int_size)
+        return sum(int_size(item) for item in msg)
+    if numpy is not None and isinstance(msg, numpy.ndarray):
+        if msg.dtype.kind == "f":
+            return float_size * msg.size
+        if msg.dtype.kind in "iu":
+            return int_array_size(msg, int_size)
+    return msg_size(msg)
+
+
+class VarintEncoder(Encoder):
+    """
+    Encodes ints as zigzag varints: 7 bits per byte, so small values take
+    a single byte. Floats and strings keep their msg_size.
+    """
+
+    def encoded_size(self, channel, msg, raw):
+        return math.ceil(value_size(msg, varint_size, FLOAT))
+
+
+class QuantizeEncoder(Encoder):
+    """
+    Encodes floats with fewer bits, e.g. 16 for float16. Ints are encoded
+    as varints if `varint` is true, and keep their msg_size otherwise.
+    """
+
+    def __init__(self, bits=16, varint=False, sample=1.0, seed=None):
+        """
+        A basic constructor.
+
+        :param bits: the bits of an encoded float
+        :param varint: if true ints are encoded as varints
+        :param sample: the fraction of the messages that are encoded
+        :param seed: the seed of the sampling
+        """
+        super().__init__(sample, seed)
+        self.float_size = bits / 8
+        self.int_size = varint_size if varint else fixed_int_size
+
+    def encoded_size(self, channel, msg, raw):
+        return math.ceil(value_size(msg, self.int_size, self.float_size))
+
+
+class DeltaEncoder(Encoder):
+    """
+    Encodes every message as its difference from the previous message of
+    the same channel, with an inner encoder (by default varints).
+
+    Numbers are replaced by their difference, and sequences of numbers
+    with the same length as the previous message by the element-wise
+    differences. Other messages, and the first message of a channel, are
+    encoded whole.
+    """
+
+    def __init__(self, inner=None, sample=1.0, seed=None):
+        """
+        A basic constructor.
+
+        :param inner: the Encoder of the differences (a VarintEncoder by
+            default)
+        :param sample: the fraction of the messages that are encoded
+        :param seed: the seed of the sampling
+        """
+        super().__init__(sample, seed)
+        self.inner = inner if inner is not None else VarintEncoder()
+        # the previous message of every channel id
+        self.last = {}
+
+    @staticmethod
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def delta(self, previous, msg):
+        """
+        :return: the difference of msg from previous, or None if they can
+            not be subtracted
+        """
+        if previous is None:
+            return None
+        if self.is_number(msg) and self.is_number(previous):
+            return msg - previous
+        if isinstance(msg, (tuple, list)) and \
+                isinstance(previous, tuple) and len(msg) == len(previous) and \
+                all(map(self.is_number, msg)) and \
+                all(map(self.is_number, previous)):
+            return [a - b for a, b in zip(msg, previous)]
+        return None
+
+    def observe(self, channel, msg):
+        self.last[channel.cid] = tuple(msg) if isinstance(msg, list) else msg
+
+    def encoded_size(self, channel, msg, raw):
+        delta = self.delta(self.last.get(channel.cid), msg)
+        self.observe(channel, msg)
+        if delta is None:
+            return self.inner.encoded_size(channel, msg, raw)
+        return self.inner.encoded_size(channel, delta, raw)
+
+    def encode_many(self, channel, msgs, raw):
+        # every message is a delta of the one before it in the batch
+        total = 0
+        for msg in msgs:
+            total += self(channel, msg, msg_size(msg))
+        return total
+
+
+###############################################################################
+#
+# Compression
+#
+###############################################################################
+CODECS = {"zlib": lambda data, level: zlib.compress(data, level),
+          "bz2": lambda data, level: bz2.compress(data, level),
+          "lzma": lambda data, level: lzma.compress(data, preset=level)}
+if lz4 is not None:
+    CODECS["lz4"] = lambda data, level: lz4.frame.compress(data, level)
+
+
+class CompressEncoder(Encoder):
+    """
+    Estimates the size of a compressed message.
+
+    The message is serialized (bytes and strings as they are, everything
+    else with pickle) and compressed, and the raw size is scaled by the
+    compression ratio. Batches are compressed as one payload, which is
+    where compression pays off. Compression is expensive, so a `sample`
+    rate is usually given.
+    """
+
+    def __init__(self, codec="zlib", level=6, sample=1.0, seed=None):
+        """
+        A basic constructor.
+
+        :param codec: "zlib", "bz2", "lzma", or "lz4" if lz4 is installed
+        :param level: the compression level
+        :param sample: the fraction of the messages that are encoded
+        :param seed: the seed of the sampling
+        """
+        super().__init__(sample, seed)
+        if codec not in CODECS:
+            raise TypeError(f"There is no {codec!r} codec")
+        self.codec = codec
+        self.compress = CODECS[codec]
+        self.level = level
+
+    @staticmethod
+    def serialize(msg):
+        if isinstance(msg, (bytes, bytearray)):
+            return bytes(msg)
+        if isinstance(msg, str):
+            return msg.encode()
+        return pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+
+    def encoded_size(self, channel, msg, raw):
+        data = self.serialize(msg)
+        if not data:
+            return raw
+        compressed = len(self.compress(data, self.level))
+        return max(1, round(raw * compressed / len(data)))
+
+
+class ZlibEncoder(CompressEncoder):
+    """
+    A CompressEncoder with zlib.
+    """
+
+    def __init__(self, level=6, sample=1.0, seed=None):
+        super().__init__("zlib", level, sample, seed)
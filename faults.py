@@ -0,0 +1,358 @@
+"""
+Lossy network models.
+
+A `FaultModel` decides, for every message sent on the channels it is set
+on, whether the message is lost, duplicated or delivered out of order:
+
+    net.set_faults(FaultModel(drop=BernoulliDrop(0.01), duplicate=0.001,
+                              reorder=0.01, window=4, retransmit=True,
+                              seed=1))
+
+Lost messages are still accounted on their channel, since they were sent.
+With `retransmit` a lost message of a non one way endpoint is sent again
+(and accounted again) until it gets through, and every delivered message
+is acknowledged on the response channel of the endpoint. One way and
+broadcast messages are simply lost.
+
+On a broadcast every member loses the message independently. The members
+that lose it are drawn by geometric skipping, so the cost of a broadcast
+grows with the number of losses and not with the size of the group.
+
+"""
+import math
+import random
+
+from components import *
+
+
+###############################################################################
+#
+# Drop models
+#
+###############################################################################
+class BernoulliDrop:
+    """
+    Every message is lost independently with probability p.
+    """
+
+    def __init__(self, p):
+        """
+        A basic constructor.
+
+        :param p: the loss probability
+        """
+        if not 0 <= p <= 1:
+            raise TypeError("The loss probability must be in [0, 1]")
+        self.p = p
+
+    def loss(self, channel, rng):
+        """
+        :param channel: the channel of the message
+        :param rng: the random generator
+        :return: the loss probability of the next message
+        """
+        return self.p
+
+
+class GilbertElliottDrop:
+    """
+    Bursty losses: every channel is in a good or a bad state, with its own
+    loss probability, and changes state before every message.
+    """
+
+    def __init__(self, p_bad, p_good, loss_good=0.0, loss_bad=1.0):
+        """
+        A basic constructor.
+
+        :param p_bad: the probability to go from the good to the bad state
+        :param p_good: the probability to go from the bad to the good state
+        :param loss_good: the loss probability in the good state
+        :param loss_bad: the loss probability in the bad state
+        """
+        for p in (p_bad, p_good, loss_good, loss_bad):
+            if not 0 <= p <= 1:
+                raise TypeError("The probabilities must be in [0, 1]")
+        self.p_bad = p_bad
+        self.p_good = p_good
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        # the ids of the channels in the bad state
+        self.bad = set()
+
+    def loss(self, channel, rng):
+        cid = channel.cid
+        if cid in self.bad:
+            if rng.random() < self.p_good:
+                self.bad.discard(cid)
+                return self.loss_good
+            return self.loss_bad
+        if rng.random() < self.p_bad:
+            self.bad.add(cid)
+            return self.loss_bad
+        return self.loss_good
+
+
+def geometric_sample(n, p, rng):
+    """
+    Selects every one of n items independently with probability p.
+
+    :param n: the number of items
+    :param p: the probability of every item
+    :param rng: the random generator
+    :return: the sorted indices of the selected items
+    """
+    if p <= 0 or n == 0:
+        return []
+    if p >= 1:
+        return list(range(n))
+    log_q = math.log1p(-p)
+    selected = []
+    index = -1
+    while True:
+        # the number of items skipped before the next selected one
+        index += 1 + int(math.log(1.0 - rng.random()) / log_q)
+        if index >= n:
+            return selected
+        selected.append(index)
+
+
+###############################################################################
+#
+# Fault model
+#
+###############################################################################
+class PartialCall:
+    """
+    A broadcast that only reaches some members of the group.
+
+    A group handler that accepts a mask receives the broadcast once, with
+    the members that lost it masked out; otherwise the remote method of
+    every member that received it is called in turn.
+    """
+
+    __slots__ = ("group_call", "lost", "__name__")
+
+    def __init__(self, group_call, lost):
+        """
+        A basic constructor.
+
+        :param group_call: the GroupCall of the broadcast
+        :param lost: the sorted indices of the members that lost it
+        """
+        self.group_call = group_call
+        self.lost = lost
+        self.__name__ = group_call.__name__
+
+    def mask(self):
+        """
+        :return: a boolean per member, false for the members that lost the
+            broadcast
+        """
+        members = len(self.group_call.group.members)
+        if numpy is not None:
+            mask = numpy.ones(members, dtype=bool)
+            mask[self.lost] = False
+        else:
+            mask = [True] * members
+            for index in self.lost:
+                mask[index] = False
+        return mask
+
+    def __call__(self, msg):
+        group_call = self.group_call
+        supported = group_call.supported()
+        if supported and group_call.masked:
+            group_call.handler(group_call.group, msg, mask=self.mask())
+            return
+        if not supported or not group_call.complete:
+            raise TypeError(f"Not every member implements "
+                            f"{group_call.__name__!r}")
+        funcs = group_call.funcs
+        start = 0
+        for index in self.lost:
+            for func in funcs[start:index]:
+                func(msg)
+            start = index + 1
+        for func in funcs[start:]:
+            func(msg)
+
+
+class FaultModel:
+    """
+    Loss, duplication and reordering of the messages of channels.
+
+    The statistics of every channel are kept in `stats` as
+    [lost, duplicated, reordered, retransmitted, acked] per channel id; a
+    lost broadcast counts once per member that lost it.
+
+    Messages that are held back to be reordered are delivered after up to
+    `window` later messages of the same channel, or by `flush`.
+    """
+
+    LOST, DUPLICATED, REORDERED, RETRANSMITTED, ACKED = range(5)
+
+    def __init__(self, drop=None, duplicate=0.0, reorder=0.0, window=4,
+                 retransmit=False, max_retries=16, ack=True, seed=None):
+        """
+        A basic constructor.
+
+        :param drop: a drop model, e.g. BernoulliDrop(0.01) (None for no
+            losses)
+        :param duplicate: the probability that a message is delivered twice
+        :param reorder: the probability that a message is held back
+        :param window: the most later messages a held message waits for
+        :param retransmit: if true lost messages of non one way endpoints
+            are sent again and delivered messages are acknowledged
+        :param max_retries: the most retransmissions of a message
+        :param ack: the acknowledgement message accounted on the response
+            channel
+        :param seed: the seed of the random generator
+        """
+        for p in (duplicate, reorder):
+            if not 0 <= p <= 1:
+                raise TypeError("The probabilities must be in [0, 1]")
+        self.drop = drop
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.window = window
+        self.retransmit = retransmit
+        self.max_retries = max_retries
+        self.ack = ack
+        self.rng = random.Random(seed)
+        self.stats = {}
+        self.channels = {}
+        # {channel id: [[remaining, channel, func, msg], ...]}
+        self.held = {}
+
+    def stats_of(self, channel):
+        stats = self.stats.get(channel.cid)
+        if stats is None:
+            stats = self.stats[channel.cid] = [0, 0, 0, 0, 0]
+            self.channels[channel.cid] = channel
+        return stats
+
+    def deliver(self, dispatcher, endpoint, msg, size, multicast):
+        """
+        Delivers a message that was sent on the request channel of an
+        endpoint, with the faults of the model. Retransmits and acks are
+        accounted like sends, so the taps of the network see them.
+
+        :param dispatcher: the dispatcher of the network
+        :param endpoint: the Endpoint of the message
+        :param msg: the message
+        :param size: the size of the message, if already known
+        :param multicast: True if the endpoint is a broadcast
+        :return: what the dispatcher returns for the (first) delivery, or
+            None if the message was lost or held back
+        """
+        channel = endpoint.req_channel
+        net = channel.src.net
+        stats = self.stats_of(channel)
+        rng = self.rng
+        func = endpoint.send
+
+        if multicast:
+            if self.drop is not None:
+                members = len(channel.dst.members)
+                lost = geometric_sample(members,
+                                        self.drop.loss(channel, rng), rng)
+                if lost:
+                    stats[self.LOST] += len(lost)
+                    if len(lost) == members:
+                        return None
+                    func = PartialCall(func, lost)
+        else:
+            if self.drop is not None:
+                reliable = self.retransmit and \
+                    endpoint.resp_channel is not None
+                retries = 0
+                while rng.random() < self.drop.loss(channel, rng):
+                    stats[self.LOST] += 1
+                    if not reliable or retries == self.max_retries:
+                        return None
+                    retries += 1
+                    stats[self.RETRANSMITTED] += 1
+                    size = net.transmit(channel, msg, size)
+            if self.retransmit and endpoint.resp_channel is not None:
+                net.transmit(endpoint.resp_channel, self.ack)
+                stats[self.ACKED] += 1
+
+        copies = 1
+        if self.duplicate and rng.random() < self.duplicate:
+            copies = 2
+            stats[self.DUPLICATED] += 1
+        result = self.release(dispatcher, channel, func, msg, size, stats)
+        if copies == 2:
+            self.release(dispatcher, channel, func, msg, size, stats)
+        return result
+
+    def release(self, dispatcher, channel, func, msg, size, stats):
+        """
+        Delivers a message, or holds it back, and delivers the held
+        messages of the channel whose turn came.
+
+        :return: what the dispatcher returns for the delivery, or None if
+            the message was held back
+        """
+        held = self.held.get(channel.cid)
+        if self.reorder and self.window and \
+                self.rng.random() < self.reorder:
+            stats[self.REORDERED] += 1
+            if held is None:
+                held = self.held[channel.cid] = []
+            held.append([self.rng.randint(1, self.window), channel, func,
+                         msg])
+            return None
+
+        result = dispatcher.deliver(channel, func, msg, size)
+        if held:
+            due = []
+            for entry in held:
+                entry[0] -= 1
+                if entry[0] <= 0:
+                    due.append(entry)
+            if due:
+                held[:] = [entry for entry in held if entry[0] > 0]
+                for _, channel, func, msg in due:
+                    dispatcher.deliver(channel, func, msg)
+        return result
+
+    def flush(self, dispatcher):
+        """
+        Delivers all the held messages.
+
+        :param dispatcher: the dispatcher of the network
+        :return: the number of delivered messages
+        """
+        delivered = 0
+        for held in self.held.values():
+            entries = held[:]
+            held.clear()
+            for _, channel, func, msg in entries:
+                dispatcher.deliver(channel, func, msg)
+                delivered += 1
+        return delivered
+
+    def totals(self):
+        """
+        :return: a dict with the sum of every statistic
+        """
+        names = ("lost", "duplicated", "reordered", "retransmitted", "acked")
+        totals = dict.fromkeys(names, 0)
+        for stats in self.stats.values():
+            for name, value in zip(names, stats):
+                totals[name] += value
+        return totals
+
+    def by_endpoint(self):
+        """
+        :return: a dict {endpoint: [lost, duplicated, reordered,
+            retransmitted, acked]}
+        """
+        result = {}
+        for cid, stats in self.stats.items():
+            endpoint = self.channels[cid].endpoint
+            total = result.setdefault(endpoint, [0, 0, 0, 0, 0])
+            for i, value in enumerate(stats):
+                total[i] += value
+        return result
@@ -0,0 +1,340 @@
+"""
+Read-only message payloads.
+
+Every send hands the same object to the receivers, so a receiver that
+keeps a message, or a sender that keeps changing the object it sent, can
+see the other side's changes. Instead of copying the messages, they can be
+frozen: buffers become read-only views of the same memory and containers
+become immutable, without copying the numbers:
+
+    net.dispatcher = PayloadDispatcher(net.dispatcher)
+
+freezes every message on its way to the receivers. With `debug=True` it
+also takes a digest of every message when it is sent and checks it when
+the message is delivered and after the receiver returns, so a mutation of
+a payload is reported at the delivery where it happened:
+
+    net.dispatcher = PayloadDispatcher(net.dispatcher, frozen=False,
+                                       debug=True)
+
+Frozen messages have the same size as the messages they were made of, so
+the accounting does not change.
+
+"""
+import array
+import hashlib
+
+from components import *
+
+
+###############################################################################
+#
+# Frozen containers
+#
+###############################################################################
+class FrozenDict(dict):
+    """
+    A dict that can not be changed. It is a dict for everything else,
+    including msg_size.
+    """
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("A frozen message can not be changed")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+    def __repr__(self):
+        return f"FrozenDict({dict.__repr__(self)})"
+
+
+class FrozenArray:
+    """
+    A read-only view of the memory of an array.array, without a copy.
+    """
+
+    __slots__ = ("view", "typecode")
+
+    def __init__(self, source, typecode=None):
+        """
+        A basic constructor.
+
+        :param source: an array.array, or a memoryview with typecode
+        :param typecode: the typecode of a memoryview source
+        """
+        self.view = memoryview(source).toreadonly()
+        self.typecode = source.typecode if typecode is None else typecode
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)(self.view[index], self.typecode)
+        return self.view[index]
+
+    def __iter__(self):
+        return iter(self.view)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def tolist(self):
+        return self.view.tolist()
+
+    def numpy(self):
+        """
+        :return: a read-only NumPy array on the same memory
+        """
+        return numpy.frombuffer(self.view, dtype=numpy.dtype(self.typecode))
+
+    def __reduce__(self):
+        return FrozenArray, (array.array(self.typecode, self.view),)
+
+
+class FrozenBytes(FrozenArray):
+    """
+    A read-only view of the memory of a bytearray or memoryview, without a
+    copy. Unlike a memoryview, it can be pickled with a checkpoint.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, source, typecode="B"):
+        super().__init__(memoryview(source).cast("B"), typecode)
+
+    def tobytes(self):
+        return self.view.tobytes()
+
+    def __reduce__(self):
+        return FrozenBytes, (self.view.tobytes(),)
+
+
+def _frozen_array_size(msg):
+    if msg.typecode in "fd":
+        return FLOAT * len(msg)
+    if msg.typecode == "u":
+        return CHAR * len(msg)
+    return INT * len(msg)
+
+
+def _frozen_bytes_size(msg):
+    return CHAR * len(msg)
+
+
+register_sizer(FrozenArray, _frozen_array_size)
+register_sizer(FrozenBytes, _frozen_bytes_size)
+
+
+def freeze(msg):
+    """
+    Makes a message read-only without copying its buffers.
+
+    NumPy arrays become read-only views, arrays FrozenArrays, bytearrays
+    and memoryviews FrozenBytes, lists tuples and dicts
+    FrozenDicts; the items of containers are frozen too. Other objects are
+    returned as they are.
+
+    :param msg: the message
+    :return: the frozen message, with the same msg_size
+    """
+    cls = type(msg)
+    if cls in (int, float, str, bytes, bool) or msg is None:
+        return msg
+    if cls is tuple or cls is list:
+        items = tuple(freeze(item) for item in msg)
+        if cls is tuple and all(a is b for a, b in zip(items, msg)):
+            return msg
+        return items
+    if isinstance(msg, dict):
+        if cls is FrozenDict and all(freeze(value) is value
+                                     for value in msg.values()):
+            return msg
+        return FrozenDict((key, freeze(value)) for key, value in msg.items())
+    if cls is array.array:
+        return FrozenArray(msg)
+    if cls is bytearray or cls is memoryview:
+        return FrozenBytes(msg)
+    if numpy is not None and isinstance(msg, numpy.ndarray):
+        if not msg.flags.writeable:
+            return msg
+        view = msg.view()
+        view.flags.writeable = False
+        return view
+    return msg
+
+
+###############################################################################
+#
+# Digests
+#
+###############################################################################
+def _feed(h, msg):
+    cls = type(msg)
+    h.update(cls.__name__.encode())
+    if cls in (int, float, str, bool) or msg is None:
+        h.update(repr(msg).encode())
+    elif isinstance(msg, (bytes, bytearray, memoryview, array.array)):
+        h.update(memoryview(msg).cast("B") if not isinstance(msg, bytes)
+                 else msg)
+    elif isinstance(msg, FrozenArray):
+        h.update(msg.view.cast("B"))
+    elif numpy is not None and isinstance(msg, numpy.ndarray):
+        h.update(repr((msg.shape, msg.dtype.str)).encode())
+        h.update(numpy.ascontiguousarray(msg).data.cast("B"))
+    elif isinstance(msg, (tuple, list)):
+        h.update(len(msg).to_bytes(8, "little"))
+        for item in msg:
+            _feed(h, item)
+    elif isinstance(msg, dict):
+        h.update(len(msg).to_bytes(8, "little"))
+        for key, value in msg.items():
+            _feed(h, key)
+            _feed(h, value)
+    elif hasattr(msg, "__dict__"):
+        _feed(h, vars(msg))
+    elif hasattr(cls, "__slots__"):
+        _feed(h, [getattr(msg, name, None) for name in cls.__slots__])
+    else:
+        h.update(repr(msg).encode())
+
+
+def digest(msg):
+    """
+    :param msg: a message
+    :return: a digest of the contents of the message
+    """
+    h = hashlib.blake2b(digest_size=16)
+    _feed(h, msg)
+    return h.digest()
+
+
+###############################################################################
+#
+# Dispatcher
+#
+###############################################################################
+class CheckedCall(WrappedCall):
+    """
+    A remote method that checks the digest of its message before and after
+    it runs.
+    """
+
+    __slots__ = ("channel", "expected")
+
+    def __init__(self, func, channel, expected):
+        super().__init__(func)
+        self.channel = channel
+        self.expected = expected
+
+    def check(self, msg, when):
+        if digest(msg) != self.expected:
+            raise TypeError(f"The payload of {self.channel.endpoint!r} was "
+                            f"changed {when}")
+
+    def before(self, msg):
+        self.check(msg, "between its send and its delivery")
+
+    def after(self, msg):
+        self.check(msg, "by its receiver")
+
+
+class PayloadDispatcher(Dispatcher):
+    """
+    Wraps the dispatcher of a network to freeze and check the payloads.
+
+    Messages are still passed by reference: a frozen message is frozen
+    once at the send and the same object reaches every member of a
+    broadcast. With `retain`, the debug mode also keeps every message and
+    its digest, so that `verify` finds the messages that were changed after
+    their delivery. `Sender.call` and `Sender.gather` do not go through the
+    dispatcher, so their messages are not frozen.
+    """
+
+    def __init__(self, inner, frozen=True, debug=False, retain=False):
+        """
+        A basic constructor.
+
+        :param inner: the dispatcher that delivers the messages
+        :param frozen: if true every message is frozen
+        :param debug: if true the digests of the messages are checked
+        :param retain: if true (with debug) every message is kept for
+            `verify`
+        """
+        self.inner = inner
+        self.frozen = frozen
+        self.debug = debug
+        self.retain = retain
+        # (channel, msg, digest) of the sent messages, with retain
+        self.sent = []
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    @property
+    def now(self):
+        return self.inner.now
+
+    @now.setter
+    def now(self, value):
+        self.inner.now = value
+
+    def prepare(self, channel, func, msg):
+        """
+        :return: the function and the message to deliver
+        """
+        if self.frozen:
+            msg = freeze(msg)
+        if self.debug:
+            expected = digest(msg)
+            func = CheckedCall(func, channel, expected)
+            if self.retain:
+                self.sent.append((channel, msg, expected))
+        return func, msg
+
+    def deliver(self, channel, func, msg, size=None):
+        func, msg = self.prepare(channel, func, msg)
+        return self.inner.deliver(channel, func, msg, size)
+
+    def broadcast(self, channel, group_call, msg, size=None):
+        func, msg = self.prepare(channel, group_call, msg)
+        return self.inner.broadcast(channel, func, msg, size)
+
+    def deliver_many(self, channel, func, msgs):
+        for msg in msgs:
+            self.deliver(channel, func, msg)
+
+    def pending(self):
+        return self.inner.pending()
+
+    def pending_events(self):
+        return [(time, channel, getattr(func, "func", func), msg)
+                for time, channel, func, msg in self.inner.pending_events()]
+
+    def load_events(self, events):
+        self.inner.load_events([(time, channel,
+                                 *self.prepare(channel, func, msg))
+                                for time, channel, func, msg in events])
+
+    def run(self, max_events=None):
+        return self.inner.run(max_events)
+
+    def run_until(self, stop):
+        return self.inner.run_until(stop)
+
+    def verify(self):
+        """
+        Checks that no retained message was changed since it was sent.
+
+        :return: the number of checked messages
+        """
+        for channel, msg, expected in self.sent:
+            if digest(msg) != expected:
+                raise TypeError(f"A payload of {channel.endpoint!r} was "
+                                f"changed after it was sent")
+        return len(self.sent)
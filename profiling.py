@@ -0,0 +1,384 @@
+"""
+Opt-in profiling of the hot paths of a network.
+
+A `Profiler` measures where the wall time of a simulation goes: in the
+remote methods (handlers) of every endpoint, in the proxy dispatch of
+`Sender.send`, and in `msg_size`. Nothing in the simulator is changed for
+it: while the profiler is enabled the endpoint functions, the send methods
+of the hosts and `msg_size` are replaced by timed wrappers, and disabling
+it puts the originals back, so a network that is not profiled runs
+exactly the same code as before.
+
+    with Profiler(net) as profiler:
+        net.coord.send("call", 0)
+    print(profiler.report())
+
+"""
+import time
+
+import components
+from components import *
+
+
+###############################################################################
+#
+# Measurements
+#
+###############################################################################
+class CallStats:
+    """
+    The measurements of a profiled function.
+
+    `total` is the inclusive wall time, `own` excludes the time of the
+    profiled functions called from it (e.g. handlers that a send runs
+    directly), and `sizing` is the time spent in msg_size on its behalf.
+    """
+
+    __slots__ = ("calls", "total", "own", "sizing", "sizing_calls", "times")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.sizing = 0.0
+        self.sizing_calls = 0
+        self.times = Histogram()
+
+    def add(self, elapsed, own):
+        self.calls += 1
+        self.total += elapsed
+        self.own += own
+        self.times.add(elapsed)
+
+    def merge(self, other):
+        """
+        Adds the measurements of another CallStats.
+
+        :param other: a CallStats
+        :return: None
+        """
+        self.calls += other.calls
+        self.total += other.total
+        self.own += other.own
+        self.sizing += other.sizing
+        self.sizing_calls += other.sizing_calls
+        self.times.count += other.times.count
+        self.times.total += other.times.total
+        for index, count in other.times.buckets.items():
+            self.times.buckets[index] = self.times.buckets.get(index, 0) + \
+                count
+        for attr, pick in (("min", min), ("max", max)):
+            value = getattr(other.times, attr)
+            if value is not None:
+                mine = getattr(self.times, attr)
+                setattr(self.times, attr,
+                        value if mine is None else pick(mine, value))
+
+    def as_dict(self):
+        return {"calls": self.calls,
+                "total": self.total,
+                "own": self.own,
+                "sizing": self.sizing,
+                "sizing_calls": self.sizing_calls,
+                "mean": self.times.mean(),
+                "p50": self.times.percentile(50),
+                "p99": self.times.percentile(99),
+                "max": self.times.max or 0.0}
+
+
+class TimedGroupCall(GroupCall):
+    """
+    A GroupCall whose deliveries and replies are measured.
+
+    It resolves the members like the GroupCall it wraps, so dispatchers
+    that read the handlers of a GroupCall keep working.
+    """
+
+    __slots__ = ("timed_call", "timed_replies")
+
+    def __init__(self, group_call, timed_call, timed_replies):
+        """
+        A basic constructor.
+
+        :param group_call: the wrapped GroupCall
+        :param timed_call: the timed wrapper of the GroupCall
+        :param timed_replies: the timed wrapper of its replies method
+        """
+        super().__init__(group_call.group, group_call.__name__)
+        self.timed_call = timed_call
+        self.timed_replies = timed_replies
+
+    def replies(self, msg):
+        return self.timed_replies(msg)
+
+    def __call__(self, msg):
+        return self.timed_call(msg)
+
+
+###############################################################################
+#
+# Profiler
+#
+###############################################################################
+class Profiler:
+    """
+    Collects per-endpoint and per-host timings of a network.
+
+    Measurements are kept per (kind, endpoint, host) where kind is
+    "handler" for the execution of a remote method on the receiving host,
+    and "send" for `Sender.send`/`send_batch` on the sending host.
+    Handlers of broadcast endpoints are accounted to the host "group".
+
+    Only the hosts and endpoints that exist when the profiler is enabled
+    are instrumented; hosts are named by their key in `net.hosts`, or by
+    their nid. While it is enabled `components.msg_size` is
+    replaced too, so sizing in other networks is measured as well (and
+    accounted to no endpoint).
+    """
+
+    def __init__(self, net, clock=time.perf_counter):
+        """
+        A basic constructor.
+
+        :param net: the network to profile
+        :param clock: a function that returns the current time in seconds
+        """
+        self.net = net
+        self.clock = clock
+        self.stats = {}
+        # an entry [stats, time of the profiled calls below] per active call
+        self.stack = []
+        # sizing outside every profiled call
+        self.unattributed = CallStats()
+        self.enabled = False
+        self.saved = []
+
+    def stats_of(self, key):
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = CallStats()
+        return stats
+
+    def timed(self, key, func):
+        """
+        Wraps a function so that its calls are measured.
+
+        :param key: the key of the measurements
+        :param func: the function
+        :return: the wrapper
+        """
+        stats = self.stats_of(key)
+        clock = self.clock
+        stack = self.stack
+
+        def wrapper(*args):
+            frame = [stats, 0.0]
+            stack.append(frame)
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                elapsed = clock() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                stats.add(elapsed, elapsed - frame[1])
+
+        # the dispatchers read these attributes of the remote methods
+        wrapper.__name__ = getattr(func, "__name__", key[1])
+        if hasattr(func, "supported"):
+            wrapper.supported = func.supported
+        return wrapper
+
+    def timed_remote(self, key, func):
+        """
+        Wraps a remote method so that its calls are measured. A GroupCall
+        stays a GroupCall, so that the dispatchers and `Sender.gather` can
+        still read its handlers.
+
+        :param key: the key of the measurements
+        :param func: the remote method
+        :return: the wrapper
+        """
+        if isinstance(func, GroupCall):
+            return TimedGroupCall(func, self.timed(key, func),
+                                  self.timed(key, func.replies))
+        return self.timed(key, func)
+
+    def timed_size(self, func):
+        """
+        Wraps msg_size so that its time is accounted to the active call.
+
+        :param func: the msg_size function
+        :return: the wrapper
+        """
+        clock = self.clock
+        stack = self.stack
+        unattributed = self.unattributed
+
+        def wrapper(msg):
+            start = clock()
+            size = func(msg)
+            elapsed = clock() - start
+            if stack:
+                frame = stack[-1]
+                frame[1] += elapsed
+                stats = frame[0]
+            else:
+                stats = unattributed
+            stats.sizing += elapsed
+            stats.sizing_calls += 1
+            return size
+
+        return wrapper
+
+    ###########################################################################
+    # instrumentation
+
+    def enable(self):
+        """
+        Replaces the hot paths of the network with timed wrappers.
+
+        :return: None
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        names = {id(host): name for name, host in self.net.hosts.items()}
+
+        def host_name(host):
+            if isinstance(host, HostGroup):
+                return "group"
+            return names.get(id(host), host.nid)
+
+        # every host that sends is the source of some channel
+        senders = {}
+        for channel in self.net.channels:
+            if getattr(channel.src, "proxy", None) is not None:
+                senders.setdefault(id(channel.src), channel.src)
+
+        for host in senders.values():
+            name = host_name(host)
+            for proxy in host.all_proxies():
+                receiver = host_name(proxy.proxied)
+                for method, endpoint in proxy.endpoints.items():
+                    key = ("handler", method, receiver)
+                    self.saved.append((endpoint, "send", endpoint.send))
+                    endpoint.send = self.timed_remote(key, endpoint.send)
+                    if endpoint.send_batch is not None:
+                        self.saved.append((endpoint, "send_batch",
+                                           endpoint.send_batch))
+                        endpoint.send_batch = self.timed_remote(
+                            key, endpoint.send_batch)
+
+            # the instance attributes shadow Sender.send until disabled
+            for attr in ("send", "send_batch"):
+                self.saved.append((host, attr, None))
+            host.send = self.timed_send(name, host, type(host).send)
+            host.send_batch = self.timed_send(name, host,
+                                              type(host).send_batch)
+
+        self.saved.append((components, "msg_size", components.msg_size))
+        components.msg_size = self.timed_size(components.msg_size)
+
+    def timed_send(self, name, host, func):
+        """
+        :return: a send method of the host that is measured per endpoint
+        """
+        wrappers = {}
+
+        def send(method, msg, to=None):
+            wrapper = wrappers.get(method)
+            if wrapper is None:
+                wrapper = wrappers[method] = self.timed(
+                    ("send", method, name),
+                    lambda msg, to: func(host, method, msg, to))
+            return wrapper(msg, to)
+
+        return send
+
+    def disable(self):
+        """
+        Puts back the original functions.
+
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        for obj, attr, original in reversed(self.saved):
+            if original is None:
+                vars(obj).pop(attr, None)
+            else:
+                setattr(obj, attr, original)
+        self.saved = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def reset(self):
+        """
+        Drops the measurements so far.
+
+        :return: None
+        """
+        for stats in self.stats.values():
+            stats.__init__()
+        self.unattributed = CallStats()
+
+    ###########################################################################
+    # results
+
+    def aggregate(self, by):
+        """
+        :param by: "endpoint" or "host"
+        :return: a dict {(kind, endpoint or host): CallStats}
+        """
+        index = 1 if by == "endpoint" else 2
+        result = {}
+        for key, stats in self.stats.items():
+            group = (key[0], key[index])
+            if group not in result:
+                result[group] = CallStats()
+            result[group].merge(stats)
+        return result
+
+    def top(self, by="endpoint", n=10, metric="own"):
+        """
+        :param by: "endpoint" or "host"
+        :param n: the number of entries
+        :param metric: the CallStats attribute to sort by
+        :return: the n most expensive (kind, name, CallStats)
+        """
+        entries = [(kind, name, stats)
+                   for (kind, name), stats in self.aggregate(by).items()
+                   if stats.calls]
+        entries.sort(key=lambda entry: getattr(entry[2], metric),
+                     reverse=True)
+        return entries[:n]
+
+    def report(self, n=10, metric="own"):
+        """
+        :param n: the number of entries of every table
+        :param metric: the CallStats attribute to sort by
+        :return: a text report of the most expensive endpoints and hosts
+        """
+        lines = []
+        header = (f"{'kind':<8} {'name':<16} {'calls':>9} {'total(s)':>10} "
+                  f"{'own(s)':>10} {'sizing(s)':>10} {'mean(us)':>9} "
+                  f"{'p99(us)':>9}")
+        for by in ("endpoint", "host"):
+            lines.append(f"Top {by}s by {metric}")
+            lines.append(header)
+            for kind, name, stats in self.top(by, n, metric):
+                lines.append(f"{kind:<8} {str(name):<16} {stats.calls:>9} "
+                             f"{stats.total:>10.4f} {stats.own:>10.4f} "
+                             f"{stats.sizing:>10.4f} "
+                             f"{stats.times.mean() * 1e6:>9.1f} "
+                             f"{stats.times.percentile(99) * 1e6:>9.1f}")
+            lines.append("")
+        return "\n".join(lines)
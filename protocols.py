@@ -0,0 +1,590 @@
+"""
+Continuous distributed monitoring protocols.
+
+Every protocol is a `StarNetwork` whose sites read a stream and whose
+coordinator continuously tracks a function of the union of the streams:
+
+    net = CountingNetwork(k=100, eps=0.05)
+    driver = StreamDriver(net, source, round_robin(100))
+    net.feed_stream(driver)
+    print(net.estimate(), net.communication())
+
+The local state of the sites is kept in the columns of a `GroupState`, so
+`feed` can apply a whole chunk of the stream with a few array operations
+and check the local conditions of all the sites at once ("drift checks");
+only the sites whose condition fails then run their Python handler, which
+sends the messages. Items can also be given to a single site with its
+`update` method, which checks its condition after every item. Feeding a
+chunk checks the conditions once per chunk, so it may send fewer messages
+than feeding the same items one by one, with the same error guarantee.
+
+"""
+import collections
+import heapq
+import math
+import operator
+
+from components import *
+from statistics import *
+from tools import *
+
+
+###############################################################################
+#
+# Base
+#
+###############################################################################
+class MonitoringNetwork(StarNetwork):
+    """
+    A star network that runs a monitoring protocol.
+
+    Subclasses give the site and coordinator types in SITE and COORD, their
+    interfaces in SITE_IFC and COORD_IFC, and the columns of the site state
+    in `columns`.
+    """
+
+    SITE = None
+    COORD = None
+    SITE_IFC = {}
+    COORD_IFC = {}
+
+    def __init__(self, k, dispatcher=None):
+        """
+        Builds the network, its connections and the state of the sites.
+
+        :param k: the number of sites
+        :param dispatcher: the dispatcher of the network
+        """
+        super().__init__(k, site_type=remote_class("site")(self.SITE),
+                         coord_type=remote_class("coord")(self.COORD),
+                         dispatcher=dispatcher)
+        self.add_interface("coord", self.COORD_IFC)
+        self.add_interface("site", self.SITE_IFC)
+        self.add_sites(k, "coord")
+        self.add_coord("site")
+        self.setup_connections()
+
+        self.state = GroupState(self.groups[0])
+        for name, (value, typecode) in self.columns().items():
+            self.state.add_column(name, value, typecode)
+
+    def columns(self):
+        """
+        :return: a dict {name: (initial value, typecode)} with the columns
+            of the site state
+        """
+        return {}
+
+    def feed(self, pairs):
+        """
+        Gives a chunk of the stream to the sites.
+
+        :param pairs: a list of (site id, item) pairs
+        :return: None
+        """
+        sites = self.sites
+        for sid, item in pairs:
+            sites[sid].update(item)
+
+    def feed_stream(self, driver):
+        """
+        Feeds all the items of a stream driver, a chunk at a time.
+
+        :param driver: a StreamDriver of this network
+        :return: the number of items fed
+        """
+        fed = 0
+        for chunk in driver.chunks():
+            self.feed(chunk)
+            self.run()
+            fed += len(chunk)
+        return fed
+
+    def communication(self):
+        """
+        :return: a dict with the traffic of the protocol: the totals and
+            the messages of every remote method
+        """
+        report = {"msgs": total_msgs(self),
+                  "bytes": total_bytes(self),
+                  "broadcast_msgs": broadcast_msgs(self),
+                  "broadcast_bytes": broadcast_bytes(self)}
+        for name in list(self.COORD_IFC) + list(self.SITE_IFC):
+            report[name + "_msgs"] = endpoint_msgs(self, name)
+        return report
+
+
+def vectorized(column):
+    """
+    :param column: a column of a GroupState
+    :return: True if the column can be updated with array operations
+    """
+    return numpy is not None and isinstance(column, numpy.ndarray)
+
+
+def group_network(group):
+    """
+    :param group: a host group
+    :return: the network of its members
+    """
+    return next(iter(group.members)).net
+
+
+def site_ids(pairs):
+    """
+    :param pairs: a list of (site id, item) pairs
+    :return: the site ids (a NumPy array if NumPy is installed)
+    """
+    if numpy is not None:
+        return numpy.fromiter((sid for sid, _ in pairs), dtype=numpy.int64,
+                              count=len(pairs))
+    return [sid for sid, _ in pairs]
+
+
+###############################################################################
+#
+# Counting
+#
+###############################################################################
+class CountingSite(Sender):
+    """
+    A site that counts its items and reports them to the coordinator in
+    batches of `slack` items.
+    """
+
+    def update(self, item):
+        unreported = self.net.state["unreported"]
+        unreported[self.nid] += 1
+        self.check_count()
+
+    def check_count(self):
+        """
+        Reports the unreported items if there are at least `slack`.
+
+        :return: None
+        """
+        state = self.net.state
+        nid = self.nid
+        unreported = int(state["unreported"][nid])
+        if unreported >= state["slack"][nid]:
+            state["unreported"][nid] = 0
+            self.send("count", unreported)
+
+    def slack(self, msg):
+        self.net.state["slack"][self.nid] = msg
+
+    @classmethod
+    def slack_group(cls, group, msg, mask=None):
+        group.state.fill("slack", msg, mask)
+
+
+class CountingCoordinator(Sender):
+    """
+    Tracks the number of items of all the sites.
+
+    The estimate misses less than `slack` items of every site. Every time
+    the estimate doubles, the coordinator starts a round with the slack
+    eps * estimate / k, so the estimate is always within eps of the count.
+    """
+
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.estimate = 0
+        # the estimate at the start of the round
+        self.round_start = 0
+        self.current_slack = 1
+        self.rounds = 0
+
+    def count(self, msg):
+        self.estimate += msg
+        if self.estimate >= 2 * self.round_start:
+            self.round_start = self.estimate
+            slack = max(1, int(self.net.eps * self.estimate / self.net.k))
+            if slack != self.current_slack:
+                self.current_slack = slack
+                self.rounds += 1
+                self.send("slack", slack)
+
+
+class CountingNetwork(MonitoringNetwork):
+    """
+    Distributed counting: the coordinator knows the number of items of
+    all the streams within a relative error eps, with O(k / eps * log n)
+    messages.
+    """
+
+    SITE = CountingSite
+    COORD = CountingCoordinator
+    SITE_IFC = {"slack": True}
+    COORD_IFC = {"count": True}
+
+    def __init__(self, k, eps=0.1, dispatcher=None):
+        """
+        A simple constructor.
+
+        :param k: the number of sites
+        :param eps: the relative error of the count
+        :param dispatcher: the dispatcher of the network
+        """
+        if not 0 < eps < 1:
+            raise TypeError("eps must be in (0, 1)")
+        self.eps = eps
+        super().__init__(k, dispatcher)
+
+    def columns(self):
+        return {"unreported": (0, "q"), "slack": (1, "q")}
+
+    def estimate(self):
+        """
+        :return: the estimated number of items
+        """
+        return self.coord.estimate
+
+    def feed(self, pairs):
+        if not pairs:
+            return
+        unreported = self.state["unreported"]
+        slack = self.state["slack"]
+        if vectorized(unreported):
+            unreported += numpy.bincount(site_ids(pairs), minlength=self.k)
+            due = numpy.flatnonzero(unreported >= slack).tolist()
+        else:
+            for sid, _ in pairs:
+                unreported[sid] += 1
+            due = sorted(sid for sid in {sid for sid, _ in pairs}
+                         if unreported[sid] >= slack[sid])
+        sites = self.sites
+        for sid in due:
+            sites[sid].check_count()
+
+
+###############################################################################
+#
+# Geometric monitoring
+#
+###############################################################################
+class GeometricSite(Sender):
+    """
+    A site with a local vector, its latest reading.
+
+    The columns x<j> hold the reading, s<j> the reading at the last
+    synchronization and e<j> the global estimate of that synchronization.
+    """
+
+    def update(self, item):
+        state = self.net.state
+        nid = self.nid
+        for name, value in zip(self.net.x_names, item):
+            state[name][nid] = value
+        self.check_ball()
+
+    def violates(self):
+        """
+        Checks the local condition of geometric monitoring: the ball with
+        diameter from the estimate e to the drift vector e + x - s must lie
+        on the same side of the threshold surface as e.
+
+        :return: True if the ball crosses the threshold surface
+        """
+        net = self.net
+        state = net.state
+        nid = self.nid
+        center = radius = norm = 0.0
+        for x_name, s_name, e_name in net.names:
+            e = state[e_name][nid]
+            drift = state[x_name][nid] - state[s_name][nid]
+            center += (e + drift / 2) ** 2
+            radius += drift * drift
+            norm += e * e
+        center = math.sqrt(center)
+        radius = math.sqrt(radius) / 2
+        if math.sqrt(norm) >= net.threshold:
+            return center - radius < net.threshold
+        return center + radius >= net.threshold
+
+    def check_ball(self):
+        """
+        Reports a violation of the local condition to the coordinator.
+
+        :return: None
+        """
+        if self.violates():
+            self.send("violation",
+                      (self.nid, int(self.net.state["round"][self.nid])))
+
+    def collect(self, msg):
+        state = self.net.state
+        return tuple(float(state[name][self.nid])
+                     for name in self.net.x_names)
+
+    @classmethod
+    def collect_group(cls, group, msg):
+        net = group_network(group)
+        columns = [group.state[name] for name in net.x_names]
+        if columns and vectorized(columns[0]):
+            columns = [column.tolist() for column in columns]
+        return list(zip(*columns))
+
+    def estimate(self, msg):
+        number, vector = msg
+        state = self.net.state
+        nid = self.nid
+        for (x_name, s_name, e_name), value in zip(self.net.names, vector):
+            state[s_name][nid] = state[x_name][nid]
+            state[e_name][nid] = value
+        state["round"][nid] = number
+
+    @classmethod
+    def estimate_group(cls, group, msg, mask=None):
+        number, vector = msg
+        state = group.state
+        names = group_network(group).names
+        for (x_name, s_name, e_name), value in zip(names, vector):
+            state.assign(s_name, state[x_name], mask)
+            state.fill(e_name, value, mask)
+        state.fill("round", number, mask)
+
+
+class GeometricCoordinator(Sender):
+    """
+    Tracks whether the norm of the average of the local vectors is above
+    a threshold.
+
+    On a violation the coordinator polls all the sites, averages their
+    vectors into the new estimate and broadcasts it.
+    """
+
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.estimate_vector = [0.0] * net.dim
+        self.round = 0
+        self.syncs = 0
+
+    def violation(self, msg):
+        sid, number = msg
+        # a violation of a round that is over is already resolved
+        if number != self.round:
+            return
+        readings = self.gather("collect", None)
+        self.estimate_vector = [sum(values) / len(readings)
+                                for values in zip(*readings)]
+        self.round += 1
+        self.syncs += 1
+        self.send("estimate", (self.round, self.estimate_vector))
+
+
+class GeometricNetwork(MonitoringNetwork):
+    """
+    Geometric monitoring of the threshold function ||avg(v_i)|| >= T, where
+    v_i is the latest vector read by site i.
+
+    Every site checks a local condition on its own drift; as long as no
+    condition fails the answer of the coordinator is correct, so the sites
+    only communicate when the answer may have changed.
+    """
+
+    SITE = GeometricSite
+    COORD = GeometricCoordinator
+    SITE_IFC = {"collect": False, "estimate": True}
+    COORD_IFC = {"violation": True}
+
+    def __init__(self, k, dim, threshold, dispatcher=None):
+        """
+        A simple constructor.
+
+        :param k: the number of sites
+        :param dim: the dimension of the vectors
+        :param threshold: the threshold T of the norm
+        :param dispatcher: the dispatcher of the network
+        """
+        self.dim = dim
+        self.threshold = threshold
+        self.x_names = [f"x{j}" for j in range(dim)]
+        self.names = [(f"x{j}", f"s{j}", f"e{j}") for j in range(dim)]
+        super().__init__(k, dispatcher)
+
+    def columns(self):
+        columns = {"round": (0, "q")}
+        for names in self.names:
+            columns.update(dict.fromkeys(names, (0.0, "d")))
+        return columns
+
+    def estimate(self):
+        """
+        :return: the estimate of the average vector
+        """
+        return self.coord.estimate_vector
+
+    def above(self):
+        """
+        :return: True if the norm of the estimate is above the threshold
+        """
+        return math.sqrt(sum(value * value for value in self.estimate())) \
+            >= self.threshold
+
+    def feed(self, pairs):
+        if not pairs:
+            return
+        state = self.state
+        if not vectorized(state["round"]):
+            touched = {}
+            for sid, item in pairs:
+                touched[sid] = item
+            for sid, item in touched.items():
+                for name, value in zip(self.x_names, item):
+                    state[name][sid] = value
+            due = [sid for sid in sorted(touched)
+                   if self.sites[sid].violates()]
+        else:
+            sids = site_ids(pairs)
+            values = numpy.array([item for _, item in pairs], dtype=float)
+            # the last reading of every site
+            touched, last = numpy.unique(sids[::-1], return_index=True)
+            rows = values[len(sids) - 1 - last]
+            for j, name in enumerate(self.x_names):
+                state[name][touched] = rows[:, j]
+
+            center = numpy.zeros(len(touched))
+            radius = numpy.zeros(len(touched))
+            norm = numpy.zeros(len(touched))
+            for x_name, s_name, e_name in self.names:
+                e = state[e_name][touched]
+                drift = state[x_name][touched] - state[s_name][touched]
+                center += (e + drift / 2) ** 2
+                radius += drift * drift
+                norm += e * e
+            center = numpy.sqrt(center)
+            radius = numpy.sqrt(radius) / 2
+            threshold = self.threshold
+            violated = numpy.where(numpy.sqrt(norm) >= threshold,
+                                   center - radius < threshold,
+                                   center + radius >= threshold)
+            due = touched[violated].tolist()
+
+        sites = self.sites
+        for sid in due:
+            # an earlier violation of the chunk may have synchronized it
+            sites[sid].check_ball()
+
+
+###############################################################################
+#
+# Heavy hitters and top-k
+#
+###############################################################################
+class HeavyHitterSite(CountingSite):
+    """
+    A counting site that also counts every key of its items, and reports
+    the count of a key when it reaches the slack.
+    """
+
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        # the unreported count of every key
+        self.pending = {}
+
+    def update(self, item):
+        count = self.pending.get(item, 0) + 1
+        if count >= self.net.state["slack"][self.nid]:
+            self.pending.pop(item, None)
+            self.send("key_count", (item, count))
+        else:
+            self.pending[item] = count
+        super().update(item)
+
+    def add_counts(self, counts, total):
+        """
+        Adds the counts of a chunk and reports the keys that reached the
+        slack in one batch.
+
+        :param counts: a list of (key, count) pairs
+        :param total: the number of items of the chunk
+        :return: None
+        """
+        pending = self.pending
+        slack = self.net.state["slack"][self.nid]
+        due = []
+        for key, count in counts:
+            count += pending.get(key, 0)
+            if count >= slack:
+                pending.pop(key, None)
+                due.append((key, count))
+            else:
+                pending[key] = count
+        if due:
+            self.send_batch("key_count", due)
+        self.net.state["unreported"][self.nid] += total
+        self.check_count()
+
+
+class HeavyHitterCoordinator(CountingCoordinator):
+    """
+    Tracks the count of every key; the estimate of a key misses less than
+    `slack` of its items at every site, so less than eps of all the items.
+    """
+
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.counts = {}
+
+    def key_count(self, msg):
+        key, count = msg
+        self.counts[key] = self.counts.get(key, 0) + count
+
+    def heavy_hitters(self, phi):
+        """
+        :param phi: the fraction of the items
+        :return: the (key, estimated count) pairs of all the keys with more
+            than phi of the items, and maybe of keys with more than
+            phi - eps, by decreasing count
+        """
+        limit = (phi - self.net.eps) * self.estimate
+        return sorted(((key, count) for key, count in self.counts.items()
+                       if count >= limit),
+                      key=operator.itemgetter(1), reverse=True)
+
+    def top_k(self, n):
+        """
+        :param n: the number of keys
+        :return: the (key, estimated count) pairs of the n keys with the
+            largest estimates; the count of every missing key is at most
+            eps of the items more than the smallest of them
+        """
+        return heapq.nlargest(n, self.counts.items(),
+                              key=operator.itemgetter(1))
+
+
+class HeavyHittersNetwork(CountingNetwork):
+    """
+    Distributed heavy hitters and top-k: every item is a key, and the
+    coordinator estimates the count of every key within eps times the
+    number of items.
+    """
+
+    SITE = HeavyHitterSite
+    COORD = HeavyHitterCoordinator
+    COORD_IFC = {"count": True, "key_count": True}
+
+    def heavy_hitters(self, phi):
+        """
+        @see HeavyHitterCoordinator.heavy_hitters
+        """
+        return self.coord.heavy_hitters(phi)
+
+    def top_k(self, n):
+        """
+        @see HeavyHitterCoordinator.top_k
+        """
+        return self.coord.top_k(n)
+
+    def feed(self, pairs):
+        if not pairs:
+            return
+        by_site = {}
+        for (sid, key), count in collections.Counter(pairs).items():
+            by_site.setdefault(sid, []).append((key, count))
+        sites = self.sites
+        for sid in sorted(by_site):
+            counts = by_site[sid]
+            sites[sid].add_counts(counts,
+                                  sum(count for _, count in counts))
@@ -0,0 +1,328 @@
+"""
+Time series of the channel counters of a network.
+
+A `Recorder` takes snapshots of the counters of all the channels every N
+messages or every N units of simulated time, so that the traffic of each
+phase of a protocol can be studied, e.g. the bytes of every endpoint per
+epoch.
+
+"""
+import array
+import csv
+import json
+import os
+import sys
+
+from components import *
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+###############################################################################
+#
+# Recorder
+#
+###############################################################################
+class Recorder:
+    """
+    Records snapshots of the channel counters of a network.
+
+    Each snapshot is a row with the simulated time, the total number of
+    messages so far, and the value of every recorded counter of every
+    channel. Rows are kept in preallocated int64 arrays: a ring buffer of
+    `capacity` rows that overwrites the oldest rows, or an array that
+    grows if no capacity is given. Taking a snapshot copies one array per
+    counter, so its cost only depends on the number of channels.
+
+    The channels are the channels of the network when the recorder is
+    created.
+    """
+
+    def __init__(self, net, every_msgs=None, every_time=None, capacity=None,
+                 columns=("msgs", "bytes")):
+        """
+        A basic constructor.
+
+        :param net: the network to record
+        :param every_msgs: take a snapshot every that many messages
+        :param every_time: take a snapshot on the first message after every
+            that many units of simulated time
+        :param capacity: the number of rows of the ring buffer (None for a
+            growable buffer)
+        :param columns: the names of the ChannelStore counters to record
+        """
+        if every_msgs is None and every_time is None:
+            raise TypeError("A snapshot interval must be given")
+        for name in columns:
+            if name not in ChannelStore.COLUMNS:
+                raise TypeError(f"There is no {name!r} counter")
+
+        self.net = net
+        self.every_msgs = every_msgs
+        self.every_time = every_time
+        self.capacity = capacity
+        self.columns = tuple(columns)
+        self.channels = list(net.channels)
+        self.width = len(self.channels)
+        # a row has the counters of the channels in this order, read from
+        # the store by channel id
+        self.cids = [channel.cid for channel in self.channels]
+        self.contiguous = self.cids == list(range(self.width))
+
+        rows = capacity if capacity is not None else 0
+        self.times = array.array("d", bytes(8 * rows))
+        self.totals = array.array("q", bytes(8 * rows))
+        self.data = {name: array.array("q", bytes(8 * rows * self.width))
+                     for name in self.columns}
+        # the number of snapshots taken so far
+        self.count = 0
+
+        self.next_msgs = None
+        self.next_time = None
+        self.attached = False
+
+    ###########################################################################
+    # recording
+
+    def attach(self):
+        """
+        Starts recording; a first snapshot is taken immediately.
+
+        :return: None
+        """
+        if self.attached:
+            return
+        self.attached = True
+        self.net.taps.append(self.tap)
+        self.snapshot()
+        if self.every_msgs is not None:
+            self.next_msgs = self.net.traffic.total[0] + self.every_msgs
+        if self.every_time is not None:
+            self.next_time = self.net.now + self.every_time
+
+    def detach(self):
+        """
+        Stops recording; a last snapshot is taken.
+
+        :return: None
+        """
+        if not self.attached:
+            return
+        self.attached = False
+        self.net.taps.remove(self.tap)
+        self.snapshot()
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def tap(self, channel, msg, size, count):
+        """
+        Called by the network after every send.
+        """
+        if self.next_msgs is not None and \
+                self.net.traffic.total[0] >= self.next_msgs:
+            self.snapshot()
+            self.next_msgs += self.every_msgs * \
+                ((self.net.traffic.total[0] - self.next_msgs) //
+                 self.every_msgs + 1)
+        if self.next_time is not None and self.net.now >= self.next_time:
+            self.snapshot()
+            self.next_time += self.every_time * \
+                ((self.net.now - self.next_time) // self.every_time + 1)
+
+    def snapshot(self):
+        """
+        Appends a row with the current counters.
+
+        :return: None
+        """
+        width = self.width
+        store = self.net.counters
+        if self.capacity is None:
+            self.times.append(self.net.now)
+            self.totals.append(self.net.traffic.total[0])
+            for name, data in self.data.items():
+                data.extend(self.counters(getattr(store, name)))
+        else:
+            row = self.count % self.capacity
+            self.times[row] = self.net.now
+            self.totals[row] = self.net.traffic.total[0]
+            for name, data in self.data.items():
+                data[row * width:(row + 1) * width] = \
+                    self.counters(getattr(store, name))
+        self.count += 1
+
+    def counters(self, column):
+        """
+        :param column: a counter column of the store
+        :return: the counters of the recorded channels, in their order
+        """
+        if self.contiguous:
+            return column[:self.width]
+        return array.array("q", (column[cid] for cid in self.cids))
+
+    ###########################################################################
+    # reading
+
+    def __len__(self):
+        if self.capacity is None:
+            return self.count
+        return min(self.count, self.capacity)
+
+    def row_order(self):
+        """
+        :return: the buffer rows from the oldest to the newest snapshot
+        """
+        if self.capacity is None or self.count <= self.capacity:
+            return range(len(self))
+        start = self.count % self.capacity
+        return [(start + i) % self.capacity for i in range(self.capacity)]
+
+    def row(self, name, index):
+        """
+        :param name: the name of a recorded counter
+        :param index: the buffer row
+        :return: the counter of every recorded channel in this row, in
+            the order of `channels`
+        """
+        width = self.width
+        return self.data[name][index * width:(index + 1) * width]
+
+    def series(self, name, by="endpoint", deltas=False):
+        """
+        The time series of a counter, aggregated per group of channels.
+
+        :param name: the name of a recorded counter
+        :param by: "endpoint", "src", "dst", "type" or "channel"
+        :param deltas: if true every value is the difference from the
+            previous snapshot (the traffic of that interval)
+        :return: a tuple (times, {key: list of values})
+        """
+        keys = [self.key(channel, by) for channel in self.channels]
+        order = self.row_order()
+        times = [self.times[i] for i in order]
+        result = {key: [0] * len(order) for key in keys}
+        for position, index in enumerate(order):
+            for key, value in zip(keys, self.row(name, index)):
+                result[key][position] += value
+
+        if deltas:
+            for values in result.values():
+                for position in range(len(values) - 1, 0, -1):
+                    values[position] -= values[position - 1]
+        return times, result
+
+    @staticmethod
+    def key(channel, by):
+        """
+        :return: the aggregation key of a channel
+        """
+        if by == "endpoint":
+            return channel.endpoint
+        if by == "src":
+            return getattr(channel.src, "nid", "group")
+        if by == "dst":
+            return getattr(channel.dst, "nid", "group")
+        if by == "type":
+            return type(channel).__name__
+        if by == "channel":
+            return channel.cid
+        raise TypeError(f"Unknown aggregation {by!r}")
+
+    ###########################################################################
+    # export
+
+    def to_csv(self, path, name="bytes", by="endpoint", deltas=False):
+        """
+        Writes a time series as CSV, with one line per snapshot and one
+        column per key.
+
+        :param path: the path of the file
+        :param name: the name of a recorded counter
+        :param by: how the channels are aggregated (see series)
+        :param deltas: if true the traffic of every interval is written
+        :return: None
+        """
+        times, result = self.series(name, by, deltas)
+        keys = list(result)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time"] + [str(key) for key in keys])
+            for position, time in enumerate(times):
+                writer.writerow([time] + [result[key][position]
+                                          for key in keys])
+
+    def to_columns(self, directory):
+        """
+        Writes the raw snapshots in a columnar layout.
+
+        Every column is a file of little endian int64 (float64 for the
+        times) values, with one value per snapshot and channel in
+        snapshot-major order. A schema.json file describes the columns and
+        the channels.
+
+        :param directory: the directory of the files
+        :return: None
+        """
+        os.makedirs(directory, exist_ok=True)
+        order = self.row_order()
+
+        def write(filename, values):
+            if sys.byteorder != "little":
+                values.byteswap()
+            with open(os.path.join(directory, filename), "wb") as f:
+                values.tofile(f)
+
+        write("time.bin", array.array("d", (self.times[i] for i in order)))
+        write("total_msgs.bin",
+              array.array("q", (self.totals[i] for i in order)))
+        for name in self.columns:
+            values = array.array("q")
+            for index in order:
+                values.extend(self.row(name, index))
+            write(f"{name}.bin", values)
+
+        schema = {"rows": len(order),
+                  "channels": [{"cid": c.cid,
+                                "src": self.key(c, "src"),
+                                "dst": self.key(c, "dst"),
+                                "endpoint": c.endpoint,
+                                "type": type(c).__name__}
+                               for c in self.channels],
+                  "columns": {"time": "float64", "total_msgs": "int64",
+                              **{name: "int64" for name in self.columns}}}
+        with open(os.path.join(directory, "schema.json"), "w") as f:
+            json.dump(schema, f, indent=2)
+
+    def to_parquet(self, path):
+        """
+        Writes the raw snapshots as a Parquet file in long format, one row
+        per snapshot and channel. Needs pyarrow.
+
+        :param path: the path of the file
+        :return: None
+        """
+        if pyarrow is None:
+            raise TypeError("Writing Parquet files needs pyarrow")
+        order = self.row_order()
+        width = self.width
+        table = {"snapshot": [p for p in range(len(order))
+                              for _ in range(width)],
+                 "time": [self.times[i] for i in order for _ in range(width)],
+                 "cid": [c.cid for _ in order for c in self.channels],
+                 "endpoint": [c.endpoint for _ in order
+                              for c in self.channels]}
+        for name in self.columns:
+            values = []
+            for index in order:
+                values.extend(self.row(name, index))
+            table[name] = values
+        pyarrow.parquet.write_table(pyarrow.table(table), path)
@@ -0,0 +1,420 @@
+"""
+Sharded simulation of the sites of a star network over many processes.
+
+The sites of a `StarNetwork` are partitioned into shards. Each shard runs
+the local handlers of its sites (e.g. updating local statistics with stream
+tuples) and only forwards the remote calls of its sites to the coordinator
+process, together with the accounting of their channels.
+
+The run proceeds in epochs. In every epoch:
+
+    1. each shard feeds the items of the epoch to its sites,
+    2. the coordinator receives the messages the sites sent, ordered by
+       site id (and by send order for the same site),
+    3. the messages the coordinator sent are delivered to the sites of
+       every shard, and the messages the sites send in response go back to
+       step 2, until no message is left.
+
+Since the order of the messages does not depend on how the sites are
+partitioned, the per-channel counters and the final coordinator state are
+the same for any number of shards, including a single in-process shard,
+as long as the protocol is deterministic and sites do not share state.
+
+"""
+import multiprocessing
+import traceback
+
+from components import *
+from faults import PartialCall
+
+
+###############################################################################
+#
+# Dispatcher
+#
+###############################################################################
+class OutboxDispatcher(Dispatcher):
+    """
+    A dispatcher that never executes remote methods.
+
+    Every delivery is recorded in the outbox as a tuple
+    (src nid, channel id, batch, msg), so that it can be executed in another
+    process which has built the same network. `batch` is True when the
+    message is a list for the `<method>_batch` remote method.
+    """
+
+    def __init__(self):
+        self.outbox = []
+
+    def deliver(self, channel, func, msg, size=None):
+        self.outbox.append((channel.src.nid, channel.cid,
+                            is_batch(channel, func), msg))
+
+    def pending(self):
+        return len(self.outbox)
+
+    def drain(self):
+        """
+        Empties the outbox.
+
+        :return: the recorded deliveries
+        """
+        outbox = self.outbox
+        self.outbox = []
+        return outbox
+
+
+###############################################################################
+#
+# Shards
+#
+###############################################################################
+class Shard:
+    """
+    The sites of a star network that are simulated together.
+
+    A shard owns a network built by the network factory, but only the
+    listed sites of that network are used.
+    """
+
+    def __init__(self, net, site_ids, handler="update"):
+        """
+        A basic constructor.
+
+        :param net: the network of the shard
+        :param site_ids: the ids of the sites the shard owns
+        :param handler: the name of the site method that processes an item
+        """
+        self.net = net
+        self.site_ids = set(site_ids)
+        self.handler = handler
+        self.channels = {channel.cid: channel for channel in net.channels}
+        self.funcs = {}
+
+        if not isinstance(net.dispatcher, OutboxDispatcher):
+            net.dispatcher = OutboxDispatcher()
+
+    def feed(self, items):
+        """
+        Feeds items to the local handlers of the sites.
+
+        :param items: a list of (site id, item) pairs of this shard
+        :return: the deliveries the sites sent
+        """
+        sites = self.net.sites
+        handler = self.handler
+        for sid, item in items:
+            getattr(sites[sid], handler)(item)
+        return self.net.dispatcher.drain()
+
+    def func(self, channel, batch):
+        """
+        :return: the remote method that executes the deliveries of a
+            channel on the sites of the shard, or None if they have no
+            local receiver
+        """
+        # the members of a group may change
+        key = (channel.cid, batch, getattr(channel.dst, "version", None))
+        func = self.funcs.get(key)
+        if func is None:
+            proxy = channel.src.proxy_to(channel.dst)
+            endpoint = proxy.endpoints[channel.endpoint]
+            func = endpoint.send_batch if batch else endpoint.send
+            if isinstance(channel.dst, HostGroup):
+                # a broadcast is a single call of the GroupCall, so the
+                # group handler runs, with the other shards' sites masked
+                lost = [index for index, member
+                        in enumerate(channel.dst.members)
+                        if member.nid not in self.site_ids]
+                if len(lost) == len(channel.dst.members):
+                    func = False
+                elif lost:
+                    func = PartialCall(func, lost)
+            elif channel.dst.nid not in self.site_ids:
+                func = False
+            self.funcs[key] = func
+        return func
+
+    def deliver(self, entries):
+        """
+        Executes deliveries of the coordinator on the sites of the shard.
+
+        :param entries: deliveries recorded by an OutboxDispatcher
+        :return: the deliveries the sites sent in response
+        """
+        channels = self.channels
+        for _, cid, batch, msg in entries:
+            func = self.func(channels[cid], batch)
+            if func:
+                func(msg)
+        return self.net.dispatcher.drain()
+
+    def counters(self):
+        """
+        :return: a snapshot of the counters of the shard's network
+        """
+        return self.net.counters.snapshot()
+
+
+def _serve(conn, factory, site_ids, handler):
+    """
+    The main loop of a shard process.
+
+    :param conn: the pipe to the coordinator process
+    :param factory: the network factory
+    :param site_ids: the ids of the sites of the shard
+    :param handler: the name of the site method that processes an item
+    :return: None
+    """
+    try:
+        shard = Shard(factory(), site_ids, handler)
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    conn.send(("ok", None))
+
+    while True:
+        command, arg = conn.recv()
+        if command == "stop":
+            break
+        try:
+            result = getattr(shard, command)(*arg)
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+        else:
+            conn.send(("ok", result))
+    conn.close()
+
+
+class ShardProcess:
+    """
+    A shard that runs in its own process.
+
+    It has the same interface as `Shard`; every call is sent through a pipe
+    and executed by the shard process.
+    """
+
+    # seconds to wait for a shard process to exit before terminating it
+    JOIN_TIMEOUT = 5.0
+
+    def __init__(self, factory, site_ids, handler="update", context=None):
+        """
+        A basic constructor.
+
+        :param factory: the network factory (it must be picklable when the
+            start method is not fork)
+        :param site_ids: the ids of the sites the shard owns
+        :param handler: the name of the site method that processes an item
+        :param context: the multiprocessing context
+        """
+        context = context or multiprocessing.get_context()
+        self.site_ids = sorted(site_ids)
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve,
+                                       args=(child, factory, list(site_ids),
+                                             handler),
+                                       daemon=True)
+        self.process.start()
+        child.close()
+        self.receive()
+
+    def name(self):
+        """
+        :return: a description of the shard for error messages
+        """
+        site_ids = self.site_ids
+        sites = f"{site_ids[0]}..{site_ids[-1]}" if site_ids else "none"
+        return f"shard process {self.process.pid} (sites {sites})"
+
+    def died(self):
+        """
+        :return: the error of a shard process that exited unexpectedly
+        """
+        self.process.join(self.JOIN_TIMEOUT)
+        self.close()
+        return RuntimeError(f"The {self.name()} exited with code "
+                            f"{self.process.exitcode}")
+
+    def receive(self):
+        try:
+            status, result = self.conn.recv()
+        except (EOFError, ConnectionError) as error:
+            raise self.died() from error
+        if status == "error":
+            self.close()
+            raise RuntimeError(f"The {self.name()} failed:\n{result}")
+        return result
+
+    def request(self, command, *args):
+        try:
+            self.conn.send((command, args))
+        except (ConnectionError, OSError) as error:
+            raise self.died() from error
+        return self.receive()
+
+    def feed(self, items):
+        return self.request("feed", items)
+
+    def deliver(self, entries):
+        return self.request("deliver", entries)
+
+    def counters(self):
+        return self.request("counters")
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(("stop", ()))
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(self.JOIN_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.conn.close()
+
+
+###############################################################################
+#
+# Runner
+#
+###############################################################################
+def partition(site_ids, shards):
+    """
+    Splits the site ids in contiguous blocks of (almost) equal size.
+
+    :param site_ids: the ids of the sites
+    :param shards: the number of blocks
+    :return: a list of lists of site ids
+    """
+    site_ids = sorted(site_ids)
+    size, extra = divmod(len(site_ids), shards)
+    blocks = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        blocks.append(site_ids[start:end])
+        start = end
+    return blocks
+
+
+class ShardedRunner:
+    """
+    Runs a star network with its sites partitioned into shards.
+
+    The network is built by `factory`, a function without arguments that
+    returns a `StarNetwork` with its connections set up. Every shard
+    process calls the factory, so the factory must build the same network
+    every time. With `processes=0` the whole network is simulated in this
+    process with the same epoch semantics, which is the reference run.
+    """
+
+    def __init__(self, factory, processes=None, handler="update",
+                 context=None):
+        """
+        A basic constructor.
+
+        :param factory: the network factory
+        :param processes: the number of shard processes (by default the
+            number of CPUs, 0 for a single in-process shard)
+        :param handler: the name of the site method that processes an item
+        :param context: the multiprocessing context
+        """
+        self.net = factory()
+        self.net.dispatcher = OutboxDispatcher()
+        self.channels = {channel.cid: channel for channel in self.net.channels}
+        self.handler = handler
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = min(processes, len(self.net.sites))
+
+        if processes == 0:
+            self.shards = [Shard(self.net, self.net.sites, handler)]
+            self.owner = dict.fromkeys(self.net.sites, 0)
+        else:
+            blocks = partition(self.net.sites, processes)
+            self.shards = []
+            try:
+                for block in blocks:
+                    self.shards.append(ShardProcess(factory, block, handler,
+                                                    context))
+            except Exception:
+                self.close()
+                raise
+            self.owner = {sid: i for i, block in enumerate(blocks)
+                          for sid in block}
+        self.remote = processes > 0
+
+    def run(self, epochs):
+        """
+        Runs the simulation.
+
+        :param epochs: an iterable of epochs; each epoch is a list of
+            (site id, item) pairs
+        :return: the network of the coordinator, with the counters of all
+            the shards merged into it
+        """
+        try:
+            for epoch in epochs:
+                self.run_epoch(epoch)
+            if self.remote:
+                for shard in self.shards:
+                    self.net.counters.add(shard.counters())
+                self.net.traffic.rebuild(self.net.channels)
+        finally:
+            self.close()
+        return self.net
+
+    def run_epoch(self, epoch):
+        """
+        Feeds an epoch to the sites and exchanges messages until none is
+        left.
+
+        :param epoch: a list of (site id, item) pairs
+        :return: None
+        """
+        items = [[] for _ in self.shards]
+        for sid, item in epoch:
+            items[self.owner[sid]].append((sid, item))
+
+        inbox = []
+        for shard, shard_items in zip(self.shards, items):
+            if shard_items:
+                inbox.extend(shard.feed(shard_items))
+
+        while inbox:
+            outbox = self.deliver_to_coord(inbox)
+            inbox = []
+            if outbox:
+                for shard in self.shards:
+                    inbox.extend(shard.deliver(outbox))
+
+    def deliver_to_coord(self, inbox):
+        """
+        Executes the messages of the sites on the coordinator.
+
+        :param inbox: deliveries recorded by the shards
+        :return: the deliveries the coordinator sent in response
+        """
+        # the order must not depend on the partitioning of the sites
+        inbox.sort(key=lambda entry: entry[0])
+
+        coord = self.net.coord
+        channels = self.channels
+        for _, cid, batch, msg in inbox:
+            channel = channels[cid]
+            name = batch_name(channel.endpoint) if batch else \
+                channel.endpoint
+            getattr(coord, name)(msg)
+        return self.net.dispatcher.drain()
+
+    def close(self):
+        """
+        Stops the shard processes.
+
+        :return: None
+        """
+        for shard in getattr(self, "shards", ()):
+            if isinstance(shard, ShardProcess):
+                shard.close()
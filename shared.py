@@ -0,0 +1,215 @@
+"""
+Channel counters in shared memory, for runs split over many processes.
+
+A `SharedChannelStore` keeps the counters of all the channels in one
+`multiprocessing.shared_memory` block with one slot per process. Every
+worker process builds the same network (so its channels get the same
+ids), attaches to its own slot and moves its counters there:
+
+    store = SharedChannelStore(capacity=len(net.counters), slots=workers)
+    # in worker i
+    net.set_counters(store.attach(i))
+
+`Channel.transmit` then updates the counters of the worker's slot, without
+locks, since no two processes write the same slot. The parent process
+reads the sum of all the slots with `refresh`, which loads it into its own
+network, so that the queries of the statistics module see the traffic of
+all the workers while they run, without pickling anything:
+
+    net.set_counters(store.reader())
+    refresh(net)
+    total_msgs(net)
+
+Counters are read while they are written, so a refresh taken during a
+run may count the messages of a send but not yet its bytes.
+
+"""
+import array
+import sys
+from multiprocessing import shared_memory
+
+from components import *
+
+
+###############################################################################
+#
+# Shared store
+#
+###############################################################################
+def _attach_store(name, capacity, slots, slot, size):
+    return SharedChannelStore(capacity, slots, slot, name, size)
+
+
+class SharedChannelStore(ChannelStore):
+    """
+    A ChannelStore whose counters are the per-process slots of a shared
+    memory block.
+
+    A store with a slot (a writer) reads and writes the counters of its
+    slot. A store without a slot (a reader) keeps private counters, which
+    `refresh` overwrites with the sum of all the slots. The store that
+    created the block owns it and must `unlink` it at the end.
+    """
+
+    def __init__(self, capacity, slots, slot=None, name=None, size=0):
+        """
+        A basic constructor.
+
+        :param capacity: the maximum number of channels
+        :param slots: the number of writer processes
+        :param slot: the slot of this process, or None for a reader
+        :param name: the name of an existing block (by default a new block
+            is created)
+        :param size: the number of channels already allocated
+        """
+        if slot is not None and not 0 <= slot < slots:
+            raise TypeError(f"There is no slot {slot} in {slots} slots")
+        self.capacity = capacity
+        self.slots = slots
+        self.slot = slot
+        self.size = size
+        self.owner = name is None
+
+        nbytes = 8 * len(self.COLUMNS) * slots * max(capacity, 1)
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        elif sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            # the child processes share the resource tracker of their
+            # parent, which forgets the block when the owner unlinks it
+            self.shm = shared_memory.SharedMemory(name)
+        self.buffer = self.shm.buf[:nbytes].cast("q")
+
+        if slot is None:
+            super().__init__()
+            super().allocate(size)
+        else:
+            for index, name in enumerate(self.COLUMNS):
+                start = (slot * len(self.COLUMNS) + index) * capacity
+                setattr(self, name, self.buffer[start:start + capacity])
+
+    def __len__(self):
+        return self.size
+
+    def __reduce__(self):
+        return _attach_store, (self.shm.name, self.capacity, self.slots,
+                               self.slot, self.size)
+
+    @property
+    def name(self):
+        """
+        The name of the shared memory block.
+        """
+        return self.shm.name
+
+    def columns(self):
+        if self.slot is None:
+            return super().columns()
+        return {name: getattr(self, name)[:self.size]
+                for name in self.COLUMNS}
+
+    def allocate(self, n=1):
+        cid = self.size
+        if cid + n > self.capacity:
+            raise TypeError(f"The store has room for {self.capacity} "
+                            f"channels")
+        if self.slot is None:
+            super().allocate(n)
+        self.size += n
+        return cid
+
+    def attach(self, slot):
+        """
+        :param slot: a slot of the block
+        :return: a writer store of the slot, on the same block
+        """
+        return SharedChannelStore(self.capacity, self.slots, slot,
+                                  self.shm.name, self.size)
+
+    def reader(self):
+        """
+        :return: a reader store of the block
+        """
+        return SharedChannelStore(self.capacity, self.slots, None,
+                                  self.shm.name, self.size)
+
+    def merged(self):
+        """
+        Sums the counters of all the slots.
+
+        :return: a snapshot with the summed counters
+        """
+        width = len(self.COLUMNS)
+        size = self.size
+        if numpy is not None:
+            blocks = numpy.frombuffer(self.buffer, dtype=numpy.int64)
+            blocks = blocks.reshape(self.slots, width, self.capacity)
+            totals = blocks[:, :, :size].sum(axis=0)
+            del blocks
+            return dict(zip(self.COLUMNS, totals))
+
+        result = {}
+        for index, name in enumerate(self.COLUMNS):
+            total = array.array("q", bytes(8 * size))
+            for slot in range(self.slots):
+                start = (slot * width + index) * self.capacity
+                for cid, value in enumerate(self.buffer[start:start + size]):
+                    total[cid] += value
+            result[name] = total
+        return result
+
+    def clear(self):
+        """
+        Zeroes the counters of all the slots.
+
+        :return: None
+        """
+        self.buffer[:] = array.array("q", bytes(self.buffer.nbytes))
+
+    def close(self):
+        """
+        Detaches the store from the block. The store can not be used
+        afterwards.
+
+        :return: None
+        """
+        if self.buffer is None:
+            return
+        if self.slot is not None:
+            for name in self.COLUMNS:
+                getattr(self, name).release()
+                setattr(self, name, None)
+        self.buffer.release()
+        self.buffer = None
+        self.shm.close()
+
+    def __del__(self):
+        if getattr(self, "buffer", None) is not None:
+            self.close()
+
+    def unlink(self):
+        """
+        Closes the store and frees the block; only the owner should call
+        it, once all the processes are done.
+
+        :return: None
+        """
+        self.close()
+        self.shm.unlink()
+
+
+def refresh(net):
+    """
+    Loads the sum of all the slots into a network with a reader store and
+    recomputes its traffic aggregates.
+
+    :param net: a network whose counters are a reader SharedChannelStore
+    :return: the network
+    """
+    store = net.counters
+    if not isinstance(store, SharedChannelStore) or store.slot is not None:
+        raise TypeError("Only a network with a reader store can be "
+                        "refreshed")
+    net.load_counters(store.merged())
+    return net
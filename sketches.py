@@ -0,0 +1,733 @@
+"""
+Sketches that can be sent as messages.
+
+Every sketch keeps its cells in one flat buffer (a NumPy array when NumPy
+is installed, an array.array otherwise), so that `update_many` and `merge`
+are a few array operations, and `msg_size` sizes a sketch from the length
+of its buffer without looking at the cells:
+
+    sketch = CountMin(width=272, depth=5, seed=1)
+    sketch.update_many(items)
+    self.send("sketch", sketch)
+
+A sketch can also be sent as a delta: the cells that changed since the
+previous delta, with their indices. The size of a delta is its encoded
+size, with the gaps between the indices and the integer values as varints:
+
+    self.send("sketch_delta", sketch.delta())
+    ...
+    def sketch_delta(self, delta):
+        self.sketch.apply(delta)
+
+All the sketches with the same parameters and seed hash the same way in
+every process, so sketches of different sites can be merged.
+
+"""
+import array
+import math
+import random
+
+from encoders import varint_size
+from streams import mix64, stable_hash
+from tools import *
+
+MASK = (1 << 64) - 1
+
+
+###############################################################################
+#
+# Hashing
+#
+###############################################################################
+if numpy is not None:
+    _U64 = {name: numpy.uint64(value) for name, value in
+            (("golden", 0x9E3779B97F4A7C15), ("m1", 0xBF58476D1CE4E5B9),
+             ("m2", 0x94D049BB133111EB))}
+
+
+def mix64_array(values):
+    """
+    streams.mix64 of every value of a uint64 NumPy array.
+
+    :param values: a uint64 array
+    :return: a new uint64 array
+    """
+    with numpy.errstate(over="ignore"):
+        values = values + _U64["golden"]
+        values = (values ^ (values >> numpy.uint64(30))) * _U64["m1"]
+        values = (values ^ (values >> numpy.uint64(27))) * _U64["m2"]
+    return values ^ (values >> numpy.uint64(31))
+
+
+def bucket(value, width):
+    """
+    :param value: a 64-bit hash
+    :param width: the number of buckets
+    :return: a bucket in [0, width) from the high bits of the hash
+    """
+    return ((value >> 32) * width) >> 32
+
+
+def median(values):
+    """
+    :param values: an iterable of numbers
+    :return: the median (the lower one for an even count)
+    """
+    values = sorted(values)
+    return values[(len(values) - 1) // 2]
+
+
+def bit_lengths(values):
+    """
+    int.bit_length of every value of a uint64 NumPy array.
+
+    :param values: a uint64 array
+    :return: an int64 array
+    """
+    values = values.copy()
+    lengths = numpy.zeros(len(values), dtype=numpy.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >> numpy.uint64(shift)
+        nonzero = high != 0
+        lengths += nonzero * shift
+        values = numpy.where(nonzero, high, values)
+    return lengths + values.astype(numpy.int64)
+
+
+def varints_size(values):
+    """
+    :param values: ints (a list or an int64 NumPy array)
+    :return: the bytes of the zigzag varint encoding of all the values
+    """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        values = values.astype(numpy.int64)
+        zigzag = numpy.where(values >= 0, values << 1,
+                             ((-values) << 1) - 1).astype(numpy.uint64)
+        return int(numpy.maximum(1, (bit_lengths(zigzag) + 6) // 7).sum())
+    return sum(varint_size(value) for value in values)
+
+
+###############################################################################
+#
+# Buffers
+#
+###############################################################################
+def new_buffer(length, typecode, value=0):
+    """
+    :return: a buffer of length cells with the same value
+    """
+    if numpy is not None:
+        return numpy.full(length, value, dtype=numpy.dtype(typecode))
+    return array.array(typecode, [value]) * length
+
+
+def is_array(buffer):
+    return numpy is not None and isinstance(buffer, numpy.ndarray)
+
+
+def zeros_like(buffer):
+    """
+    :return: a buffer of zeros with the length and type of another
+    """
+    if is_array(buffer):
+        return numpy.zeros_like(buffer)
+    return array.array(buffer.typecode, bytes(len(buffer) * buffer.itemsize))
+
+
+###############################################################################
+#
+# Deltas
+#
+###############################################################################
+class SketchDelta:
+    """
+    The cells of a sketch that changed since its previous delta.
+
+    `mode` tells how `apply` combines the values with the cells: "add"
+    (the values are the differences), "max" or "set".
+    """
+
+    __slots__ = ("kind", "header", "indices", "values", "mode", "cell",
+                 "seen")
+
+    def __init__(self, kind, header, indices, values, mode, cell, seen=None):
+        """
+        A basic constructor.
+
+        :param kind: the name of the sketch type
+        :param header: the parameters of the sketch
+        :param indices: the sorted indices of the changed cells
+        :param values: the values of the changed cells
+        :param mode: "add", "max" or "set"
+        :param cell: the encoded size of a value (None for varints)
+        :param seen: the number of items the sketch has seen, if it is
+            part of its state
+        """
+        self.kind = kind
+        self.header = header
+        self.indices = indices
+        self.values = values
+        self.mode = mode
+        self.cell = cell
+        self.seen = seen
+
+    def __len__(self):
+        return len(self.indices)
+
+    def size(self):
+        """
+        :return: the encoded size: the header, the index gaps and the
+            values
+        """
+        size = INT * (len(self.header) + (self.seen is not None))
+        if not len(self.indices):
+            return size
+        indices = self.indices
+        if is_array(indices):
+            gaps = numpy.diff(indices, prepend=0)
+        else:
+            gaps = [index - previous for index, previous in
+                    zip(indices, [0] + list(indices[:-1]))]
+        size += varints_size(gaps)
+        if self.cell is None:
+            return size + varints_size(self.values)
+        return size + self.cell * len(self.values)
+
+
+register_sizer(SketchDelta, lambda delta: delta.size())
+
+
+###############################################################################
+#
+# Base
+#
+###############################################################################
+class Sketch:
+    """
+    Base class of the sketches.
+
+    A sketch has its cells in `cells`. Subclasses give the encoded size of
+    a cell in CELL (None for varint encoded deltas of ints), how two
+    sketches are merged in MERGE, and the parameters in `header`.
+    """
+
+    CELL = INT
+    MERGE = "add"
+
+    def __init__(self, length, typecode):
+        self.cells = new_buffer(length, typecode)
+        # the cells at the previous delta
+        self.base = None
+
+    def header(self):
+        """
+        :return: the parameters of the sketch; sketches with the same
+            header can be merged
+        """
+        raise NotImplementedError
+
+    def cell_size(self):
+        """
+        :return: the encoded size of a cell (None for varints)
+        """
+        return self.CELL
+
+    def size(self):
+        """
+        :return: the size of the sketch as a message
+        """
+        return INT * len(self.header()) + \
+            (self.cell_size() or INT) * len(self.cells)
+
+    def check(self, other):
+        if type(other) is not type(self) or other.header() != self.header():
+            raise TypeError(f"Can not combine a {type(self).__name__} with "
+                            f"a different sketch")
+
+    def keys(self, items):
+        """
+        :param items: the items (ints, strings, bytes or tuples), or a NumPy
+            array of ints
+        :return: the 64-bit keys of the items (a uint64 array if NumPy is
+            installed)
+        """
+        if numpy is None:
+            return [stable_hash(item) for item in items]
+        if isinstance(items, numpy.ndarray) and items.dtype.kind in "iu":
+            return items.astype(numpy.uint64)
+        return numpy.fromiter((stable_hash(item) for item in items),
+                              dtype=numpy.uint64, count=len(items))
+
+    def merge(self, other):
+        """
+        Adds the items of another sketch with the same parameters.
+
+        :param other: the other sketch
+        :return: self
+        """
+        self.check(other)
+        self.combine(range(len(other.cells)), other.cells, self.MERGE)
+        return self
+
+    def combine(self, indices, values, mode):
+        cells = self.cells
+        if is_array(cells):
+            if isinstance(indices, range):
+                indices = slice(indices.start, indices.stop)
+            else:
+                indices = numpy.asarray(indices, dtype=numpy.int64)
+            if mode == "add":
+                cells[indices] += values
+            elif mode == "max":
+                cells[indices] = numpy.maximum(cells[indices], values)
+            else:
+                cells[indices] = values
+        else:
+            for index, value in zip(indices, values):
+                if mode == "add":
+                    cells[index] += value
+                elif mode == "max":
+                    if value > cells[index]:
+                        cells[index] = value
+                else:
+                    cells[index] = value
+
+    def delta(self):
+        """
+        Takes the cells that changed since the previous delta (or since the
+        sketch was created).
+
+        :return: a SketchDelta
+        """
+        cells = self.cells
+        base = self.base
+        if base is None:
+            base = self.base = zeros_like(cells)
+        if is_array(cells):
+            indices = numpy.flatnonzero(cells != base)
+            values = cells[indices]
+            if self.MERGE == "add":
+                values = values - base[indices]
+            base[indices] = cells[indices]
+        else:
+            indices = [index for index, (value, old) in
+                       enumerate(zip(cells, base)) if value != old]
+            if self.MERGE == "add":
+                values = [cells[index] - base[index] for index in indices]
+            else:
+                values = [cells[index] for index in indices]
+            for index in indices:
+                base[index] = cells[index]
+        return SketchDelta(type(self).__name__, self.header(), indices,
+                           values, self.MERGE, self.cell_size())
+
+    def apply(self, delta):
+        """
+        Applies a delta of a sketch with the same parameters.
+
+        :param delta: a SketchDelta
+        :return: self
+        """
+        if delta.kind != type(self).__name__ or \
+                delta.header != self.header():
+            raise TypeError(f"Can not apply the delta of a different sketch "
+                            f"to a {type(self).__name__}")
+        self.combine(delta.indices, delta.values, delta.mode)
+        return self
+
+
+# subclasses such as Reservoir have their own size
+register_sizer(Sketch, lambda sketch: sketch.size())
+
+
+###############################################################################
+#
+# Count-Min and AMS
+#
+###############################################################################
+class CountMin(Sketch):
+    """
+    A Count-Min sketch: depth rows of width counters. The estimate of the
+    count of an item is at most eps * total above the real count, with
+    probability 1 - delta, for width = e / eps and depth = ln(1 / delta).
+    """
+
+    CELL = None
+
+    def __init__(self, width, depth, seed=0):
+        """
+        A basic constructor.
+
+        :param width: the counters of a row
+        :param depth: the number of rows
+        :param seed: the seed of the hash functions
+        """
+        super().__init__(width * depth, "q")
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.row_seeds = [mix64(seed * 1000003 + row) for row in range(depth)]
+
+    @classmethod
+    def from_error(cls, eps, delta, seed=0):
+        """
+        :return: a sketch with error eps * total with probability 1 - delta
+        """
+        return cls(math.ceil(math.e / eps), math.ceil(math.log(1 / delta)),
+                   seed)
+
+    def header(self):
+        return self.width, self.depth, self.seed
+
+    def cells_of(self, key):
+        width = self.width
+        return [row * width + bucket(mix64((key + row_seed) & MASK), width)
+                for row, row_seed in enumerate(self.row_seeds)]
+
+    def update(self, item, count=1):
+        cells = self.cells
+        for index in self.cells_of(stable_hash(item)):
+            cells[index] += count
+
+    def update_many(self, items, counts=None):
+        """
+        Adds many items at once.
+
+        :param items: the items
+        :param counts: the count of every item (1 by default)
+        :return: None
+        """
+        if not is_array(self.cells):
+            if counts is None:
+                for item in items:
+                    self.update(item)
+            else:
+                for item, count in zip(items, counts):
+                    self.update(item, count)
+            return
+
+        keys = self.keys(items)
+        width = self.width
+        weights = None if counts is None else \
+            numpy.asarray(counts, dtype=numpy.float64)
+        with numpy.errstate(over="ignore"):
+            for row, row_seed in enumerate(self.row_seeds):
+                buckets = bucket(mix64_array(keys + numpy.uint64(row_seed)),
+                                 numpy.uint64(width)).astype(numpy.int64)
+                self.cells[row * width:(row + 1) * width] += numpy.bincount(
+                    buckets, weights, minlength=width).astype(numpy.int64)
+
+    def query(self, item):
+        """
+        :return: the estimated count of an item
+        """
+        cells = self.cells
+        return int(min(cells[index]
+                       for index in self.cells_of(stable_hash(item))))
+
+
+class AMS(CountMin):
+    """
+    An AMS (fast AMS / Count) sketch: every item adds its count with a
+    random sign to one counter per row. It estimates the second frequency
+    moment and inner products of streams.
+    """
+
+    def cells_of(self, key):
+        width = self.width
+        cells = []
+        for row, row_seed in enumerate(self.row_seeds):
+            value = mix64((key + row_seed) & MASK)
+            cells.append((row * width + bucket(value, width),
+                          1 if value & 1 else -1))
+        return cells
+
+    def update(self, item, count=1):
+        cells = self.cells
+        for index, sign in self.cells_of(stable_hash(item)):
+            cells[index] += sign * count
+
+    def update_many(self, items, counts=None):
+        if not is_array(self.cells):
+            super().update_many(items, counts)
+            return
+
+        keys = self.keys(items)
+        width = self.width
+        counts = numpy.ones(len(keys)) if counts is None else \
+            numpy.asarray(counts, dtype=numpy.float64)
+        with numpy.errstate(over="ignore"):
+            for row, row_seed in enumerate(self.row_seeds):
+                values = mix64_array(keys + numpy.uint64(row_seed))
+                buckets = bucket(values,
+                                 numpy.uint64(width)).astype(numpy.int64)
+                signs = (values & numpy.uint64(1)).astype(numpy.int64) * 2 - 1
+                self.cells[row * width:(row + 1) * width] += numpy.bincount(
+                    buckets, signs * counts,
+                    minlength=width).astype(numpy.int64)
+
+    def query(self, item):
+        cells = self.cells
+        return int(median(sign * cells[index] for index, sign in
+                                self.cells_of(stable_hash(item))))
+
+    def rows(self):
+        width = self.width
+        return [self.cells[row * width:(row + 1) * width]
+                for row in range(self.depth)]
+
+    def inner(self, other):
+        """
+        :param other: an AMS sketch with the same parameters
+        :return: the estimated inner product of the two frequency vectors
+        """
+        self.check(other)
+        return median(
+            int(numpy.dot(row, other_row)) if is_array(row) else
+            sum(a * b for a, b in zip(row, other_row))
+            for row, other_row in zip(self.rows(), other.rows()))
+
+    def second_moment(self):
+        """
+        :return: the estimated sum of the squared counts
+        """
+        return self.inner(self)
+
+
+###############################################################################
+#
+# HyperLogLog
+#
+###############################################################################
+class HyperLogLog(Sketch):
+    """
+    HyperLogLog: 2^p registers of one byte that estimate the number of
+    distinct items with a relative error of about 1.04 / sqrt(2^p).
+    """
+
+    CELL = CHAR
+    MERGE = "max"
+
+    def __init__(self, p=12, seed=0):
+        """
+        A basic constructor.
+
+        :param p: the bits of the register index, in [4, 18]
+        :param seed: the seed of the hash function
+        """
+        if not 4 <= p <= 18:
+            raise ValueError("p must be in [4, 18]")
+        super().__init__(1 << p, "B")
+        self.p = p
+        self.seed = seed
+        self.hash_seed = mix64(seed)
+
+    def header(self):
+        return self.p, self.seed
+
+    def register(self, key):
+        """
+        :return: the register of a key and the rank of its hash
+        """
+        value = mix64((key + self.hash_seed) & MASK)
+        bits = 64 - self.p
+        rest = value & ((1 << bits) - 1)
+        return value >> bits, bits - rest.bit_length() + 1
+
+    def update(self, item):
+        index, rank = self.register(stable_hash(item))
+        if rank > self.cells[index]:
+            self.cells[index] = rank
+
+    def update_many(self, items):
+        """
+        Adds many items at once.
+
+        :param items: the items
+        :return: None
+        """
+        if not is_array(self.cells):
+            for item in items:
+                self.update(item)
+            return
+
+        keys = self.keys(items)
+        bits = 64 - self.p
+        with numpy.errstate(over="ignore"):
+            values = mix64_array(keys + numpy.uint64(self.hash_seed))
+        indices = (values >> numpy.uint64(bits)).astype(numpy.int64)
+        rest = values & numpy.uint64((1 << bits) - 1)
+        ranks = (bits - bit_lengths(rest) + 1).astype(numpy.uint8)
+        numpy.maximum.at(self.cells, indices, ranks)
+
+    def estimate(self):
+        """
+        :return: the estimated number of distinct items
+        """
+        m = len(self.cells)
+        if is_array(self.cells):
+            total = float(numpy.ldexp(1.0, -self.cells.astype(
+                numpy.int64)).sum())
+            zeros = int((self.cells == 0).sum())
+        else:
+            total = sum(math.ldexp(1.0, -register)
+                        for register in self.cells)
+            zeros = self.cells.count(0)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / total
+        if estimate <= 2.5 * m and zeros:
+            # linear counting for small cardinalities
+            return m * math.log(m / zeros)
+        return estimate
+
+
+###############################################################################
+#
+# Reservoir
+#
+###############################################################################
+class Reservoir(Sketch):
+    """
+    A uniform sample of `capacity` items of a stream of numbers.
+
+    Once the sample is full, the position of the next item that enters it
+    is drawn ahead (Algorithm L), so the items in between are skipped
+    without drawing a random number for each.
+    """
+
+    MERGE = "set"
+
+    def __init__(self, capacity, typecode="d", seed=None):
+        """
+        A basic constructor.
+
+        :param capacity: the size of the sample
+        :param typecode: the array.array typecode of the items
+        :param seed: the seed of the sampling
+        """
+        super().__init__(capacity, typecode)
+        self.capacity = capacity
+        self.typecode = typecode
+        self.seen = 0
+        self.rng = random.Random(seed)
+        # the skip weight and the position of the next item to sample
+        self.weight = None
+        self.next = None
+
+    def header(self):
+        return self.capacity, self.typecode
+
+    def cell_size(self):
+        # the cells hold the sampled items, so their size is that of the
+        # items
+        return FLOAT if self.typecode in "fd" else None
+
+    def size(self):
+        return INT * 2 + (self.cell_size() or INT) * len(self)
+
+    def __len__(self):
+        return min(self.seen, self.capacity)
+
+    def sample(self):
+        """
+        :return: the sampled items
+        """
+        return list(self.cells[:len(self)])
+
+    def uniform(self):
+        """
+        :return: a random number in (0, 1)
+        """
+        value = self.rng.random()
+        while value == 0.0:
+            value = self.rng.random()
+        return value
+
+    def skip(self):
+        """
+        Draws the position of the next item that enters the sample.
+
+        :return: None
+        """
+        if self.weight is None:
+            self.weight = 1.0
+            self.next = self.seen - 1
+        self.weight *= math.exp(math.log(self.uniform()) / self.capacity)
+        self.next += 1 + int(math.log(self.uniform()) /
+                             math.log(1 - self.weight))
+
+    def update(self, item):
+        if self.seen < self.capacity:
+            self.cells[self.seen] = item
+        else:
+            if self.next is None:
+                self.skip()
+            if self.seen == self.next:
+                self.cells[self.rng.randrange(self.capacity)] = item
+                self.skip()
+        self.seen += 1
+
+    def update_many(self, items):
+        """
+        Adds many items at once.
+
+        :param items: a sequence of items
+        :return: None
+        """
+        cells = self.cells
+        start = min(max(self.capacity - self.seen, 0), len(items))
+        if start:
+            head = items[:start]
+            if not is_array(cells):
+                head = array.array(self.typecode, head)
+            cells[self.seen:self.seen + start] = head
+            self.seen += start
+        if start == len(items):
+            return
+
+        first = self.seen - start
+        end = first + len(items)
+        if self.next is None:
+            self.skip()
+        while self.next < end:
+            cells[self.rng.randrange(self.capacity)] = items[self.next - first]
+            self.skip()
+        self.seen = end
+
+    def merge(self, other):
+        """
+        Replaces the sample with a uniform sample of the union of the two
+        streams.
+
+        :param other: a Reservoir with the same capacity and typecode
+        :return: self
+        """
+        self.check(other)
+        mine, theirs = self.sample(), other.sample()
+        self.rng.shuffle(mine)
+        self.rng.shuffle(theirs)
+        left, right = self.seen, other.seen
+        merged = []
+        while len(merged) < self.capacity and (mine or theirs):
+            if theirs and (not mine or
+                           self.rng.random() * (left + right) >= left):
+                merged.append(theirs.pop())
+                right -= 1
+            else:
+                merged.append(mine.pop())
+                left -= 1
+        self.seen += other.seen
+        self.weight = self.next = None
+        self.combine(range(len(merged)), merged, "set")
+        return self
+
+    def delta(self):
+        delta = super().delta()
+        delta.seen = self.seen
+        return delta
+
+    def apply(self, delta):
+        super().apply(delta)
+        self.seen = delta.seen
+        self.weight = self.next = None
+        return self
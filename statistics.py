@@ -5,85 +5,85 @@ from components import *
 #
 # Statistics
 #
+# All the queries read the running aggregates of `net.traffic`, which the
+# channels update on every transmit, so they do not depend on the number of
+# channels.
+#
 ###############################################################################
 
 # Total messages over all channels
 def total_msgs(net):
-    total = 0
-    for channel in net.channels:
-        total += channel.msgs
-
-    return total
+    return net.traffic.total[0]
 
 
 # Total bytes over all channels
 def total_bytes(net):
-    total = 0
-    for channel in net.channels:
-        total += channel.bytes
-
-    return total
+    return net.traffic.total[1]
 
 
 # Received messages over broadcast channels
 def broadcast_msgs(net):
-    total = 0
-    for channel in net.channels:
-        if isinstance(channel, MulticastChannel):
-            total += channel.rx_msgs
-    return total
+    return net.traffic.broadcast[0]
 
 
 # Received bytes over broadcast channels
 def broadcast_bytes(net):
-    total = 0
-    for channel in net.channels:
-        if isinstance(channel, MulticastChannel):
-            total += channel.rx_bytes
-    return total
+    return net.traffic.broadcast[1]
 
 
 # Sent msgs filtered by source
 def src_msgs(net, src):
-    for channel in net.channels:
-        if src == channel.src.nid:
-            return channel.msgs
+    return net.traffic.by_src.get(src, (0, 0))[0]
 
 
 # Sent bytes filtered by source
 def src_bytes(net, src):
-    for channel in net.channels:
-        if src == channel.src.nid:
-            return channel.bytes
+    return net.traffic.by_src.get(src, (0, 0))[1]
 
 
-# Received bytes filtered by destination
+# Received msgs filtered by destination (broadcasts included)
 def dst_msgs(net, dst):
-    for channel in net.channels:
-        if dst == channel.dst.nid:
-            return channel.msgs
+    return net.traffic.received(dst)[0]
 
 
-# Received bytes filtered by destination
+# Received bytes filtered by destination (broadcasts included)
 def dst_bytes(net, dst):
-    for channel in net.channels:
-        if dst == channel.dst.nid:
-            return channel.bytes
+    return net.traffic.received(dst)[1]
 
 
 # Total msgs filtered by endpoint
 def endpoint_msgs(net, endpoint):
-    total = 0
-    for channel in net.channels:
-        if endpoint == channel.endpoint:
-            total += channel.msgs
-    return total
+    return net.traffic.by_endpoint.get(endpoint, (0, 0))[0]
 
 
 # Total bytes filtered by endpoint
 def endpoint_bytes(net, endpoint):
-    total = 0
-    for channel in net.channels:
-        if endpoint == channel.endpoint:
-            total += channel.bytes
-    return total
+    return net.traffic.by_endpoint.get(endpoint, (0, 0))[1]
+
+
+# Total msgs filtered by channel type (e.g. MulticastChannel)
+def type_msgs(net, channel_type):
+    return net.traffic.by_type.get(channel_type, (0, 0))[0]
+
+
+# Total bytes filtered by channel type (e.g. MulticastChannel)
+def type_bytes(net, channel_type):
+    return net.traffic.by_type.get(channel_type, (0, 0))[1]
+
+
+# Total bytes after encoding (raw bytes on the channels without an encoder)
+def encoded_bytes(net):
+    raw, encoded = net.traffic.encoded
+    return net.traffic.total[1] - raw + encoded
+
+
+# Bytes after encoding filtered by source
+def src_encoded_bytes(net, src):
+    raw, encoded = net.traffic.encoded_by_src.get(src, (0, 0))
+    return src_bytes(net, src) - raw + encoded
+
+
+# Bytes after encoding filtered by endpoint
+def endpoint_encoded_bytes(net, endpoint):
+    raw, encoded = net.traffic.encoded_by_endpoint.get(endpoint, (0, 0))
+    return endpoint_bytes(net, endpoint) - raw + encoded
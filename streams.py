@@ -0,0 +1,502 @@
+"""
+Stream sources that feed data streams to the sites of a network.
+
+A source is an iterable of items that is read lazily, in chunks, so that
+traces much larger than the memory can be replayed. Every source knows its
+`offset`: the position of the next item, which can be given back as
+`start` to continue from the same point.
+
+An assigner decides which site receives each item, and a `StreamDriver`
+feeds the items to the sites.
+
+"""
+import bisect
+import csv
+import hashlib
+import itertools
+import json
+import mmap
+import numbers
+import os
+import random
+import struct
+
+
+###############################################################################
+#
+# File sources
+#
+###############################################################################
+class LineSource:
+    """
+    Base class of the text sources with one record per line.
+
+    The file is read in binary mode, a chunk of lines at a time, and the
+    offset is the byte position of the next record. Subclasses implement
+    `parse`.
+    """
+
+    def __init__(self, path, encoding="utf-8", start=0, chunk_size=1 << 20):
+        """
+        A basic constructor.
+
+        :param path: the path of the file
+        :param encoding: the encoding of the file
+        :param start: the byte offset of the first record to read
+        :param chunk_size: about how many bytes are read at a time
+        """
+        self.path = path
+        self.encoding = encoding
+        self.offset = start
+        self.chunk_size = chunk_size
+
+    def parse(self, lines):
+        """
+        Parses a chunk of decoded lines.
+
+        :param lines: a list of strings
+        :return: an iterator with one record per line (None for the lines
+            that hold no record)
+        """
+        raise NotImplementedError
+
+    def skip_header(self, f):
+        """
+        Skips the lines before the first record.
+
+        :param f: the file, positioned at its start
+        :return: None
+        """
+        pass
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            if self.offset == 0:
+                self.skip_header(f)
+                self.offset = f.tell()
+            f.seek(self.offset)
+
+            encoding = self.encoding
+            while True:
+                lines = f.readlines(self.chunk_size)
+                if not lines:
+                    break
+                records = self.parse([line.decode(encoding)
+                                      for line in lines])
+                for line, record in zip(lines, records):
+                    self.offset += len(line)
+                    if record is not None:
+                        yield record
+
+
+class CsvSource(LineSource):
+    """
+    Reads the records of a delimited text file.
+
+    Every line is one record (quoted fields can not span lines). Records
+    are yielded as tuples of strings, or of the values that the `types`
+    converters return.
+    """
+
+    delimiter = ","
+
+    def __init__(self, path, types=None, header=False, delimiter=None,
+                 encoding="utf-8", start=0, chunk_size=1 << 20):
+        """
+        A basic constructor.
+
+        :param path: the path of the file
+        :param types: a converter for each column, e.g. (int, str, float)
+        :param header: if true the first line is skipped
+        :param delimiter: the delimiter of the fields
+        :param encoding: the encoding of the file
+        :param start: the byte offset of the first record to read
+        :param chunk_size: about how many bytes are read at a time
+        """
+        super().__init__(path, encoding, start, chunk_size)
+        self.types = tuple(types) if types is not None else None
+        self.header = header
+        if delimiter is not None:
+            self.delimiter = delimiter
+
+    def skip_header(self, f):
+        if self.header:
+            f.readline()
+
+    def parse(self, lines):
+        types = self.types
+        for row in csv.reader(lines, delimiter=self.delimiter):
+            if not row:
+                yield None
+            elif types is None:
+                yield tuple(row)
+            else:
+                yield tuple(convert(value)
+                            for convert, value in zip(types, row))
+
+
+class TsvSource(CsvSource):
+    """
+    Reads the records of a tab separated file.
+    """
+
+    delimiter = "\t"
+
+
+class JsonLinesSource(LineSource):
+    """
+    Reads a file with one JSON document per line.
+    """
+
+    def parse(self, lines):
+        loads = json.loads
+        return (loads(line) if line.strip() else None for line in lines)
+
+
+class BinarySource:
+    """
+    Reads fixed size binary records from a memory mapped file.
+
+    Records are decoded with a `struct` format, e.g. "<qd" for an int64 key
+    followed by a float64 value, and yielded as tuples. The offset is the
+    index of the next record.
+    """
+
+    def __init__(self, path, fmt, start=0, chunk_records=1 << 16):
+        """
+        A basic constructor.
+
+        :param path: the path of the file
+        :param fmt: the struct format of a record
+        :param start: the index of the first record to read
+        :param chunk_records: how many records are decoded at a time
+        """
+        self.path = path
+        self.record = struct.Struct(fmt)
+        self.offset = start
+        self.chunk_records = chunk_records
+
+    def __len__(self):
+        return os.path.getsize(self.path) // self.record.size
+
+    def __iter__(self):
+        size = self.record.size
+        if os.path.getsize(self.path) < size:
+            return
+        with open(self.path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm) // size * size
+            step = self.chunk_records * size
+            position = self.offset * size
+            while position < end:
+                chunk = mm[position:min(position + step, end)]
+                position += len(chunk)
+                for record in self.record.iter_unpack(chunk):
+                    self.offset += 1
+                    yield record
+
+    @staticmethod
+    def write(path, fmt, records):
+        """
+        Writes records in the format that BinarySource reads.
+
+        :param path: the path of the file
+        :param fmt: the struct format of a record
+        :param records: an iterable of tuples
+        :return: the number of written records
+        """
+        pack = struct.Struct(fmt).pack
+        count = 0
+        with open(path, "wb") as f:
+            for record in records:
+                f.write(pack(*record))
+                count += 1
+        return count
+
+
+###############################################################################
+#
+# Synthetic sources
+#
+###############################################################################
+class SyntheticSource:
+    """
+    Base class of the random sources.
+
+    A synthetic source yields `count` items (or forever if count is None)
+    from a seeded generator, so the same seed gives the same stream. The
+    offset is the number of items already drawn.
+    """
+
+    def __init__(self, count=None, seed=None, start=0):
+        """
+        A basic constructor.
+
+        :param count: the number of items (None for an endless stream)
+        :param seed: the seed of the generator
+        :param start: the number of items to skip
+        """
+        self.count = count
+        self.seed = seed
+        self.offset = start
+
+    def draw(self, rng):
+        """
+        :param rng: the random generator
+        :return: the next item
+        """
+        raise NotImplementedError
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        draw = self.draw
+        # replay the skipped draws so the stream continues where it stopped
+        for _ in range(self.offset):
+            draw(rng)
+
+        while self.count is None or self.offset < self.count:
+            item = draw(rng)
+            self.offset += 1
+            yield item
+
+
+class UniformSource(SyntheticSource):
+    """
+    Yields integers drawn uniformly from [low, high].
+    """
+
+    def __init__(self, low, high, count=None, seed=None, start=0):
+        super().__init__(count, seed, start)
+        self.low = low
+        self.high = high
+
+    def draw(self, rng):
+        return rng.randint(self.low, self.high)
+
+
+class ZipfSource(SyntheticSource):
+    """
+    Yields keys in [1, universe] following a Zipf distribution.
+
+    The probability of key i is proportional to 1 / i^s. Keys are drawn by
+    a binary search on the cumulative weights.
+    """
+
+    def __init__(self, universe, s=1.0, count=None, seed=None, start=0):
+        super().__init__(count, seed, start)
+        self.universe = universe
+        self.s = s
+        self.cumulative = list(itertools.accumulate(
+            1.0 / i ** s for i in range(1, universe + 1)))
+
+    def draw(self, rng):
+        cumulative = self.cumulative
+        index = bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+        return min(index, self.universe - 1) + 1
+
+
+###############################################################################
+#
+# Site assignment
+#
+###############################################################################
+def stable_hash(value):
+    """
+    A hash that is the same in every process and every run.
+
+    Ints, including NumPy ints, are their own 64-bit hash; strings, bytes
+    and tuples get a 64-bit blake2b digest, and a tuple hashes the same
+    whether its ints are Python or NumPy ints.
+
+    :param value: an int, a string, bytes or a tuple of them
+    :return: a non negative 64-bit int
+    """
+    if isinstance(value, numbers.Integral):
+        return int(value) & 0xFFFFFFFFFFFFFFFF
+    h = hashlib.blake2b(digest_size=8)
+    if isinstance(value, str):
+        h.update(b"s")
+        h.update(value.encode())
+    elif isinstance(value, (bytes, bytearray)):
+        h.update(b"b")
+        h.update(value)
+    elif isinstance(value, tuple):
+        h.update(b"t")
+        for item in value:
+            h.update(stable_hash(item).to_bytes(8, "little"))
+    else:
+        if isinstance(value, numbers.Real):
+            # NumPy floats have another repr
+            value = float(value)
+        h.update(b"r")
+        h.update(repr(value).encode())
+    return int.from_bytes(h.digest(), "little")
+
+
+def mix64(value):
+    """
+    The splitmix64 finalizer: a 64-bit hash with well mixed bits.
+
+    :param value: a 64-bit int
+    :return: a 64-bit int
+    """
+    mask = 0xFFFFFFFFFFFFFFFF
+    value = (value + 0x9E3779B97F4A7C15) & mask
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & mask
+    return value ^ (value >> 31)
+
+
+def round_robin(k):
+    """
+    Assigns the items to the sites 0, 1, ..., k-1, 0, 1, ...
+
+    :param k: the number of sites
+    :return: an assigner
+    """
+
+    def assign(index, item):
+        return index % k
+
+    return assign
+
+
+def hash_by_key(k, key=0):
+    """
+    Assigns all the items with the same key to the same site.
+
+    :param k: the number of sites
+    :param key: the index of the key in the item, or a function that
+        returns the key of an item
+    :return: an assigner
+    """
+    get = key if callable(key) else (lambda item: item[key])
+
+    def assign(index, item):
+        # ints are their own stable_hash, so strided keys need mixing
+        return mix64(stable_hash(get(item))) % k
+
+    return assign
+
+
+def from_trace(field=0):
+    """
+    Assigns each item to the site that the trace gives.
+
+    :param field: the index of the site id in the item, or a function that
+        returns the site id of an item
+    :return: an assigner
+    """
+    get = field if callable(field) else (lambda item: item[field])
+
+    def assign(index, item):
+        return get(item)
+
+    return assign
+
+
+###############################################################################
+#
+# Driver
+#
+###############################################################################
+class StreamDriver:
+    """
+    Feeds the items of a source to the sites of a network.
+
+    Each item is given to the `handler` method of the site that the
+    assigner chooses. Items are read and fed in chunks; after every chunk
+    the network delivers the pending messages.
+
+    If `time` is given, it extracts a timestamp from every item and the
+    network's clock is advanced to it before the item is fed, which needs
+    a `TimedDispatcher`.
+
+    If a `Checkpointer` is given, it may save a checkpoint after every
+    chunk, with the offset of the source and the number of items fed.
+    """
+
+    def __init__(self, net, source, assign, handler="update", time=None,
+                 chunk_size=4096, checkpoint=None):
+        """
+        A basic constructor.
+
+        :param net: the network with the sites (a StarNetwork)
+        :param source: an iterable of items
+        :param assign: an assigner, e.g. round_robin(k)
+        :param handler: the name of the site method that gets an item
+        :param time: the index of the timestamp in the item, or a function
+            that returns it (None to ignore time)
+        :param chunk_size: how many items are fed between deliveries
+        :param checkpoint: a Checkpointer (None for no checkpoints)
+        """
+        self.net = net
+        self.source = source
+        self.assign = assign
+        self.handler = handler
+        if time is not None and not callable(time):
+            field = time
+            time = (lambda item: item[field])
+        self.time = time
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.fed = 0
+
+    def pairs(self):
+        """
+        :return: an iterator of (site id, item) pairs
+        """
+        assign = self.assign
+        for index, item in enumerate(self.source, self.fed):
+            yield assign(index, item), item
+
+    def chunks(self, size=None):
+        """
+        Groups the (site id, item) pairs in lists, e.g. to use them as the
+        epochs of a sharded run.
+
+        :param size: the number of pairs per list (by default chunk_size)
+        :return: an iterator of lists
+        """
+        pairs = self.pairs()
+        size = size or self.chunk_size
+        while True:
+            chunk = list(itertools.islice(pairs, size))
+            if not chunk:
+                break
+            self.fed += len(chunk)
+            yield chunk
+
+    def run(self, limit=None):
+        """
+        Feeds the items to the sites.
+
+        :param limit: the maximum number of items to feed (None for all)
+        :return: the number of items fed
+        """
+        net = self.net
+        sites = net.sites
+        handler = self.handler
+        time = self.time
+        fed = 0
+        pairs = self.pairs()
+        if limit is not None:
+            pairs = itertools.islice(pairs, limit)
+
+        while True:
+            chunk = list(itertools.islice(pairs, self.chunk_size))
+            if not chunk:
+                break
+            for sid, item in chunk:
+                if time is not None:
+                    net.run_until(time(item))
+                getattr(sites[sid], handler)(item)
+            self.fed += len(chunk)
+            fed += len(chunk)
+            net.run()
+            if self.checkpoint is not None:
+                self.checkpoint.mark(sites[sid] for sid in
+                                     {sid for sid, _ in chunk})
+                self.checkpoint.maybe_save(
+                    self.fed, {"source": getattr(self.source, "offset", None)})
+        return fed
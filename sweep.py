@@ -0,0 +1,296 @@
+"""
+Parameter sweeps that run many simulations in parallel.
+
+A sweep runs the same simulation for every configuration of a parameter
+grid, e.g. every k and threshold, on a pool of processes, and collects the
+traffic statistics of every run in one table:
+
+    def simulate(inputs, k, threshold):
+        net = build_network(k, threshold)
+        StreamDriver(net, inputs["trace"], round_robin(k)).run()
+        return net
+
+    with SharedArray.create(values, "q") as trace:
+        table = run_sweep(simulate, grid(k=[10, 100], threshold=[1, 5]),
+                          inputs={"trace": trace})
+    table.to_csv("results.csv")
+
+Inputs that all the runs read, e.g. a parsed trace, are placed once in
+shared memory, and every worker maps them instead of reading and parsing
+them again.
+
+"""
+import array
+import concurrent.futures
+import csv
+import itertools
+import multiprocessing
+import time
+import traceback
+from multiprocessing import shared_memory
+
+from components import *
+from statistics import *
+
+# the metrics of every run: a name and a function of the network
+METRICS = {"total_msgs": total_msgs,
+           "total_bytes": total_bytes,
+           "broadcast_msgs": broadcast_msgs,
+           "broadcast_bytes": broadcast_bytes}
+
+
+###############################################################################
+#
+# Grids
+#
+###############################################################################
+def grid(**axes):
+    """
+    The cartesian product of parameter values.
+
+    :param axes: a list of values for every parameter, e.g. k=[10, 100]
+    :return: a list of dicts, one per configuration
+    """
+    names = list(axes)
+    return [dict(zip(names, values))
+            for values in itertools.product(*axes.values())]
+
+
+###############################################################################
+#
+# Shared inputs
+#
+###############################################################################
+class SharedArray:
+    """
+    A typed array in shared memory.
+
+    The process that creates it owns the memory and frees it on `close`.
+    A SharedArray is pickled as the name of the memory, so passing it to
+    another process only maps the same memory there.
+    """
+
+    def __init__(self, name, typecode, length, owner=False):
+        """
+        A basic constructor; use `create` to make a new array.
+
+        :param name: the name of the shared memory block
+        :param typecode: the array.array typecode of the values
+        :param length: the number of values
+        :param owner: if true close also frees the memory
+        """
+        self.name = name
+        self.typecode = typecode
+        self.length = length
+        self.owner = owner
+        self.shm = None
+
+    @classmethod
+    def create(cls, values, typecode="q"):
+        """
+        Copies values to a new block of shared memory.
+
+        :param values: an iterable of numbers (or an array of the typecode)
+        :param typecode: the array.array typecode of the values
+        :return: the SharedArray
+        """
+        if not isinstance(values, array.array) or \
+                values.typecode != typecode:
+            values = array.array(typecode, values)
+        nbytes = max(len(values) * values.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        shm.buf[:len(values) * values.itemsize] = values.tobytes()
+        shared = cls(shm.name, typecode, len(values), owner=True)
+        shared.shm = shm
+        return shared
+
+    def attach(self):
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        return self.shm
+
+    @property
+    def values(self):
+        """
+        :return: the values without a copy: a NumPy array if NumPy is
+            installed, a memoryview otherwise
+        """
+        buf = self.attach().buf
+        itemsize = array.array(self.typecode).itemsize
+        view = buf[:self.length * itemsize].cast(self.typecode)
+        if numpy is not None:
+            return numpy.frombuffer(view, dtype=numpy.dtype(self.typecode))
+        return view
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __getstate__(self):
+        return self.name, self.typecode, self.length
+
+    def __setstate__(self, state):
+        self.name, self.typecode, self.length = state
+        self.owner = False
+        self.shm = None
+
+    def close(self):
+        """
+        Unmaps the memory, and frees it if this is the owner.
+
+        :return: None
+        """
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                # views of the values are still alive; the mapping goes
+                # away with them
+                pass
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+###############################################################################
+#
+# Results
+#
+###############################################################################
+class ResultTable:
+    """
+    The results of a sweep: one row per configuration, with the parameters,
+    the metrics, the wall time of the run in `seconds` and the traceback in
+    `error` if the run failed.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def columns(self):
+        """
+        :return: the names of the columns, in order of appearance
+        """
+        names = {}
+        for row in self.rows:
+            names.update(dict.fromkeys(row))
+        return list(names)
+
+    def column(self, name):
+        """
+        :param name: the name of a column
+        :return: the values of the column (None for the missing values)
+        """
+        return [row.get(name) for row in self.rows]
+
+    def where(self, **params):
+        """
+        :param params: parameter values, e.g. k=10
+        :return: a table with the rows that have these values
+        """
+        return ResultTable([row for row in self.rows
+                            if all(row.get(name) == value
+                                   for name, value in params.items())])
+
+    def to_csv(self, path):
+        """
+        Writes the table as CSV.
+
+        :param path: the path of the file
+        :return: None
+        """
+        columns = self.columns()
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, columns)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+
+###############################################################################
+#
+# Runner
+#
+###############################################################################
+_INPUTS = None
+
+
+def _init_worker(inputs):
+    global _INPUTS
+    _INPUTS = inputs
+
+
+def _run(simulate, params, inputs, metrics):
+    """
+    Runs a configuration and measures it.
+
+    :return: the row of the configuration
+    """
+    if inputs is None:
+        inputs = _INPUTS
+    row = dict(params)
+    start = time.perf_counter()
+    try:
+        net = simulate(inputs, **params)
+        row["seconds"] = time.perf_counter() - start
+        for name, metric in metrics.items():
+            row[name] = metric(net)
+        row["error"] = None
+    except Exception:
+        row.setdefault("seconds", time.perf_counter() - start)
+        row["error"] = traceback.format_exc()
+    return row
+
+
+def run_sweep(simulate, configurations, inputs=None, processes=None,
+              metrics=None, context=None):
+    """
+    Runs a simulation for every configuration.
+
+    :param simulate: a function (inputs, **params) that builds a network,
+        runs it and returns it; it must be picklable, e.g. a module level
+        function
+    :param configurations: a list of parameter dicts, e.g. grid(k=[1, 2])
+    :param inputs: an object given to every run, e.g. a dict of
+        SharedArrays; it is sent once to every worker process
+    :param processes: the number of worker processes (by default the
+        number of CPUs, 0 to run in this process)
+    :param metrics: a dict {name: function of the network} (by default
+        METRICS)
+    :param context: the multiprocessing context
+    :return: a ResultTable with the rows in the order of configurations
+    """
+    metrics = METRICS if metrics is None else metrics
+    configurations = list(configurations)
+
+    if processes == 0:
+        return ResultTable([_run(simulate, params, inputs, metrics)
+                            for params in configurations])
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(configurations)))
+
+    with concurrent.futures.ProcessPoolExecutor(
+            processes, mp_context=context or multiprocessing.get_context(),
+            initializer=_init_worker, initargs=(inputs,)) as pool:
+        futures = [pool.submit(_run, simulate, params, None, metrics)
+                   for params in configurations]
+        rows = [future.result() for future in futures]
+    return ResultTable(rows)
@@ -0,0 +1,11 @@
+import benchmark
+
+
+###############################################################################
+def test_benchmarks_run():
+    result = benchmark.report(sizes=[10, 20], ops=50, repeat=1)
+    names = {r["name"] for r in result["results"]}
+
+    assert names == {name for name, _ in benchmark.BENCHMARKS}
+    assert all(r["seconds"] >= 0 and r["ops"] > 0 for r in result["results"])
+    assert benchmark.compare(result, result, 0.0) == []
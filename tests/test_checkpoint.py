@@ -0,0 +1,142 @@
+from components import *
+from checkpoint import *
+from streams import *
+from statistics import *
+
+
+def summing_network(k, dispatcher=None):
+    @remote_class("coord")
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.total = 0
+
+        def report(self, msg):
+            self.total += msg
+
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.sum = 0
+
+        def update(self, item):
+            self.sum += item
+            self.send("report", item)
+
+        def reset(self, msg):
+            pass
+
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator,
+                    dispatcher=dispatcher)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"reset": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    return n
+
+
+###############################################################################
+def test_checkpoint_resume(tmp_path):
+    k = 4
+    path = tmp_path / "run.ckpt"
+
+    reference = summing_network(k)
+    StreamDriver(reference, UniformSource(0, 9, count=100, seed=1),
+                 round_robin(k)).run()
+
+    # a run that stops after 55 items, with a checkpoint every 20
+    n = summing_network(k)
+    StreamDriver(n, UniformSource(0, 9, count=100, seed=1), round_robin(k),
+                 chunk_size=10,
+                 checkpoint=Checkpointer(n, path, every_items=20)).run(55)
+
+    checkpoint = read_checkpoint(path)
+    assert checkpoint.number == 2
+    assert checkpoint.offsets == {"source": 40, "fed": 40}
+
+    resumed = summing_network(k)
+    driver = StreamDriver(resumed,
+                          UniformSource(0, 9, count=100, seed=1,
+                                        start=checkpoint.offsets["source"]),
+                          round_robin(k), chunk_size=10,
+                          checkpoint=Checkpointer(resumed, path,
+                                                  every_items=20,
+                                                  resume=checkpoint))
+    checkpoint.restore(resumed, driver)
+    assert total_msgs(resumed) == 40 and driver.fed == 40
+    driver.run()
+
+    assert resumed.coord.total == reference.coord.total
+    assert [site.sum for site in resumed.sites.values()] == \
+        [site.sum for site in reference.sites.values()]
+    assert total_msgs(resumed) == total_msgs(reference)
+    assert src_bytes(resumed, 2) == src_bytes(reference, 2)
+    assert read_checkpoint(path).offsets["fed"] == 100
+
+
+###############################################################################
+def test_checkpoint_incremental_and_events(tmp_path):
+    path = tmp_path / "run.ckpt"
+    n = summing_network(3, dispatcher=TimedDispatcher(auto_run=False))
+    n.set_link_model(LinkModel(latency=2.0))
+    checkpointer = Checkpointer(n, path)
+    assert checkpointer.save() == len(host_keys(n))
+    assert checkpointer.save() == 0
+
+    n.sites[1].update(5)
+    n.sites[2].update(7)
+    # a host that is changed without a message is saved once marked
+    n.sites[0].sum = 1
+    assert checkpointer.save() == 2
+    checkpointer.mark([n.sites[0]])
+    assert checkpointer.save() == 1
+
+    resumed = summing_network(3, dispatcher=TimedDispatcher(auto_run=False))
+    resumed.set_link_model(LinkModel(latency=2.0))
+    read_checkpoint(path).restore(resumed)
+    assert resumed.sites[1].sum == 5
+    assert resumed.dispatcher.pending() == 2
+
+    n.run()
+    resumed.run()
+    assert resumed.coord.total == n.coord.total == 12
+    assert resumed.now == n.now == 2.0
+
+    # a truncated checkpoint is ignored
+    with open(path, "ab") as f:
+        f.write(FRAME.pack(HOSTS, 0, 100) + b"partial")
+    assert read_checkpoint(path).number == 4
+
+
+###############################################################################
+def test_checkpoint_timed_links(tmp_path):
+    path = tmp_path / "run.ckpt"
+
+    def timed_network():
+        n = summing_network(3, dispatcher=TimedDispatcher())
+        n.set_link_model(LinkModel(latency=1.0, jitter=0.5, seed=3))
+        return n
+
+    def feed(n, start, stop):
+        for i in range(start, stop):
+            n.run_until(float(i))
+            n.sites[i % 3].update(i)
+        n.run()
+
+    reference = timed_network()
+    feed(reference, 0, 20)
+
+    n = timed_network()
+    feed(n, 0, 10)
+    Checkpointer(n, path).save()
+    resumed = timed_network()
+    read_checkpoint(path).restore(resumed)
+    feed(resumed, 10, 20)
+
+    for channel, other in zip(resumed.channels, reference.channels):
+        assert channel.busy_until == other.busy_until
+        for attr in ("queue_delay", "latency"):
+            assert vars(getattr(channel, attr)) == \
+                vars(getattr(other, attr))
+    assert resumed.now == reference.now
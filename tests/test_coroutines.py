@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from components import *
+from coroutines import *
+from faults import *
+from statistics import *
+from tests.test_network import EchoSim
+
+
+class Site(AsyncSender):
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.count = 0
+
+    async def poll(self, msg):
+        # every site takes its own time to answer
+        await self.sleep(self.nid + 1)
+        return self.count
+
+
+class Coordinator(AsyncSender):
+    def __init__(self, net, nid, ifc):
+        super().__init__(net, nid, ifc)
+        self.rounds = []
+
+    async def report(self, msg):
+        return msg
+
+    async def start(self, rounds):
+        for _ in range(rounds):
+            counts = await self.gather_async("poll", None)
+            self.rounds.append((self.net.now, counts))
+            await self.sleep(1.0)
+
+
+def build(k, **kwargs):
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator,
+                    dispatcher=AsyncDispatcher(**kwargs))
+    n.add_interface("coord", {"report": False})
+    n.add_interface("site", {"poll": False})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    return n
+
+
+###############################################################################
+def test_same_accounting():
+    k = 10
+    direct = EchoSim(k, dispatcher=DirectDispatcher())
+    coroutine = EchoSim(k, dispatcher=AsyncDispatcher())
+
+    for sim in (direct, coroutine):
+        for site in sim.n.sites.values():
+            site.send("answer", 1)
+
+    assert [c.msgs for c in direct.n.channels] == \
+        [c.msgs for c in coroutine.n.channels]
+    assert [c.bytes for c in direct.n.channels] == \
+        [c.bytes for c in coroutine.n.channels]
+    assert direct.n.coord.store == coroutine.n.coord.store == 50
+
+
+###############################################################################
+def test_gather_in_simulated_time():
+    k = 3
+    n = build(k)
+    n.sites[1].count = 5
+    task = n.dispatcher.spawn(n.coord.start(2))
+    n.run()
+
+    assert task.done()
+    # a round lasts as long as the slowest site, then the coordinator
+    # sleeps a second
+    assert n.coord.rounds == [(3.0, [0, 5, 0]), (7.0, [0, 5, 0])]
+    assert n.now == 8.0
+    assert type_msgs(n, FanInChannel) == 2 * k
+    assert endpoint_msgs(n, "poll") == 2 + 2 * k
+
+
+###############################################################################
+def test_await_send_and_latency():
+    n = build(2, auto_run=False)
+    n.set_link_model(LinkModel(latency=0.5), endpoint="report")
+    results = []
+
+    async def main():
+        results.append(await n.sites[0].send("report", 7))
+        results.append(await n.sites[0].call_async("report", 8))
+        results.append(n.now)
+
+    n.dispatcher.spawn(main())
+    assert n.run() == 2
+    # the request and the reply of the call take 0.5 each
+    assert results == [7, 8, 1.5]
+    assert endpoint_msgs(n, "report") == 3
+
+
+###############################################################################
+def test_run_until_horizon():
+    n = build(4, auto_run=False)
+    n.dispatcher.spawn(n.coord.start(10))
+
+    n.run_until(5.0)
+    assert n.now == 5.0
+    assert len(n.coord.rounds) == 1
+
+    n.run_until(lambda: len(n.coord.rounds) == 2)
+    assert n.dispatcher.tasks
+
+    n.run()
+    assert len(n.coord.rounds) == 10
+    assert not n.dispatcher.tasks
+    n.dispatcher.close()
+
+
+###############################################################################
+def test_handler_errors_are_raised():
+    n = build(2)
+
+    async def main():
+        await n.sites[0].call_async("report", None)
+        await n.sites[0].send("poll", 1)
+
+    n.dispatcher.spawn(main())
+    with pytest.raises(TypeError):
+        n.run()
+
+
+###############################################################################
+def test_blocking_calls_take_no_time():
+    n = build(1, auto_run=False)
+    lines = []
+
+    async def main():
+        await n.coord.sleep(2.0)
+        lines.append(await n.dispatcher.run_in_executor(sum, [1, 2, 3]))
+        lines.append(n.now)
+
+    n.dispatcher.spawn(main())
+    n.run()
+    assert lines == [6, 2.0]
+
+
+###############################################################################
+def test_await_send_with_faults():
+    n = build(2, auto_run=False)
+    n.set_faults(FaultModel(seed=1), endpoint="report")
+    results = []
+
+    async def main():
+        results.append(await n.sites[0].send("report", 7))
+
+    n.dispatcher.spawn(main())
+    n.run()
+    assert results == [7]
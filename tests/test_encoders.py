@@ -0,0 +1,104 @@
+import array
+import random
+
+from components import *
+from encoders import *
+from statistics import *
+from tests.test_network import EchoSim
+
+
+###############################################################################
+def test_varint_and_quantize():
+    assert [varint_size(v) for v in (0, -1, 63, 64, -65, 1 << 20)] == \
+        [1, 1, 1, 2, 2, 4]
+
+    varint = VarintEncoder()
+    assert varint(None, [1, 2, 300], msg_size([1, 2, 300])) == 4
+    # like msg_size, the keys of a dict are not counted
+    assert varint(None, {"ab": 1.5}, 0) == FLOAT
+    counters = {"counter_name": 1, "other_key": 2}
+    assert varint(None, counters, msg_size(counters)) == 2 <= \
+        msg_size(counters)
+    assert QuantizeEncoder()(None, counters, 0) == msg_size(counters)
+
+    half = QuantizeEncoder(bits=16)
+    assert half(None, [0.5, 1.5, 2.5], 24) == 6
+    assert half(None, (1, 0.5), 12) == INT + 2
+
+    values = [0, -1, 63, 64, -65, 1 << 20, -(1 << 40)]
+    assert varint(None, array.array("q", values), 0) == \
+        sum(map(varint_size, values))
+    if numpy is not None:
+        assert varint(None, numpy.array(values), 0) == \
+            sum(map(varint_size, values))
+        unsigned = numpy.array([0, 63, 64, (1 << 64) - 1], dtype=numpy.uint64)
+        assert varint(None, unsigned, 0) == \
+            sum(varint_size(int(value)) for value in unsigned)
+
+
+###############################################################################
+def test_network_encoded_bytes():
+    k = 4
+    sim = EchoSim(k, limit=20)
+    sim.n.set_encoder(VarintEncoder(), endpoint="answer")
+    sim.n.coord.send("call", 0)
+
+    answers = endpoint_msgs(sim.n, "answer")
+    assert endpoint_bytes(sim.n, "answer") == answers * INT
+    # every answer is the int 1, a single byte as a varint
+    assert endpoint_encoded_bytes(sim.n, "answer") == answers
+    assert endpoint_encoded_bytes(sim.n, "call") == \
+        endpoint_bytes(sim.n, "call")
+    assert encoded_bytes(sim.n) == total_bytes(sim.n) - answers * (INT - 1)
+    assert src_encoded_bytes(sim.n, 0) == answers // k
+
+    channel = sim.n.sites[0].proxy.endpoints["answer"].req_channel
+    assert channel.enc_bytes == channel.msgs
+
+    before = encoded_bytes(sim.n)
+    sim.n.traffic.rebuild(sim.n.channels)
+    assert encoded_bytes(sim.n) == before
+
+
+###############################################################################
+def test_delta_encoder():
+    n = EchoSim(1).n
+    channel = n.sites[0].proxy.endpoints["answer"].req_channel
+    delta = DeltaEncoder()
+    assert delta(channel, [1000, 2000], 8) == 4
+    # the differences are small
+    assert delta(channel, [1001, 2003], 8) == 2
+    # 1002 is not a delta of a list, and 1003 is a delta of 1002
+    assert delta.encode_many(channel, [1002, 1003], 8) == 2 + 1
+
+
+###############################################################################
+def test_sampled_compression():
+    n = EchoSim(1).n
+    channel = n.sites[0].proxy.endpoints["answer"].req_channel
+    msg = "abcd" * 100
+
+    exact = ZlibEncoder()
+    size = exact(channel, msg, len(msg))
+    assert size < len(msg) // 4
+
+    sampled = ZlibEncoder(sample=0.1, seed=1)
+    sizes = [sampled(channel, msg, len(msg)) for _ in range(200)]
+    # the same message gives the same ratio, sampled or extrapolated
+    assert set(sizes) == {size}
+    assert sampled.ratios["answer"][0] < 200 * len(msg) // 2
+
+
+###############################################################################
+def test_compression_levels():
+    n = EchoSim(1).n
+    channel = n.sites[0].proxy.endpoints["answer"].req_channel
+    rng = random.Random(1)
+    msg = bytes(rng.choice(b"abcdefgh") for _ in range(100000))
+
+    for codec in ("zlib", "bz2", "lzma"):
+        fast = CompressEncoder(codec, level=1)(channel, msg, len(msg))
+        best = CompressEncoder(codec, level=9)(channel, msg, len(msg))
+        assert best <= fast < len(msg)
+    assert CompressEncoder("lzma", level=9)(channel, msg, len(msg)) < \
+        CompressEncoder("lzma", level=0)(channel, msg, len(msg))
@@ -0,0 +1,148 @@
+import random
+
+from components import *
+from faults import *
+from statistics import *
+
+
+def query_network(k, dispatcher=None):
+    @remote_class("coord")
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.received = []
+
+        def query(self, msg):
+            self.received.append(msg)
+
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.received = 0
+
+        def notify(self, msg):
+            self.received += 1
+
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator,
+                    dispatcher=dispatcher)
+    n.add_interface("coord", {"query": False})
+    n.add_interface("site", {"notify": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    return n
+
+
+###############################################################################
+def test_geometric_sample():
+    rng = random.Random(1)
+    counts = [len(geometric_sample(1000, 0.05, rng)) for _ in range(200)]
+    assert 45 < sum(counts) / len(counts) < 55
+    assert geometric_sample(10, 0.0, rng) == []
+    assert geometric_sample(3, 1.0, rng) == [0, 1, 2]
+
+
+###############################################################################
+def test_drops_without_retransmit():
+    n = query_network(1)
+    faults = FaultModel(drop=BernoulliDrop(0.3), seed=2)
+    n.set_faults(faults)
+    for i in range(1000):
+        n.sites[0].send("query", i)
+
+    lost = faults.totals()["lost"]
+    assert 200 < lost < 400
+    assert len(n.coord.received) == 1000 - lost
+    assert total_msgs(n) == 1000
+
+
+###############################################################################
+def test_retransmit_and_ack():
+    n = query_network(1)
+    faults = FaultModel(drop=GilbertElliottDrop(0.1, 0.3), retransmit=True,
+                        seed=3)
+    n.set_faults(faults)
+    tapped = {}
+
+    def tap(channel, msg, size, count):
+        tapped[channel.cid] = tapped.get(channel.cid, 0) + count
+
+    n.taps.append(tap)
+    for i in range(1000):
+        n.sites[0].send("query", i)
+
+    totals = faults.totals()
+    assert n.coord.received == list(range(1000))
+    assert totals["retransmitted"] == totals["lost"] > 0
+    endpoint = n.sites[0].proxy.endpoints["query"]
+    assert endpoint.req_channel.msgs == 1000 + totals["retransmitted"]
+    assert endpoint.resp_channel.msgs == totals["acked"] == 1000
+    assert faults.by_endpoint()["query"][FaultModel.ACKED] == 1000
+    # the taps see the retransmits and the acks too
+    assert tapped == {channel.cid: channel.msgs for channel in
+                      (endpoint.req_channel, endpoint.resp_channel)}
+
+
+###############################################################################
+def test_broadcast_losses():
+    k = 1000
+    n = query_network(k)
+    faults = FaultModel(drop=BernoulliDrop(0.1), seed=4)
+    n.set_faults(faults, endpoint="notify")
+    for _ in range(10):
+        n.coord.send("notify", None)
+
+    received = sum(site.received for site in n.sites.values())
+    assert received + faults.totals()["lost"] == 10 * k
+    assert 0.05 * 10 * k < faults.totals()["lost"] < 0.15 * 10 * k
+    assert broadcast_msgs(n) == 10 * k
+
+
+###############################################################################
+def test_duplicates_and_reordering():
+    n = query_network(1)
+    faults = FaultModel(duplicate=0.1, reorder=0.2, window=3, seed=5)
+    n.set_faults(faults)
+    for i in range(500):
+        n.sites[0].send("query", i)
+    faults.flush(n.dispatcher)
+
+    totals = faults.totals()
+    received = n.coord.received
+    assert len(received) == 500 + totals["duplicated"]
+    assert set(received) == set(range(500))
+    assert received != sorted(received)
+    assert totals["reordered"] > 0
+
+
+###############################################################################
+def test_broadcast_losses_group_handler():
+    class Site(Sender):
+        def notify(self, msg):
+            raise AssertionError("The group handler receives the broadcast")
+
+        @classmethod
+        def notify_group(cls, group, msg, mask=None):
+            group.state.fill("value", msg, mask)
+
+    class Coordinator(Sender):
+        def query(self, msg):
+            pass
+
+    k = 100
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"query": False})
+    n.add_interface("site", {"notify": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    state = GroupState(n.groups[0])
+    state.add_column("value", 0, "q")
+
+    faults = FaultModel(drop=BernoulliDrop(0.05), seed=3)
+    n.set_faults(faults, endpoint="notify")
+    n.coord.send("notify", 7)
+
+    lost = faults.totals()["lost"]
+    assert 0 < lost < 20
+    assert sum(value == 7 for value in state["value"]) == k - lost
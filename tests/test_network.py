@@ -1,3 +1,5 @@
+import pytest
+
 from components import *
 from statistics import *
 
@@ -9,7 +11,7 @@ class EchoSim:
         When initialized it creates a star network with k sites.
     """
 
-    def __init__(self, k):
+    def __init__(self, k, limit=50, dispatcher=None):
         @remote_class("coord")
         class Coordinator(Sender):
             def __init__(self, net, nid, ifc):
@@ -39,13 +41,13 @@ class EchoSim:
                 assert arg == "a coord msg"
 
             def call(self, msg):
-                if msg < 50:
+                if msg < limit:
                     self.send("answer", 1)
                 else:
-                    print(msg)
-                    assert msg >= 50
+                    assert msg >= limit
 
-        self.n = StarNetwork(k, coord_type=Coordinator, site_type=Site)
+        self.n = StarNetwork(k, coord_type=Coordinator, site_type=Site,
+                             dispatcher=dispatcher)
 
         ifc_coord = {"echo": True, "answer": True}
         self.n.add_interface("coord", ifc_coord)
@@ -111,3 +113,376 @@ def test_iterations():
 
     for site in sim.n.sites.values():
         site.send("answer", 1)
+
+
+###############################################################################
+def test_dispatchers_same_accounting():
+    k = 10
+    direct = EchoSim(k, dispatcher=DirectDispatcher())
+    fifo = EchoSim(k, dispatcher=FifoDispatcher())
+
+    for sim in (direct, fifo):
+        for site in sim.n.sites.values():
+            site.send("answer", 1)
+
+    assert [c.msgs for c in direct.n.channels] == \
+        [c.msgs for c in fifo.n.channels]
+    assert [c.bytes for c in direct.n.channels] == \
+        [c.bytes for c in fifo.n.channels]
+    assert direct.n.coord.store == fifo.n.coord.store == 50
+
+
+###############################################################################
+def test_long_protocol_flat_stack():
+    sim = EchoSim(1, limit=5000)
+
+    sim.n.sites[0].send("answer", 1)
+
+    assert sim.n.coord.store == 5000
+    assert total_msgs(sim.n) == 2 * 5000
+    assert broadcast_msgs(sim.n) == 5000
+
+
+###############################################################################
+def test_run_manually():
+    k = 10
+    sim = EchoSim(k, dispatcher=FifoDispatcher(auto_run=False))
+
+    for site in sim.n.sites.values():
+        site.send("answer", 1)
+    assert sim.n.coord.store == 0
+    assert sim.n.dispatcher.pending() == k
+
+    assert sim.n.run(max_events=3) == 3
+    assert sim.n.coord.store == 3
+
+    sim.n.run_until(lambda: sim.n.coord.store >= 20)
+    assert sim.n.coord.store == 20
+
+    sim.n.run()
+    assert sim.n.coord.store == 50
+    assert sim.n.dispatcher.pending() == 0
+
+
+###############################################################################
+def test_timed_delivery():
+    sim = EchoSim(2, dispatcher=TimedDispatcher(auto_run=False))
+    n = sim.n
+    n.set_link_model(LinkModel(latency=1.0, bandwidth=4), endpoint="answer")
+
+    n.sites[0].send("answer", 1)
+    n.sites[0].send("answer", 1)
+    channel = n.sites[0].proxy.endpoints["answer"].req_channel
+    # the second message waits for the first to leave the link
+    assert channel.queue_delay.max == 1.0
+    assert channel.latency.max == 3.0
+
+    n.run_until(2.0)
+    assert n.now == 2.0
+    assert n.coord.store == 1
+
+    n.run_until(3.0)
+    assert n.coord.store == 2
+
+    n.run()
+    assert n.coord.store == 50
+    assert n.now > 3.0
+    assert total_msgs(n) == 50 + 25
+
+
+###############################################################################
+def test_statistics_aggregates():
+    k = 10
+    sim = EchoSim(k)
+    n = sim.n
+
+    for site in n.sites.values():
+        site.send("echo", "a msg")
+    n.sites[0].send("echo", "a msg")
+    # the answers run the protocol until the coordinator stores 50
+    for site in n.sites.values():
+        site.send("answer", 1)
+
+    channels = n.channels
+    assert total_msgs(n) == sum(c.msgs for c in channels)
+    assert total_bytes(n) == sum(c.bytes for c in channels)
+    # a site sends on more than one channel
+    assert src_msgs(n, 0) == 2 + 5
+    assert src_bytes(n, 0) == 2 * 5 + 5 * 4
+    assert src_msgs(n, 1) == 1 + 5
+    assert dst_msgs(n, None) == k + 1 + 50
+    assert endpoint_msgs(n, "echo") == k + 1
+    assert endpoint_bytes(n, "answer") == 50 * 4
+    assert type_msgs(n, Channel) == k + 1 + 50
+    assert src_msgs(n, "missing") == 0
+
+    # the coordinator broadcast "call" 5 times; every member received them
+    assert broadcast_msgs(n) == 5 * k
+    assert broadcast_bytes(n) == 5 * 4 * k
+    n.coord.send("echo", "a coord msg")
+    assert broadcast_msgs(n) == 6 * k
+    assert broadcast_bytes(n) == (5 * 4 + 11) * k
+    assert dst_msgs(n, 3) == 6
+    assert dst_bytes(n, 3) == 5 * 4 + 11
+    assert src_msgs(n, None) == 6
+    assert type_msgs(n, MulticastChannel) == 6
+
+    before = total_bytes(n), dst_msgs(n, 3), broadcast_msgs(n)
+    n.traffic.rebuild(channels)
+    assert (total_bytes(n), dst_msgs(n, 3), broadcast_msgs(n)) == before
+
+
+###############################################################################
+def test_channel_store():
+    k = 10
+    sim = EchoSim(k)
+    n = sim.n
+    store = n.counters
+
+    assert len(store) == len(n.channels)
+    assert sorted(c.cid for c in n.channels) == list(range(len(store)))
+
+    before = store.snapshot()
+    for site in n.sites.values():
+        site.send("answer", 1)
+    after = store.snapshot()
+
+    delta = ChannelStore.diff(after, before)
+    assert ChannelStore.sum(delta)["msgs"] == total_msgs(n) == 50 + 5
+    assert ChannelStore.sum(delta)["rx_msgs"] == broadcast_msgs(n) == 5 * k
+    assert ChannelStore.sum(store)["bytes"] == total_bytes(n)
+
+    channel = n.sites[0].proxy.endpoints["answer"].req_channel
+    assert delta["msgs"][channel.cid] == channel.msgs == 5
+
+    n.load_counters(before)
+    assert channel.msgs == 0
+    assert total_msgs(n) == 0
+    assert not hasattr(channel, "__dict__")
+
+
+###############################################################################
+def test_send_batch():
+    k = 3
+    single = EchoSim(k)
+    batched = EchoSim(k)
+
+    msgs = ["a msg"] * 5
+    for msg in msgs:
+        single.n.sites[0].send("echo", msg)
+    batched.n.sites[0].send_batch("echo", msgs)
+
+    assert [c.msgs for c in single.n.channels] == \
+        [c.msgs for c in batched.n.channels]
+    assert [c.bytes for c in single.n.channels] == \
+        [c.bytes for c in batched.n.channels]
+    assert total_bytes(batched.n) == total_bytes(single.n) == 25
+
+    channel = batched.n.sites[0].proxy.endpoints["echo"].req_channel
+    channel.store.msgs[channel.cid] = 0
+    channel.store.bytes[channel.cid] = 0
+    big = list(range(100))
+    channel.transmit_many([big, big])
+    assert (channel.msgs, channel.bytes) == (2, 2 * 100 * INT)
+
+
+###############################################################################
+def test_send_batch_opt_in():
+    @remote_class("coord")
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.calls = 0
+            self.received = []
+
+        def update(self, msg):
+            self.calls += 1
+            self.received.append(msg)
+
+        def update_batch(self, msgs):
+            self.calls += 1
+            self.received.extend(msgs)
+
+    class Site(Sender):
+        def reset(self, msg):
+            pass
+
+    n = StarNetwork(2, coord_type=Coordinator, site_type=Site)
+    n.add_interface("coord", {"update": True})
+    n.add_interface("site", {"reset": True})
+    n.add_sites(2, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    n.sites[0].send_batch("update", [1, 2, 3])
+    n.sites[1].send("update", 4)
+
+    assert n.coord.received == [1, 2, 3, 4]
+    assert n.coord.calls == 2
+    assert total_msgs(n) == 4
+    assert src_bytes(n, 0) == 3 * INT
+
+
+###############################################################################
+def test_link_many_matches_link():
+    def build(bulk):
+        class Coordinator(Sender):
+            def echo(self, msg):
+                pass
+
+            def poll(self, msg):
+                pass
+
+        class Site(Sender):
+            def reset(self, msg):
+                pass
+
+        n = StarNetwork(5, site_type=Site, coord_type=Coordinator)
+        n.add_interface("coord", {"echo": True, "poll": False})
+        n.add_interface("site", {"reset": True})
+        n.add_sites(5, "coord")
+        n.add_coord("site")
+        if bulk:
+            n.setup_connections()
+        else:
+            for site in n.sites.values():
+                n.link(site, n.coord)
+            n.link(n.coord, n.groups[0])
+        for site in n.sites.values():
+            site.send("echo", "a msg")
+            site.send("poll", 1)
+        return n
+
+    def describe(n):
+        return [(type(c), c.src.nid, getattr(c.dst, "nid", "group"),
+                 c.endpoint, c.cid, c.msgs, c.bytes) for c in n.channels]
+
+    single, bulk = build(False), build(True)
+    assert describe(single) == describe(bulk)
+    assert len(bulk.channels) == 5 * 3 + 1
+    for query in (total_bytes, broadcast_msgs):
+        assert query(single) == query(bulk)
+    assert src_bytes(bulk, 2) == src_bytes(single, 2) == 5 + 4
+    assert dst_msgs(bulk, None) == dst_msgs(single, None) == 10
+    assert endpoint_msgs(bulk, "poll") == 5
+    assert bulk.sites[0].proxy.endpoints["poll"].resp_channel is not None
+
+
+###############################################################################
+def test_broadcast_group_handler():
+    k = 1000
+
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.limit = 0.0
+
+        def threshold(self, msg):
+            self.limit = msg
+
+        @classmethod
+        def threshold_group(cls, group, msg):
+            cls.group_calls += 1
+            group.state.fill("limit", msg)
+
+    Site.group_calls = 0
+
+    class Coordinator(Sender):
+        def report(self, msg):
+            pass
+
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"threshold": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    state = GroupState(n.groups[0])
+    state.add_column("limit", 0.0)
+
+    n.coord.send("threshold", 2.5)
+
+    assert Site.group_calls == 1
+    assert state.get(n.sites[7], "limit") == 2.5
+    assert n.sites[7].limit == 0.0
+    assert broadcast_msgs(n) == k
+    assert broadcast_bytes(n) == k * FLOAT
+
+    # without a group handler every member gets the message
+    del Site.threshold_group
+    # joining changes the version of the group, so the handler is resolved
+    n.groups[0].join(n.sites[0])
+    n.coord.send("threshold", 1.5)
+    assert all(site.limit == 1.5 for site in n.sites.values())
+
+
+###############################################################################
+def test_call_returns_result():
+    class Site(Sender):
+        def poll(self, msg):
+            return [self.nid, msg]
+
+    class Coordinator(Sender):
+        def report(self, msg):
+            return msg + 1
+
+    k = 4
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": False})
+    n.add_interface("site", {"poll": False})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    assert n.sites[2].call("report", 41) == 42
+    assert endpoint_msgs(n, "report") == 2
+    assert endpoint_bytes(n, "report") == 2 * INT
+    assert dst_msgs(n, None) == 1
+
+    # a broadcast gathers the replies of all the sites at once
+    assert n.coord.gather("poll", 7) == [[i, 7] for i in range(k)]
+    assert type_msgs(n, MulticastChannel) == 1
+    assert broadcast_msgs(n) == k
+    assert type_msgs(n, FanInChannel) == k
+    assert type_bytes(n, FanInChannel) == k * 2 * INT
+    assert dst_msgs(n, None) == 1 + k
+    # the replies are counted in the store of the network
+    assert ChannelStore.sum(n.counters)["msgs"] == total_msgs(n) == 2 + 1 + k
+    assert len(n.counters) == len(n.channels)
+
+    with pytest.raises(TypeError):
+        n.coord.call("poll", 7)
+
+
+def test_gather_group_handler():
+    class Site(Sender):
+        def poll(self, msg):
+            raise AssertionError("The group handler answers")
+
+        @classmethod
+        def poll_group(cls, group, msg):
+            return [msg * value for value in group.state["value"]]
+
+    class Coordinator(Sender):
+        def report(self, msg):
+            pass
+
+    k = 100
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"poll": False})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    state = GroupState(n.groups[0])
+    state.add_column("value", 1, "q")
+    state["value"][3] = 5
+
+    replies = n.coord.gather("poll", 2)
+    assert len(replies) == k and replies[3] == 10 and replies[4] == 2
+    assert endpoint_msgs(n, "poll") == 1 + k
+    assert endpoint_bytes(n, "poll") == (1 + k) * INT
+
+    # one way methods have no replies
+    with pytest.raises(TypeError):
+        n.sites[0].call("report", 1)
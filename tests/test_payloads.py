@@ -0,0 +1,174 @@
+import array
+import asyncio
+import pickle
+
+import pytest
+
+from components import *
+from coroutines import *
+from payloads import *
+from statistics import *
+
+
+def payload_network(k, dispatcher=None):
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.received = []
+
+        def push(self, msg):
+            self.received.append(msg)
+
+        def change(self, msg):
+            msg["count"] += 1
+
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.received = []
+
+        def report(self, msg):
+            self.received.append(msg)
+
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator,
+                    dispatcher=dispatcher)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"push": True, "change": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    return n
+
+
+###############################################################################
+def test_freeze_zero_copy():
+    values = array.array("d", [1.0, 2.0, 3.0])
+    msg = {"values": values, "keys": [1, 2], "raw": bytearray(b"ab")}
+    frozen = freeze(msg)
+
+    assert isinstance(frozen, FrozenDict) and frozen == {
+        "values": [1.0, 2.0, 3.0], "keys": (1, 2), "raw": b"ab"}
+    assert msg_size(frozen) == msg_size(msg)
+    assert freeze(frozen) is frozen
+
+    # the frozen array is a view of the same memory
+    values[0] = 5.0
+    assert frozen["values"][0] == 5.0
+    assert frozen["values"][1:].tolist() == [2.0, 3.0]
+    with pytest.raises(TypeError):
+        frozen["values"][0] = 1.0
+    with pytest.raises(TypeError):
+        frozen["raw"][0] = 0
+    with pytest.raises(TypeError):
+        frozen["new"] = 1
+    with pytest.raises(TypeError):
+        frozen.update(new=1)
+
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+    assert digest(frozen) != digest(msg)
+    assert digest(freeze(msg)) == digest(frozen)
+
+    if numpy is not None:
+        vector = numpy.arange(4.0)
+        view = freeze(vector)
+        assert numpy.shares_memory(view, vector)
+        with pytest.raises(ValueError):
+            view[0] = 1.0
+        assert msg_size(view) == msg_size(vector)
+        assert numpy.shares_memory(frozen["values"].numpy(), values)
+
+
+###############################################################################
+def test_frozen_delivery():
+    k = 4
+    plain = payload_network(k)
+    n = payload_network(k)
+    n.dispatcher = PayloadDispatcher(n.dispatcher)
+
+    for net in (plain, n):
+        net.coord.send("push", {"a": [1, 2], "b": array.array("i", [3])})
+        for site in net.sites.values():
+            site.send("report", [site.nid, 1.5])
+
+    assert [c.msgs for c in n.channels] == [c.msgs for c in plain.channels]
+    assert [c.bytes for c in n.channels] == \
+        [c.bytes for c in plain.channels]
+
+    # the broadcast reaches every site with the same frozen object
+    first = n.sites[0].received[0]
+    assert all(site.received[0] is first for site in n.sites.values())
+    assert first["a"] == (1, 2) and list(first["b"]) == [3]
+    assert n.coord.received == [(i, 1.5) for i in range(k)]
+
+    with pytest.raises(TypeError):
+        n.coord.send("change", {"count": 0})
+
+
+###############################################################################
+def test_debug_mutations():
+    n = payload_network(2, dispatcher=FifoDispatcher(auto_run=False))
+    n.dispatcher = PayloadDispatcher(n.dispatcher, frozen=False,
+                                     debug=True, retain=True)
+
+    # the sender changes the message before it is delivered
+    msg = [1, 2]
+    n.sites[0].send("report", msg)
+    msg.append(3)
+    with pytest.raises(TypeError, match="between its send"):
+        n.run()
+
+    # a receiver changes the message of a broadcast
+    with pytest.raises(TypeError, match="by its receiver"):
+        n.coord.send("change", {"count": 0})
+        n.run()
+
+    n = payload_network(2)
+    n.dispatcher = PayloadDispatcher(n.dispatcher, frozen=False,
+                                     debug=True, retain=True)
+    msg = {"values": [1.0]}
+    n.coord.send("push", msg)
+    n.sites[1].send("report", 7)
+    assert n.dispatcher.verify() == 2
+
+    # the sender changes the message after the receivers kept it
+    msg["values"].append(2.0)
+    with pytest.raises(TypeError, match="after it was sent"):
+        n.dispatcher.verify()
+
+
+###############################################################################
+def test_debug_async_handlers():
+    class Site(AsyncSender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.received = []
+
+        async def push(self, msg):
+            await asyncio.sleep(0)
+            self.received.append(msg)
+
+        async def change(self, msg):
+            # the mutation happens after the handler was suspended
+            await asyncio.sleep(0)
+            msg["count"] += 1
+
+    class Coordinator(AsyncSender):
+        async def report(self, msg):
+            pass
+
+    n = StarNetwork(2, site_type=Site, coord_type=Coordinator,
+                    dispatcher=AsyncDispatcher())
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"push": True, "change": True})
+    n.add_sites(2, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    n.dispatcher = PayloadDispatcher(n.dispatcher, frozen=False, debug=True)
+
+    n.coord.send("push", [1, 2])
+    n.run()
+    assert [site.received for site in n.sites.values()] == [[[1, 2]]] * 2
+
+    with pytest.raises(TypeError, match="by its receiver"):
+        n.coord.send("change", {"count": 0})
+        n.run()
@@ -0,0 +1,82 @@
+import components
+from components import *
+from profiling import *
+from statistics import *
+from tests.test_network import EchoSim
+
+
+###############################################################################
+def test_profiler_counts_and_restores():
+    k = 4
+    sim = EchoSim(k, limit=10)
+    site = sim.n.sites[0]
+    original_size = components.msg_size
+    original_send = site.proxy.endpoints["answer"].send
+
+    with Profiler(sim.n) as profiler:
+        sim.n.coord.send("call", 0)
+
+    handlers = profiler.aggregate("endpoint")
+    assert handlers[("handler", "answer")].calls == \
+        endpoint_msgs(sim.n, "answer")
+    assert handlers[("handler", "call")].calls == \
+        endpoint_msgs(sim.n, "call")
+    assert handlers[("send", "answer")].calls == \
+        endpoint_msgs(sim.n, "answer")
+    assert handlers[("send", "call")].sizing_calls == \
+        endpoint_msgs(sim.n, "call")
+
+    hosts = profiler.aggregate("host")
+    assert hosts[("send", "coord")].calls == endpoint_msgs(sim.n, "call")
+    assert hosts[("handler", "coord")].calls == \
+        endpoint_msgs(sim.n, "answer")
+
+    for stats in profiler.stats.values():
+        assert stats.own <= stats.total + 1e-9
+
+    # everything is put back
+    assert components.msg_size is original_size
+    assert site.proxy.endpoints["answer"].send is original_send
+    assert "send" not in vars(site)
+
+    report = profiler.report(n=3)
+    assert "Top endpoints" in report and "Top hosts" in report
+
+
+###############################################################################
+def test_profiler_same_results():
+    plain = EchoSim(3, limit=20)
+    plain.n.coord.send("call", 0)
+
+    profiled = EchoSim(3, limit=20)
+    with Profiler(profiled.n):
+        profiled.n.coord.send("call", 0)
+
+    assert total_msgs(plain.n) == total_msgs(profiled.n)
+    assert total_bytes(plain.n) == total_bytes(profiled.n)
+
+
+###############################################################################
+def test_profiler_gather():
+    class Site(Sender):
+        def poll(self, msg):
+            return msg + self.nid
+
+    class Coordinator(Sender):
+        def report(self, msg):
+            pass
+
+    k = 3
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"poll": False})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    with Profiler(n) as profiler:
+        assert n.coord.gather("poll", 10) == [10, 11, 12]
+
+    handlers = profiler.aggregate("endpoint")
+    assert handlers[("handler", "poll")].calls == 1
+    assert isinstance(n.coord.proxy.endpoints["poll"].send, GroupCall)
@@ -0,0 +1,97 @@
+import collections
+import math
+import random
+
+from protocols import *
+from streams import *
+
+
+###############################################################################
+def test_counting_within_eps():
+    k, eps = 20, 0.1
+    rng = random.Random(1)
+    pairs = [(rng.randrange(k), None) for _ in range(20000)]
+
+    batched = CountingNetwork(k, eps)
+    for start in range(0, len(pairs), 500):
+        batched.feed(pairs[start:start + 500])
+    single = CountingNetwork(k, eps)
+    for sid, item in pairs:
+        single.sites[sid].update(item)
+
+    for net in (batched, single):
+        assert (1 - eps) * len(pairs) <= net.estimate() <= len(pairs)
+        assert net.communication()["msgs"] < len(pairs) / 5
+    # checking once per chunk sends fewer messages
+    assert total_msgs(batched) < total_msgs(single)
+    assert batched.communication()["count_msgs"] == \
+        endpoint_msgs(batched, "count")
+
+
+###############################################################################
+def test_heavy_hitters_and_top_k():
+    k, eps = 10, 0.01
+    net = HeavyHittersNetwork(k, eps)
+    driver = StreamDriver(net, ZipfSource(1000, count=30000, seed=2),
+                          round_robin(k), chunk_size=1000)
+    assert net.feed_stream(driver) == 30000
+
+    true = collections.Counter(ZipfSource(1000, count=30000, seed=2))
+    n = sum(true.values())
+    assert (1 - eps) * n <= net.estimate() <= n
+    for key, count in net.top_k(20):
+        assert true[key] - eps * n <= count <= true[key]
+
+    found = {key for key, _ in net.heavy_hitters(0.05)}
+    assert {key for key, count in true.items() if count >= 0.05 * n} <= \
+        found
+    assert all(true[key] >= 0.04 * n for key in found)
+
+    # items fed one by one give the same guarantee
+    single = HeavyHittersNetwork(k, eps)
+    for index, key in enumerate(ZipfSource(1000, count=30000, seed=2)):
+        single.sites[index % k].update(key)
+    assert [key for key, _ in single.top_k(3)] == \
+        [key for key, _ in net.top_k(3)]
+
+
+###############################################################################
+def test_geometric_monitoring_answer():
+    k, threshold = 10, 1.0
+    net = GeometricNetwork(k, 2, threshold)
+    rng = random.Random(3)
+    latest = {sid: (0.0, 0.0) for sid in range(k)}
+    chunks = 0
+
+    for start in range(0, 20000, 100):
+        chunk = []
+        for t in range(start, start + 100):
+            level = 0.5 + 0.8 * math.sin(t / 2000)
+            chunk.append((t % k, (level + rng.gauss(0, 0.05), 0.1)))
+        net.feed(chunk)
+        latest.update(chunk)
+        chunks += 1
+
+        average = [sum(vector[j] for vector in latest.values()) / k
+                   for j in range(2)]
+        assert net.above() == (math.hypot(*average) >= threshold)
+
+    # the sites only synchronize when the answer may change
+    assert 0 < net.coord.syncs < chunks / 2
+    report = net.communication()
+    assert report["violation_msgs"] == net.coord.syncs
+    assert type_msgs(net, FanInChannel) == k * net.coord.syncs
+
+
+###############################################################################
+def test_geometric_single_updates():
+    net = GeometricNetwork(4, 1, 2.0)
+    for value in (1.0, 1.0, 1.0):
+        net.sites[0].update((value,))
+    assert net.coord.syncs == 0
+
+    # one site alone can take the average over the threshold
+    net.sites[1].update((9.0,))
+    assert net.coord.syncs == 1
+    assert net.estimate() == [2.5]
+    assert net.above()
@@ -0,0 +1,134 @@
+import array
+import csv
+import json
+
+from components import *
+from recorder import *
+from statistics import *
+from tests.test_network import EchoSim
+
+
+###############################################################################
+def test_recorder_every_msgs():
+    k = 5
+    sim = EchoSim(k, limit=10)
+    recorder = Recorder(sim.n, every_msgs=10)
+
+    with recorder:
+        sim.n.coord.send("call", 0)
+
+    times, series = recorder.series("msgs", by="endpoint")
+    assert len(times) == len(recorder)
+    # the first snapshot is empty and the last one has the totals
+    assert sum(values[0] for values in series.values()) == 0
+    assert series["answer"][-1] == endpoint_msgs(sim.n, "answer")
+    assert series["call"][-1] == endpoint_msgs(sim.n, "call")
+
+    _, deltas = recorder.series("msgs", deltas=True)
+    assert sum(deltas["answer"]) == endpoint_msgs(sim.n, "answer")
+    assert all(value >= 0 for values in deltas.values() for value in values)
+
+
+###############################################################################
+def test_recorder_channel_ids():
+    sim = EchoSim(3, limit=10)
+    # the channels of a network need not be in the order of their ids
+    sim.n.channels.reverse()
+    recorder = Recorder(sim.n, every_msgs=5)
+
+    with recorder:
+        sim.n.coord.send("call", 0)
+
+    _, series = recorder.series("msgs", by="channel")
+    assert {cid: values[-1] for cid, values in series.items()} == \
+        {channel.cid: channel.msgs for channel in sim.n.channels}
+
+
+###############################################################################
+def test_recorder_ring_buffer():
+    sim = EchoSim(4, limit=20)
+    full = Recorder(sim.n, every_msgs=4)
+    ring = Recorder(sim.n, every_msgs=4, capacity=3)
+
+    with full, ring:
+        sim.n.coord.send("call", 0)
+
+    assert len(full) > 3
+    assert len(ring) == 3
+    _, full_series = full.series("bytes", by="src")
+    _, ring_series = ring.series("bytes", by="src")
+    for key, values in ring_series.items():
+        assert values == full_series[key][-3:]
+
+
+###############################################################################
+def test_recorder_every_time():
+    sim = EchoSim(3, limit=5, dispatcher=TimedDispatcher())
+    sim.n.set_link_model(LinkModel(latency=1.0))
+    recorder = Recorder(sim.n, every_time=2.0)
+
+    with recorder:
+        sim.n.coord.send("call", 0)
+
+    times = list(recorder.times)
+    assert times == sorted(times)
+    assert len(recorder) >= 3
+
+
+###############################################################################
+def test_recorder_export(tmp_path):
+    sim = EchoSim(3, limit=5)
+    recorder = Recorder(sim.n, every_msgs=3)
+    with recorder:
+        sim.n.coord.send("call", 0)
+
+    recorder.to_csv(tmp_path / "bytes.csv", by="endpoint", deltas=True)
+    with open(tmp_path / "bytes.csv") as f:
+        rows = list(csv.reader(f))
+    assert rows[0][0] == "time"
+    assert len(rows) == len(recorder) + 1
+
+    recorder.to_columns(tmp_path / "columns")
+    with open(tmp_path / "columns" / "schema.json") as f:
+        schema = json.load(f)
+    assert schema["rows"] == len(recorder)
+    assert len(schema["channels"]) == len(sim.n.channels)
+
+    values = array.array("q")
+    with open(tmp_path / "columns" / "msgs.bin", "rb") as f:
+        values.frombytes(f.read())
+    width = len(sim.n.channels)
+    assert sum(values[-width:]) == total_msgs(sim.n)
+
+
+###############################################################################
+def test_recorder_fan_in(tmp_path):
+    class Site(Sender):
+        def poll(self, msg):
+            return msg
+
+    class Coordinator(Sender):
+        def report(self, msg):
+            pass
+
+    k = 4
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"poll": False})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    recorder = Recorder(n, every_msgs=1)
+    with recorder:
+        n.coord.gather("poll", 1)
+    width = len(n.channels)
+    assert len(recorder.row("msgs", len(recorder) - 1)) == width
+    times, result = recorder.series("msgs", by="src")
+    assert result["group"][-1] == k and result[None][-1] == 1
+
+    recorder.to_columns(tmp_path / "columns")
+    with open(tmp_path / "columns" / "schema.json") as f:
+        schema = json.load(f)
+    assert {c["src"] for c in schema["channels"]} == \
+        {None, "group"} | set(range(k))
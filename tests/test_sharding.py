@@ -0,0 +1,134 @@
+import os
+
+import pytest
+
+from components import *
+from sharding import *
+from statistics import *
+
+
+###############################################################################
+def counting_network(k=6, threshold=4):
+    """
+    Sites count their items and report every `threshold` of them. When the
+    coordinator has heard of k reports it halves the threshold of all sites.
+    """
+
+    @remote_class("coord")
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.total = 0
+            self.reports = []
+
+        def report(self, msg):
+            self.total += msg[1]
+            self.reports.append(msg)
+            if len(self.reports) % k == 0:
+                self.send("threshold", max(1, threshold // 2))
+
+    @remote_class("site")
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.count = 0
+            self.limit = threshold
+
+        def update(self, item):
+            self.count += item
+            if self.count >= self.limit:
+                self.send("report", (self.nid, self.count))
+                self.count = 0
+
+        def threshold(self, value):
+            self.limit = value
+
+    net = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    net.add_interface("coord", {"report": True})
+    net.add_interface("site", {"threshold": True})
+    net.add_sites(k, "coord")
+    net.add_coord("site")
+    net.setup_connections()
+    return net
+
+
+def epochs(k=6, n=20):
+    return [[(i % k, (i * 7 + e) % 3 + 1) for i in range(n)]
+            for e in range(10)]
+
+
+###############################################################################
+def test_partition():
+    assert partition(range(7), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+
+
+###############################################################################
+def test_sharded_run_matches_single_process():
+    single = ShardedRunner(counting_network, processes=0).run(epochs())
+    sharded = ShardedRunner(counting_network, processes=3).run(epochs())
+
+    assert single.coord.reports == sharded.coord.reports
+    assert single.coord.total == sharded.coord.total > 0
+    for column in ChannelStore.COLUMNS:
+        assert list(single.counters.snapshot()[column]) == \
+            list(sharded.counters.snapshot()[column])
+    assert total_bytes(single) == total_bytes(sharded)
+    assert broadcast_msgs(sharded) == broadcast_msgs(single)
+
+
+###############################################################################
+def test_shard_group_handler():
+    calls = []
+
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.limit = 4
+
+        def threshold(self, value):
+            self.limit = value
+
+        @classmethod
+        def threshold_group(cls, group, value, mask=None):
+            calls.append(None if mask is None else list(mask))
+            for member, received in zip(group.members, mask):
+                if received:
+                    member.limit = value
+
+    class Coordinator(Sender):
+        def report(self, msg):
+            pass
+
+    net = StarNetwork(4, site_type=Site, coord_type=Coordinator)
+    net.add_interface("coord", {"report": True})
+    net.add_interface("site", {"threshold": True})
+    net.add_sites(4, "coord")
+    net.add_coord("site")
+    net.setup_connections()
+
+    shard = Shard(net, [1, 3])
+    channel = net.coord.proxy.endpoints["threshold"].req_channel
+    assert shard.deliver([(net.coord.nid, channel.cid, False, 1)]) == []
+    # the group handler ran once, for the sites of the shard
+    assert calls == [[False, True, False, True]]
+    assert [site.limit for site in net.sites.values()] == [4, 1, 4, 1]
+
+
+def crashing_network():
+    net = counting_network()
+    site = net.sites[4]
+
+    def update(item):
+        os._exit(3)
+
+    site.update = update
+    return net
+
+
+###############################################################################
+def test_dead_shard_process():
+    runner = ShardedRunner(crashing_network, processes=3)
+    with pytest.raises(RuntimeError, match=r"sites 4\.\.5\) exited with "
+                                           r"code 3"):
+        runner.run(epochs())
+    assert not any(shard.process.is_alive() for shard in runner.shards)
@@ -0,0 +1,87 @@
+import multiprocessing
+
+import pytest
+
+from components import *
+from shared import *
+from statistics import *
+from tests.test_sharding import counting_network
+
+
+def feed(net, site_ids, rounds=8):
+    for _ in range(rounds):
+        for nid in site_ids:
+            net.sites[nid].update(1)
+    return net
+
+
+def worker(store, site_ids):
+    net = counting_network()
+    net.set_counters(store)
+    feed(net, site_ids)
+    store.close()
+
+
+###############################################################################
+def test_shared_counters_across_processes():
+    # the same runs in this process, one network per worker
+    shards = [[0, 1], [2, 3], [4, 5]]
+    singles = [feed(counting_network(), site_ids) for site_ids in shards]
+
+    net = counting_network()
+    store = SharedChannelStore(len(net.counters), 3)
+    try:
+        processes = [multiprocessing.Process(target=worker,
+                                             args=(store.attach(slot),
+                                                   shards[slot]))
+                     for slot in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        net.set_counters(store.reader())
+        refresh(net)
+        assert total_msgs(net) == sum(map(total_msgs, singles)) > 0
+        assert total_bytes(net) == sum(map(total_bytes, singles))
+        assert broadcast_msgs(net) == sum(map(broadcast_msgs, singles))
+        for site_ids, single in zip(shards, singles):
+            for nid in site_ids:
+                assert src_msgs(net, nid) == src_msgs(single, nid)
+                assert dst_msgs(net, nid) == dst_msgs(single, nid) + \
+                    sum(broadcast_msgs(other) for other in singles
+                        if other is not single) // 6
+        with pytest.raises(TypeError):
+            refresh(singles[0])
+        net.counters.close()
+    finally:
+        store.unlink()
+
+
+###############################################################################
+def test_shared_store_slots():
+    store = SharedChannelStore(4, 2)
+    try:
+        first, second = store.attach(0), store.attach(1)
+        first.allocate(3)
+        second.allocate(3)
+        first.msgs[1] += 2
+        second.msgs[1] += 5
+        second.bytes[2] += 8
+        assert list(first.snapshot()["msgs"]) == [0, 2, 0]
+
+        reader = store.reader()
+        reader.allocate(3)
+        merged = reader.merged()
+        assert list(merged["msgs"]) == [0, 7, 0]
+        assert list(merged["bytes"]) == [0, 0, 8]
+
+        with pytest.raises(TypeError):
+            first.allocate(2)
+        with pytest.raises(TypeError):
+            store.attach(2)
+        for each in (first, second, reader):
+            each.close()
+    finally:
+        store.unlink()
@@ -0,0 +1,184 @@
+import collections
+import random
+
+import pytest
+
+from components import *
+from sketches import *
+from statistics import *
+
+
+def zipf_items(count, seed):
+    rng = random.Random(seed)
+    return [min(int(rng.paretovariate(1.0)), 10 ** 6) for _ in range(count)]
+
+
+###############################################################################
+def test_count_min():
+    items = zipf_items(20000, 1)
+    true = collections.Counter(items)
+    sketch = CountMin.from_error(0.01, 0.01, seed=3)
+    sketch.update_many(items)
+
+    for item in (1, 2, 10, 999):
+        assert true[item] <= sketch.query(item) <= \
+            true[item] + 0.01 * len(items)
+    assert msg_size(sketch) == 3 * INT + INT * sketch.width * sketch.depth
+
+    # one by one, or merged from two halves, gives the same cells
+    single = CountMin.from_error(0.01, 0.01, seed=3)
+    for item in items[:10000]:
+        single.update(item)
+    half = CountMin.from_error(0.01, 0.01, seed=3)
+    half.update_many(items[10000:])
+    assert list(single.merge(half).cells) == list(sketch.cells)
+
+    with pytest.raises(TypeError):
+        sketch.merge(CountMin.from_error(0.01, 0.01, seed=4))
+
+
+###############################################################################
+def test_same_cells_for_every_input():
+    items = [1, 2, 3, 5, 1, -4, 2 ** 40]
+    pairs = [(item, "a") for item in items]
+    feeds = [(items, items), (pairs, pairs)]
+    if numpy is not None:
+        # NumPy ints are the same items as Python ints
+        vector = numpy.array(items)
+        feeds += [(vector, items), (list(vector), items),
+                  ([(item, "a") for item in vector], pairs)]
+
+    def cells(cls, values, many):
+        sketch = cls(50, 3, seed=1)
+        if many:
+            sketch.update_many(values)
+        else:
+            for value in values:
+                sketch.update(value)
+        return list(sketch.cells)
+
+    for cls in (CountMin, AMS):
+        for values, same in feeds:
+            expected = cells(cls, same, False)
+            assert cells(cls, values, False) == expected
+            assert cells(cls, values, True) == expected
+
+    sketch = CountMin(50, 3, seed=1)
+    sketch.update_many(feeds[-1][0])
+    assert sketch.query((1, "a")) == 2
+
+
+###############################################################################
+def test_ams_and_hyperloglog():
+    items = zipf_items(20000, 2)
+    true = collections.Counter(items)
+
+    ams = AMS(512, 5, seed=1)
+    ams.update_many(items)
+    f2 = sum(count * count for count in true.values())
+    assert abs(ams.second_moment() - f2) < 0.1 * f2
+
+    hll = HyperLogLog(10, seed=1)
+    hll.update_many(items)
+    assert abs(hll.estimate() - len(true)) < 0.1 * len(true)
+    assert msg_size(hll) == 2 * INT + CHAR * 1024
+
+    strings = HyperLogLog(12)
+    for index in range(30000):
+        strings.update(f"key{index}")
+    assert abs(strings.estimate() - 30000) < 0.05 * 30000
+
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+
+
+###############################################################################
+def test_reservoir():
+    reservoir = Reservoir(200, seed=1)
+    reservoir.update_many([float(i) for i in range(50000)])
+    sample = reservoir.sample()
+    assert len(sample) == 200 and len(set(sample)) == 200
+    assert abs(sum(sample) / 200 - 25000) < 4000
+    assert msg_size(reservoir) == 2 * INT + 200 * FLOAT
+
+    # only the sampled items of a reservoir that is not full are sent
+    partial = Reservoir(1000)
+    partial.update_many([1.0, 2.0, 3.0])
+    assert msg_size(partial) == 2 * INT + 3 * FLOAT
+
+    other = Reservoir(200, seed=2)
+    for i in range(50000, 60000):
+        other.update(float(i))
+    reservoir.merge(other)
+    assert reservoir.seen == 60000 and len(reservoir) == 200
+    # about one sixth of the merged sample comes from the second stream
+    assert 10 < sum(value >= 50000 for value in reservoir.sample()) < 70
+
+
+###############################################################################
+def test_deltas():
+    sketch = CountMin(64, 3, seed=1)
+    replica = CountMin(64, 3, seed=1)
+    sketch.update_many([1, 2, 3, 3])
+    delta = sketch.delta()
+    assert len(delta) == 9
+    replica.apply(delta)
+    assert list(replica.cells) == list(sketch.cells)
+
+    # only the cells that changed travel, with varint gaps and values
+    sketch.update(3)
+    delta = sketch.delta()
+    assert len(delta) == 3
+    assert msg_size(delta) <= 3 * INT + 3 * 2 + 3
+    replica.apply(delta)
+    assert replica.query(3) == 3
+    assert len(sketch.delta()) == 0
+
+    registers = HyperLogLog(6)
+    copy = HyperLogLog(6)
+    registers.update_many(range(100))
+    copy.update_many(range(50))
+    copy.apply(registers.delta())
+    assert list(copy.cells) == list(registers.cells)
+
+    with pytest.raises(TypeError):
+        CountMin(32, 3, seed=1).apply(delta)
+
+
+###############################################################################
+def test_send_deltas():
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.sketch = CountMin(128, 4, seed=7)
+
+        def sketch_delta(self, delta):
+            self.sketch.apply(delta)
+
+    class Site(Sender):
+        def flush(self, msg):
+            pass
+
+    k = 4
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"sketch_delta": True})
+    n.add_interface("site", {"flush": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    sketches = [CountMin(128, 4, seed=7) for _ in range(k)]
+    items = zipf_items(4000, 3)
+    sent = 0
+    for start in range(0, len(items), 1000):
+        for sid, sketch in enumerate(sketches):
+            sketch.update_many(items[start + sid::k][:250])
+            delta = sketch.delta()
+            sent += msg_size(delta)
+            n.sites[sid].send("sketch_delta", delta)
+
+    total = CountMin(128, 4, seed=7)
+    total.update_many(items)
+    assert list(n.coord.sketch.cells) == list(total.cells)
+    assert endpoint_bytes(n, "sketch_delta") == sent
+    assert sent < 4 * msg_size(total) * k
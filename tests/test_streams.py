@@ -0,0 +1,106 @@
+from components import *
+from streams import *
+from statistics import *
+
+
+###############################################################################
+def test_csv_source_resume(tmp_path):
+    path = tmp_path / "trace.csv"
+    path.write_text("site,value\n0,1.5\n1,2.5\n\n2,3.5\n")
+
+    source = CsvSource(path, types=(int, float), header=True, chunk_size=8)
+    records = iter(source)
+    assert next(records) == (0, 1.5)
+    records.close()
+
+    rest = CsvSource(path, types=(int, float), header=True,
+                     start=source.offset)
+    assert list(rest) == [(1, 2.5), (2, 3.5)]
+    assert rest.offset == path.stat().st_size
+
+
+###############################################################################
+def test_tsv_and_json_lines(tmp_path):
+    tsv = tmp_path / "trace.tsv"
+    tsv.write_text("a\tb\nc\td\n")
+    assert list(TsvSource(tsv)) == [("a", "b"), ("c", "d")]
+
+    jsonl = tmp_path / "trace.jsonl"
+    jsonl.write_text('{"site": 1}\n0\n[1, 2]\n')
+    assert list(JsonLinesSource(jsonl)) == [{"site": 1}, 0, [1, 2]]
+
+
+###############################################################################
+def test_binary_source(tmp_path):
+    path = tmp_path / "trace.bin"
+    BinarySource.write(path, "<qd", ((i, i / 2) for i in range(100)))
+
+    source = BinarySource(path, "<qd", chunk_records=7)
+    assert len(source) == 100
+    assert list(source) == [(i, i / 2) for i in range(100)]
+    assert list(BinarySource(path, "<qd", start=98)) == [(98, 49.0),
+                                                         (99, 49.5)]
+
+
+###############################################################################
+def test_synthetic_sources():
+    zipf = list(ZipfSource(100, s=1.2, count=1000, seed=1))
+    assert zipf == list(ZipfSource(100, s=1.2, count=1000, seed=1))
+    assert all(1 <= key <= 100 for key in zipf)
+    assert zipf.count(1) > zipf.count(50)
+
+    uniform = UniformSource(0, 9, count=10, seed=3)
+    first = list(uniform)
+    assert list(UniformSource(0, 9, count=10, seed=3, start=4)) == first[4:]
+
+
+###############################################################################
+def test_assigners():
+    assert [round_robin(3)(i, None) for i in range(5)] == [0, 1, 2, 0, 1]
+
+    assign = hash_by_key(4, key=0)
+    assert assign(0, ("key", 1)) == assign(9, ("key", 2))
+    assert 0 <= assign(0, ("other", 1)) < 4
+    # strided int keys are spread over the sites too
+    assert len({assign(0, (key * 4, 1)) for key in range(100)}) == 4
+
+    assert from_trace(1)(0, ("x", 3)) == 3
+
+
+###############################################################################
+def test_stream_driver():
+    k = 3
+
+    @remote_class("coord")
+    class Coordinator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.total = 0
+
+        def report(self, msg):
+            self.total += msg
+
+    class Site(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.items = []
+
+        def update(self, item):
+            self.items.append(item)
+            self.send("report", item)
+
+        def reset(self, msg):
+            pass
+
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"reset": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    driver = StreamDriver(n, range(10), round_robin(k), chunk_size=4)
+    assert driver.run() == 10
+    assert n.sites[1].items == [1, 4, 7]
+    assert n.coord.total == 45
+    assert total_msgs(n) == 10
@@ -0,0 +1,64 @@
+from components import *
+from statistics import *
+from streams import *
+from sweep import *
+
+
+def summing_network(k):
+    @remote_class("coord")
+    class Coordinator(Sender):
+        def report(self, msg):
+            pass
+
+    class Site(Sender):
+        def update(self, item):
+            self.send("report", item)
+
+        def reset(self, msg):
+            pass
+
+    n = StarNetwork(k, site_type=Site, coord_type=Coordinator)
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"reset": True})
+    n.add_sites(k, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+    return n
+
+
+def simulate(inputs, k, every):
+    if k < 0:
+        raise ValueError("k must not be negative")
+    n = summing_network(k)
+    trace = [int(value) for value in inputs["trace"]]
+    StreamDriver(n, trace[::every], round_robin(k)).run()
+    return n
+
+
+###############################################################################
+def test_grid():
+    assert grid(k=[1, 2], every=[3]) == [{"k": 1, "every": 3},
+                                         {"k": 2, "every": 3}]
+
+
+###############################################################################
+def test_sweep_parallel_matches_serial(tmp_path):
+    configurations = grid(k=[2, 5], every=[1, 3])
+    with SharedArray.create(range(60), "q") as trace:
+        serial = run_sweep(simulate, configurations, {"trace": trace},
+                           processes=0)
+        parallel = run_sweep(simulate, configurations + [{"k": -1,
+                                                          "every": 1}],
+                             {"trace": trace}, processes=2)
+
+    assert serial.column("total_msgs") == [60, 20, 60, 20]
+    assert parallel.column("total_msgs")[:4] == serial.column("total_msgs")
+    assert parallel.column("total_bytes")[:4] == \
+        serial.column("total_bytes")
+    assert all(seconds >= 0 for seconds in parallel.column("seconds"))
+    assert "ValueError" in parallel.rows[-1]["error"]
+    assert len(parallel.where(k=5)) == 2
+
+    parallel.to_csv(tmp_path / "sweep.csv")
+    header = (tmp_path / "sweep.csv").read_text().splitlines()[0]
+    assert header.startswith("k,every,seconds,total_msgs")
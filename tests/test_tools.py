@@ -0,0 +1,78 @@
+import array
+from collections import namedtuple
+
+import pytest
+
+import tools
+from tools import *
+
+
+@pytest.fixture
+def sizers():
+    """
+    Puts back the sizer tables after a test that registers sizers.
+    """
+    tables = (tools._SIZERS, tools._FIXED_SIZES, tools._RESOLVED)
+    saved = [table.copy() for table in tables]
+    yield
+    for table, copy in zip(tables, saved):
+        table.clear()
+        table.update(copy)
+
+
+###############################################################################
+def test_msg_size_basic_types():
+    assert msg_size(1) == INT
+    assert msg_size(True) == INT
+    assert msg_size(1.5) == FLOAT
+    assert msg_size("abc") == 3 * CHAR
+    assert msg_size(None) == 0
+    assert msg_size((1, 2.0, "ab")) == INT + FLOAT + 2 * CHAR
+    assert msg_size({"a": 1, "b": [1.0, 2.0]}) == INT + 2 * FLOAT
+
+
+###############################################################################
+def test_msg_size_homogeneous_and_buffers():
+    assert msg_size(list(range(100))) == 100 * INT
+    assert msg_size([1.0] * 10 + [1]) == 10 * FLOAT + INT
+    assert msg_size(b"abcd") == 4 * CHAR
+    assert msg_size(memoryview(bytearray(8))) == 8 * CHAR
+    # arrays have the same size as the list of their numbers
+    assert msg_size(array.array("q", range(10))) == msg_size(list(range(10)))
+    assert msg_size(array.array("d", [1.0, 2.0])) == 2 * FLOAT
+
+    if numpy is not None:
+        vector = numpy.array([1, 2, 3])
+        assert msg_size(vector) == 3 * INT
+        # the items of an array, e.g. the replies of a group handler
+        assert msg_size(vector[0]) == INT
+        assert msg_size(numpy.float32(1.0)) == FLOAT
+        assert msg_size(list(vector)) == msg_size(vector)
+
+
+###############################################################################
+def test_msg_size_subclasses():
+    Point = namedtuple("Point", "x y")
+
+    assert msg_size(Point(1, 2.0)) == INT + FLOAT
+    assert msg_size([Point(1, 2), Point(3, 4)]) == 4 * INT
+
+
+###############################################################################
+def test_register_sizer(sizers):
+    class Sketch:
+        def __init__(self, width):
+            self.width = width
+
+    class Tagged(Sketch):
+        pass
+
+    with pytest.raises(TypeError):
+        msg_size(Sketch(3))
+
+    register_sizer(Sketch, lambda s: s.width * INT)
+    assert msg_size(Sketch(3)) == 3 * INT
+    assert msg_size(Tagged(2)) == 2 * INT
+
+    register_sizer(Sketch, 16)
+    assert msg_size([Sketch(3), Tagged(5)]) == 32
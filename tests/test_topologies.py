@@ -0,0 +1,132 @@
+from components import *
+from statistics import *
+from topologies import *
+
+
+def aggregation_tree(parents):
+    @remote_class("up")
+    class Root(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.total = 0
+            self.reports = 0
+
+        def report(self, msg):
+            self.total += msg
+            self.reports += 1
+
+    class Aggregator(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.sum = 0
+            self.pending = 0
+
+        def report(self, msg):
+            self.sum += msg
+            self.pending += 1
+            if self.pending == len(self.net.child_ids[self.nid]):
+                self.send("report", self.sum)
+                self.sum = self.pending = 0
+
+        def reset(self, msg):
+            self.send("reset", msg, to=self.net.children(self))
+
+    class Leaf(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.resets = 0
+
+        def report(self, msg):
+            pass
+
+        def reset(self, msg):
+            self.resets += 1
+
+    n = TreeNetwork(parents, leaf_type=Leaf, inner_type=Aggregator,
+                    root_type=Root)
+    n.add_interface("up", {"report": True})
+    n.add_interface("down", {"reset": True})
+    n.add_nodes("up", "down")
+    n.setup_connections()
+    return n
+
+
+###############################################################################
+def test_parents():
+    assert kary_parents(2, 2) == [None, 0, 0, 1, 1, 2, 2]
+    assert level_parents([1, 3]) == [None, 0, 1, 1, 1]
+
+
+###############################################################################
+def test_tree_aggregation():
+    # 3 aggregators with 4 sites each
+    n = aggregation_tree(level_parents([3, 4]))
+    assert len(n.sites) == 12
+    assert n.depth(n.sites[0].nid) == 2
+
+    for site in n.sites.values():
+        site.send("report", 1)
+    assert n.root.total == 12
+    assert n.root.reports == 3
+    # the root only receives from the aggregators
+    assert dst_msgs(n, n.root.nid) == 3
+    assert total_msgs(n) == 15
+
+    n.root.send("reset", None)
+    assert all(site.resets == 1 for site in n.sites.values())
+    # one broadcast from the root and one from every aggregator
+    assert endpoint_msgs(n, "reset") == 4
+    assert broadcast_msgs(n) == 3 + 12
+
+
+###############################################################################
+def test_tree_matches_star():
+    n = aggregation_tree(level_parents([5]))
+    for site in n.sites.values():
+        site.send("report", 2)
+    assert n.root.total == 10
+    assert len(n.channels) == 5 + 1
+
+
+###############################################################################
+def test_multi_proxy_send():
+    n = aggregation_tree(kary_parents(2, 2))
+    aggregator = n.nodes[1]
+    assert len(aggregator.all_proxies()) == 2
+    assert aggregator.proxy_to(n.root) is aggregator.proxy
+    try:
+        aggregator.send("reset", None, to=n.nodes[2])
+    except TypeError:
+        pass
+    else:
+        assert False, "nodes 1 and 2 are not linked"
+
+
+###############################################################################
+def test_graph_ring():
+    k = 5
+
+    @remote_class("peer")
+    class Peer(Sender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.seen = 0
+
+        def token(self, hops):
+            self.seen += 1
+            if hops:
+                successor = (self.nid + 1) % k
+                self.send("token", hops - 1, to=self.net.nodes[successor])
+
+    n = GraphNetwork([(i, (i + 1) % k) for i in range(k)], node_type=Peer,
+                     directed=False)
+    n.add_interface("peer", {"token": True})
+    n.add_nodes("peer")
+    n.setup_connections()
+
+    assert sorted(n.neighbours(0)) == [1, 4]
+    n.nodes[0].send("token", 9, to=n.nodes[1])
+    assert [n.nodes[i].seen for i in range(k)] == [2, 2, 2, 2, 2]
+    assert total_msgs(n) == 10
+    assert src_msgs(n, 0) == 2
+    assert len(n.channels) == 2 * k
@@ -0,0 +1,140 @@
+import asyncio
+
+from components import *
+from coroutines import *
+from faults import PartialCall
+from statistics import *
+from tests.test_sharding import counting_network, epochs
+from traces import *
+
+
+def record(path, **kwargs):
+    net = counting_network()
+    with TraceWriter(path, **kwargs) as writer:
+        net.dispatcher = TraceDispatcher(net.dispatcher, writer)
+        for items in epochs():
+            for nid, value in items:
+                net.sites[nid].update(value)
+    return net
+
+
+###############################################################################
+def test_record_and_replay(tmp_path):
+    path = tmp_path / "run.trace"
+    net = record(path, block_records=16)
+
+    with TraceReader(path) as reader:
+        reports = total_msgs(net) - broadcast_msgs(net) // 6
+        assert len(reader) == reports + broadcast_msgs(net) // 6
+        assert len(reader.blocks) == (len(reader) + 15) // 16
+
+        first = next(iter(reader))
+        assert first.endpoint == "report" and first.dst is None
+        assert first.size == 2 * INT and first.msg == net.coord.reports[0]
+        broadcast = next(r for r in reader if r.endpoint == "threshold")
+        assert broadcast.src is None and broadcast.dst == "group"
+
+        # the records of any offset, without reading the earlier blocks
+        records = list(reader)
+        assert list(reader.records(21, 40)) == records[21:40]
+        assert list(reader.records(len(reader) - 1)) == records[-1:]
+
+        replayed = counting_network()
+        replayer = Replayer(replayed, reader)
+        assert replayer.run() == len(reader)
+
+    assert replayed.coord.reports == net.coord.reports
+    assert [site.limit for site in replayed.sites.values()] == \
+        [site.limit for site in net.sites.values()]
+    assert list(replayed.counters.snapshot()["bytes"]) == \
+        list(net.counters.snapshot()["bytes"])
+    assert total_msgs(replayed) == total_msgs(net)
+    # the reports came from the stream; the broadcasts from the coordinator
+    assert replayer.external == reports and replayer.unmatched() == 0
+
+
+###############################################################################
+def test_append_and_truncated_trace(tmp_path):
+    path = tmp_path / "run.trace"
+    net = record(path, block_records=10, compress=False)
+    with TraceReader(path) as reader:
+        count = len(reader)
+        records = list(reader)
+
+    # a crash in the middle of the last block loses only that block
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 3)
+    with TraceReader(path) as reader:
+        assert len(reader) == (count - 1) // 10 * 10
+
+    with TraceWriter(path, append=True, block_records=10) as writer:
+        net.dispatcher = TraceDispatcher(FifoDispatcher(), writer)
+        net.sites[0].send("report", (0, 99))
+    with TraceReader(path) as reader:
+        appended = list(reader)
+    assert appended[:-1] == records[:len(appended) - 1]
+    assert appended[-1].msg == (0, 99)
+
+
+###############################################################################
+def test_replay_recorded_size(tmp_path):
+    path = tmp_path / "run.trace"
+    net = counting_network()
+    channel = net.sites[0].proxy.endpoints["report"].req_channel
+    # e.g. a size by an encoder or a sizer of the recording process
+    with TraceWriter(path) as writer:
+        writer.write(0.0, channel, 100, False, (0, 1))
+
+    replayed = counting_network()
+    with TraceReader(path) as reader:
+        replayer = Replayer(replayed, reader)
+        assert replayer.run() == 1
+    channel = replayed.sites[0].proxy.endpoints["report"].req_channel
+    assert channel.msgs == 1 and channel.bytes == 100
+    assert replayer.external == 1
+
+
+###############################################################################
+def test_record_async_broadcast(tmp_path):
+    class Site(AsyncSender):
+        def __init__(self, net, nid, ifc):
+            super().__init__(net, nid, ifc)
+            self.received = []
+
+        async def push(self, msg):
+            await asyncio.sleep(0)
+            self.received.append(msg)
+
+    class Coordinator(AsyncSender):
+        async def report(self, msg):
+            pass
+
+    n = StarNetwork(3, site_type=Site, coord_type=Coordinator,
+                    dispatcher=AsyncDispatcher())
+    n.add_interface("coord", {"report": True})
+    n.add_interface("site", {"push": True})
+    n.add_sites(3, "coord")
+    n.add_coord("site")
+    n.setup_connections()
+
+    path = tmp_path / "run.trace"
+    with TraceWriter(path) as writer:
+        n.dispatcher = TraceDispatcher(n.dispatcher, writer)
+        n.coord.send("push", 7)
+        n.run()
+    assert [site.received for site in n.sites.values()] == [[7]] * 3
+
+    with TraceReader(path) as reader:
+        records = list(reader)
+    assert len(records) == 1
+    assert records[0].dst == "group" and records[0].msg == 7
+
+
+###############################################################################
+def test_is_batch_through_wrappers():
+    net = counting_network()
+    endpoint = net.coord.proxy.endpoints["threshold"]
+    channel = endpoint.req_channel
+    for func, batch in ((endpoint.send, False), (endpoint.send_batch, True)):
+        stacked = TracedCall(PartialCall(func, [0]), channel, 8, batch, None)
+        assert is_batch(channel, func) == is_batch(channel, stacked) == batch
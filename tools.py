@@ -1,4 +1,13 @@
+import array
+import contextlib
 import functools
+import gc
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 CHAR = 1
 INT = 4
@@ -11,36 +20,258 @@ FLOAT = 8
 #
 ###############################################################################
 
+def _scalar_sizer(size):
+    def sizer(msg):
+        return size
+
+    sizer.fixed = size
+    return sizer
+
+
+def _str_size(msg):
+    return CHAR * len(msg)
+
+
+def _bytes_size(msg):
+    return CHAR * len(msg)
+
+
+def _memoryview_size(msg):
+    return CHAR * msg.nbytes
+
+
+def _sequence_size(msg):
+    if not msg:
+        return 0
+    fixed_sizes = _FIXED_SIZES
+    # homogeneous sequences of fixed size scalars are sized in one step
+    fixed = fixed_sizes.get(type(msg[0]))
+    if fixed is not None and len(set(map(type, msg))) == 1:
+        return fixed * len(msg)
+
+    sizers = _SIZERS
+    byte_size = 0
+    for x in msg:
+        cls = type(x)
+        fixed = fixed_sizes.get(cls)
+        if fixed is not None:
+            byte_size += fixed
+        else:
+            sizer = sizers.get(cls)
+            if sizer is None:
+                sizer = _resolve_sizer(cls)
+            byte_size += sizer(x)
+    return byte_size
+
+
+def _dict_size(msg):
+    return _sequence_size(list(msg.values()))
+
+
+# the size of a single item of an array.array for each typecode
+_ARRAY_ITEM_SIZES = dict.fromkeys("bBhHiIlLqQ", INT)
+_ARRAY_ITEM_SIZES.update(dict.fromkeys("fd", FLOAT))
+_ARRAY_ITEM_SIZES["u"] = CHAR
+
+
+def _array_size(msg):
+    return _ARRAY_ITEM_SIZES[msg.typecode] * len(msg)
+
+
+# the size of a single item of a numpy array for each dtype kind
+_NUMPY_ITEM_SIZES = dict.fromkeys("biu", INT)
+_NUMPY_ITEM_SIZES["f"] = FLOAT
+
+
+def _ndarray_size(msg):
+    item_size = _NUMPY_ITEM_SIZES.get(msg.dtype.kind)
+    if item_size is None:
+        return CHAR * msg.nbytes
+    return item_size * msg.size
+
+
+_SIZERS = {
+    type(None): _scalar_sizer(0),
+    bool: _scalar_sizer(INT),
+    int: _scalar_sizer(INT),
+    float: _scalar_sizer(FLOAT),
+    str: _str_size,
+    bytes: _bytes_size,
+    bytearray: _bytes_size,
+    memoryview: _memoryview_size,
+    array.array: _array_size,
+    tuple: _sequence_size,
+    list: _sequence_size,
+    dict: _dict_size,
+}
+
+if numpy is not None:
+    _SIZERS[numpy.ndarray] = _ndarray_size
+    # numpy scalars, e.g. the items of a numpy array
+    _SIZERS[numpy.generic] = _ndarray_size
+
+# the types whose messages always have the same size
+_FIXED_SIZES = {cls: sizer.fixed for cls, sizer in _SIZERS.items()
+                if hasattr(sizer, "fixed")}
+
+
+def register_sizer(cls, sizer):
+    """
+    Registers the function that calculates the size of a message type.
+
+    Subclasses of `cls` use the same sizer, unless they are registered
+    themselves. A sizer may also be an int, for types whose messages always
+    have the same size.
+
+    :param cls: the type of the message
+    :param sizer: a function that takes a message and returns its size in
+        bytes, or a fixed size
+    :return: None
+    """
+    if isinstance(sizer, int):
+        sizer = _scalar_sizer(sizer)
+    elif not callable(sizer):
+        raise TypeError(f"The sizer of {cls.__name__!r} must be callable")
+
+    # subclasses resolved earlier may have picked up an older sizer
+    for resolved in _RESOLVED:
+        del _SIZERS[resolved]
+        _FIXED_SIZES.pop(resolved, None)
+    _RESOLVED.clear()
+
+    _SIZERS[cls] = sizer
+    if hasattr(sizer, "fixed"):
+        _FIXED_SIZES[cls] = sizer.fixed
+    else:
+        _FIXED_SIZES.pop(cls, None)
+
+
+# types that got the sizer of a registered base class
+_RESOLVED = set()
+
+
+def _resolve_sizer(cls):
+    for base in cls.__mro__[1:]:
+        sizer = _SIZERS.get(base)
+        if sizer is not None:
+            _SIZERS[cls] = sizer
+            _RESOLVED.add(cls)
+            if hasattr(sizer, "fixed"):
+                _FIXED_SIZES[cls] = sizer.fixed
+            return sizer
+    raise TypeError("Unexpected type of message.")
+
+
 def msg_size(msg):
     """
     Calculates the byte size of a message
 
-    Msg_types can be char, int, float, string or tuple. If a custom type is
-    given it is calculated as a tuple.
+    Msg_types can be char, int, float, string, bytes, tuple, list, dict,
+    array.array or numpy array. Numbers inside arrays count as ints and
+    floats, so an array has the same size as the list of its numbers.
+    Other types must be registered with `register_sizer`.
+
+    The sizer is found with a single lookup on the type of the message;
+    subclasses of registered types are resolved once and then cached.
     """
-    if isinstance(msg, int):
-        return INT
-    elif isinstance(msg, float):
-        return FLOAT
-    elif isinstance(msg, str):
-        return CHAR * len(msg)
-    elif isinstance(msg, tuple):
-        byte_size = 0
-        for x in msg:
-            byte_size += msg_size(x)
-        return byte_size
-    elif isinstance(msg, dict):
-        byte_size = 0
-        for x in msg.values():
-            byte_size += msg_size(x)
-        return byte_size
-    elif isinstance(msg, list):
-        byte_size = 0
-        for x in msg:
-            byte_size += msg_size(x)
-        return byte_size
-    else:
-        raise TypeError("Unexpected type of message.")
+    sizer = _SIZERS.get(type(msg))
+    if sizer is None:
+        sizer = _resolve_sizer(type(msg))
+    return sizer(msg)
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    A context manager that pauses the cyclic garbage collector.
+
+    Building a large network allocates many long lived objects, and every
+    few thousand allocations the collector would scan all of them again.
+    The objects are not garbage, so the collection is paused while they
+    are built.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Histogram:
+    """
+    A cheap histogram of non negative values.
+
+    Values are counted in power-of-two buckets, so adding a value costs a
+    single dictionary update no matter how many values have been seen.
+    Bucket 0 holds zeros and bucket i > 0 holds values in [2^(i-b-1), 2^(i-b))
+    where b is the number of buckets reserved for values below one.
+    """
+
+    # values down to 2^-BELOW_ONE get their own buckets
+    BELOW_ONE = 32
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        Adds a value in the histogram.
+
+        :param value: a non negative number
+        :return: None
+        """
+        if value > 0:
+            index = max(math.frexp(value)[1] + self.BELOW_ONE, 1)
+        else:
+            index = 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        """
+        :return: the mean of the added values (0 if empty)
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def upper_bound(self, index):
+        """
+        :param index: the index of a bucket
+        :return: the largest value that falls in this bucket
+        """
+        if index == 0:
+            return 0.0
+        return math.ldexp(1.0, index - self.BELOW_ONE)
+
+    def percentile(self, q):
+        """
+        Estimates a percentile from the bucket counts.
+
+        The estimate is the upper bound of the bucket that holds the q-th
+        percentile, clipped to the largest value seen.
+
+        :param q: the percentile in [0, 100]
+        :return: the estimated value (0 if empty)
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max)
+        return self.max
 
 
 ###############################################################################
@@ -57,16 +288,27 @@ def remote_class(ifc):
     """
 
     def decorator_remote(cls):
+        # the method sets that the class itself is known to implement
+        checked = set()
+
         @functools.wraps(cls)
         def wrapper_decorator(*args, **kwargs):
             instance = cls(*args, **kwargs)
             if ifc in instance.net.protocol.interfaces:
                 interface = instance.net.protocol.interfaces[ifc]
+                names = frozenset(interface.methods)
+                # only instance attributes can hide the methods of the class
+                if names in checked and \
+                        names.isdisjoint(getattr(instance, "__dict__", ())):
+                    return instance
                 for name in interface.methods.keys():
                     obj = getattr(instance, str(name), None)
                     if not callable(obj):
                         raise TypeError(f"The {str(name)!r} function must be "
                                         f"implemented")
+                if all(callable(getattr(cls, str(name), None))
+                       for name in names):
+                    checked.add(names)
             return instance
 
         return wrapper_decorator
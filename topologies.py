@@ -0,0 +1,259 @@
+"""
+Network topologies besides the star.
+
+A `TreeNetwork` is a hierarchy of hosts: the leaves (the sites) send to
+their parent, the aggregators send to their own parent, and the root is at
+the top. Every parent can broadcast to its children. A `GraphNetwork`
+links hosts along the edges of any directed or undirected graph.
+
+Hosts with more than one link have one proxy per link; `send` goes to the
+first link unless it is given the peer, e.g.
+
+    self.send("reset", msg, to=self.net.children(self))
+
+"""
+from components import *
+from tools import *
+
+
+###############################################################################
+#
+# Trees
+#
+###############################################################################
+def kary_parents(k, depth):
+    """
+    The parents of a complete k-ary tree, in breadth first order.
+
+    :param k: the number of children of every inner node
+    :param depth: the number of levels below the root
+    :return: a list with the parent of every node (None for the root)
+    """
+    return level_parents([k] * depth)
+
+
+def level_parents(fanouts):
+    """
+    The parents of a tree where all the nodes of a level have the same
+    number of children, in breadth first order.
+
+    :param fanouts: the number of children of the nodes of every level,
+        from the root down, e.g. [4, 100] for 4 aggregators with 100 sites
+        each
+    :return: a list with the parent of every node (None for the root)
+    """
+    parents = [None]
+    start, width = 0, 1
+    for fanout in fanouts:
+        for node in range(start, start + width):
+            parents.extend([node] * fanout)
+        start, width = start + width, width * fanout
+    return parents
+
+
+class TreeNetwork(Network):
+    """
+    A tree of hosts.
+
+    Every node is identified by its index (its nid) in the `parents` list
+    that describes the tree. The leaves are also the `sites` of the network,
+    numbered 0, 1, ... in nid order, so the stream drivers can feed them.
+    The root is the host "root" of the network.
+
+    Every node except the root is linked to its parent with the `up`
+    interface, and every inner node is linked to the host group of its
+    children with the `down` interface.
+    """
+
+    def __init__(self, parents, leaf_type=Sender, inner_type=Sender,
+                 root_type=Sender, dispatcher=None):
+        """
+        A simple constructor.
+
+        :param parents: the parent of every node (None for the root), e.g.
+            kary_parents(k, depth)
+        :param leaf_type: the type of the leaves
+        :param inner_type: the type of the aggregators
+        :param root_type: the type of the root
+        :param dispatcher: the dispatcher of the network
+        """
+        super().__init__(dispatcher)
+        self.parents = list(parents)
+        roots = [nid for nid, parent in enumerate(self.parents)
+                 if parent is None]
+        if len(roots) != 1:
+            raise TypeError("A tree must have exactly one root")
+        self.root_id = roots[0]
+
+        self.child_ids = [[] for _ in self.parents]
+        for nid, parent in enumerate(self.parents):
+            if parent is not None:
+                self.child_ids[parent].append(nid)
+
+        self.leaf_type = leaf_type
+        self.inner_type = inner_type
+        self.root_type = root_type
+        self.nodes = []
+        self.root = None
+        self.sites = {}
+        # the host group of the children of every inner node
+        self.child_groups = {}
+        self.down = None
+
+    @classmethod
+    def kary(cls, k, depth, **kwargs):
+        """
+        :return: a complete k-ary tree with depth levels below the root
+        """
+        return cls(kary_parents(k, depth), **kwargs)
+
+    def depth(self, nid):
+        """
+        :param nid: the id of a node
+        :return: the number of edges between the node and the root
+        """
+        depth = 0
+        while self.parents[nid] is not None:
+            nid = self.parents[nid]
+            depth += 1
+        return depth
+
+    def parent(self, node):
+        """
+        :param node: a host of the tree
+        :return: the parent host (None for the root)
+        """
+        parent = self.parents[node.nid]
+        return None if parent is None else self.nodes[parent]
+
+    def children(self, node):
+        """
+        :param node: a host of the tree
+        :return: the host group of its children (None for a leaf)
+        """
+        return self.child_groups.get(node.nid)
+
+    def add_nodes(self, up, down):
+        """
+        Adds all the nodes of the tree.
+
+        :param up: the interface that a node calls on its parent
+        :param down: the interface that a node calls on its children
+        :return: None
+        """
+        nodes = self.nodes
+        child_ids = self.child_ids
+        with gc_paused():
+            for nid, parent in enumerate(self.parents):
+                if parent is None:
+                    node = self.root_type(net=self, nid=nid, ifc=down)
+                    self.root = node
+                    self.add_host("root", node)
+                elif child_ids[nid]:
+                    node = self.inner_type(net=self, nid=nid, ifc=up)
+                else:
+                    node = self.leaf_type(net=self, nid=nid, ifc=up)
+                    self.sites[len(self.sites)] = node
+                nodes.append(node)
+
+            for nid, children in enumerate(child_ids):
+                if children:
+                    group = HostGroup()
+                    for child in children:
+                        group.join(nodes[child])
+                    self.add_group(group)
+                    self.child_groups[nid] = group
+        self.down = down
+
+    def setup_connections(self):
+        """
+        Links every node with its parent and every inner node with its
+        children.
+
+        :return: None
+        """
+        nodes = self.nodes
+        with gc_paused():
+            for nid, children in enumerate(self.child_ids):
+                if children:
+                    self.link_many([nodes[child] for child in children],
+                                   nodes[nid])
+            for nid, group in self.child_groups.items():
+                self.link(nodes[nid], group, self.down)
+
+
+###############################################################################
+#
+# Graphs
+#
+###############################################################################
+class GraphNetwork(Network):
+    """
+    Hosts linked along the edges of a graph.
+
+    Every edge (u, v) is a link from u to v with its own channels; with
+    `directed=False` there is also a link from v to u. Nodes are the hosts
+    in `nodes`, keyed by the ids that the edges use. Since a node has a
+    link per neighbour, it has to name the peer when it sends:
+
+        self.send("update", msg, to=self.net.nodes[v])
+
+    """
+
+    def __init__(self, edges, node_type=Sender, directed=True,
+                 dispatcher=None):
+        """
+        A simple constructor.
+
+        :param edges: an iterable of (u, v) node id pairs
+        :param node_type: the type of the nodes
+        :param directed: if false every edge is linked both ways
+        :param dispatcher: the dispatcher of the network
+        """
+        super().__init__(dispatcher)
+        self.edges = []
+        # the ids of the nodes each node is linked to
+        self.adjacency = {}
+        for u, v in edges:
+            self.adjacency.setdefault(v, [])
+            self.adjacency.setdefault(u, []).append(v)
+            self.edges.append((u, v))
+            if not directed:
+                self.adjacency[v].append(u)
+                self.edges.append((v, u))
+        self.node_ids = list(self.adjacency)
+        self.node_type = node_type
+        self.nodes = {}
+
+    def neighbours(self, nid):
+        """
+        :param nid: the id of a node
+        :return: the ids of the nodes that the node is linked to
+        """
+        return self.adjacency[nid]
+
+    def add_nodes(self, ifc):
+        """
+        Adds all the nodes of the graph.
+
+        :param ifc: the interface that a node calls on its neighbours
+        :return: None
+        """
+        node_type = self.node_type
+        nodes = self.nodes
+        with gc_paused():
+            for nid in self.node_ids:
+                nodes[nid] = node_type(net=self, nid=nid, ifc=ifc)
+
+    def setup_connections(self):
+        """
+        Links the nodes along every edge.
+
+        :return: None
+        """
+        incoming = {}
+        for u, v in self.edges:
+            incoming.setdefault(v, []).append(self.nodes[u])
+        with gc_paused():
+            for v, srcs in incoming.items():
+                self.link_many(srcs, self.nodes[v])
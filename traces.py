@@ -0,0 +1,515 @@
+"""
+Record and replay of the messages of a run.
+
+A `TraceDispatcher` wraps the dispatcher of a network and appends every
+delivered message to a trace file through a `TraceWriter`: the simulated
+time, the channel id, the source and destination nids, the endpoint, the
+size and the pickled payload. Messages are appended in the order their
+remote methods run:
+
+    with TraceWriter(path) as writer:
+        net.dispatcher = TraceDispatcher(net.dispatcher, writer)
+        ...
+
+A `Replayer` runs the recorded messages through the handlers of a freshly
+built network of the same shape, without the stream sources or whatever
+else drove the original run:
+
+    replayer = Replayer(build_network(), TraceReader(path))
+    replayer.run()
+
+The file is a magic string followed by blocks. A block is a header with
+the number of its records, the number of its first record and its length,
+followed by the (compressed) records. Records are buffered and written a
+block at a time, so recording costs one pickle per message. A truncated
+last block, e.g. of a run that crashed, is ignored by the reader.
+
+"""
+import collections
+import mmap
+import pickle
+import struct
+import zlib
+
+from components import *
+
+MAGIC = b"DDSTRAC1"
+
+# compressed, records, first record, length
+BLOCK = struct.Struct("<BIQQ")
+# time, cid, src, dst, size, batch, endpoint length, payload length
+RECORD = struct.Struct("<dqqqQBBI")
+
+# the nids of the hosts that do not have an integer nid
+NONE_NID = -1
+GROUP_NID = -2
+OTHER_NID = -3
+
+
+def encode_nid(host):
+    """
+    :param host: a host or a host group
+    :return: the nid of the host as it is written in a trace
+    """
+    nid = getattr(host, "nid", GROUP_NID)
+    if nid is None:
+        return NONE_NID
+    if type(nid) is not int:
+        return OTHER_NID
+    return nid
+
+
+def decode_nid(nid):
+    """
+    :param nid: a nid read from a trace
+    :return: the nid of the host (None for the coordinator of a star
+        network, "group" for a host group)
+    """
+    if nid == NONE_NID:
+        return None
+    if nid == GROUP_NID:
+        return "group"
+    return nid
+
+
+class Record(collections.namedtuple("Record", "time cid src dst endpoint "
+                                              "size batch data")):
+    """
+    A recorded message; `data` is the pickled payload.
+    """
+
+    __slots__ = ()
+
+    @property
+    def msg(self):
+        return pickle.loads(self.data)
+
+
+###############################################################################
+#
+# Writing
+#
+###############################################################################
+class TraceWriter:
+    """
+    Appends records to a trace file, a block at a time.
+    """
+
+    def __init__(self, path, block_records=4096, compress=True,
+                 append=False):
+        """
+        A basic constructor.
+
+        :param path: the path of the trace file
+        :param block_records: the number of records of a block
+        :param compress: if true blocks are compressed with zlib
+        :param append: if true the records are appended to an existing
+            trace, after its last complete block
+        """
+        self.path = path
+        self.block_records = block_records
+        self.compress = compress
+        # the number of records written or buffered so far
+        self.count = 0
+
+        if append:
+            reader = TraceReader(path)
+            self.count = len(reader)
+            end = reader.end
+            reader.close()
+            self.file = open(path, "r+b", buffering=1 << 20)
+            self.file.seek(end)
+            self.file.truncate()
+        else:
+            self.file = open(path, "wb", buffering=1 << 20)
+            self.file.write(MAGIC)
+
+        self.buffer = bytearray()
+        self.buffered = 0
+
+    def write(self, time, channel, size, batch, msg):
+        """
+        Appends a record.
+
+        :param time: the simulated time of the delivery
+        :param channel: the channel of the message
+        :param size: the size of the message
+        :param batch: True if msg is the list of a `<method>_batch` call
+        :param msg: the message
+        :return: None
+        """
+        endpoint = channel.endpoint.encode()
+        data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        self.buffer += RECORD.pack(time, channel.cid, encode_nid(channel.src),
+                                   encode_nid(channel.dst), size, batch,
+                                   len(endpoint), len(data))
+        self.buffer += endpoint
+        self.buffer += data
+        self.buffered += 1
+        self.count += 1
+        if self.buffered == self.block_records:
+            self.flush_block()
+
+    def flush_block(self):
+        """
+        Writes the buffered records as a block.
+
+        :return: None
+        """
+        if not self.buffered:
+            return
+        data = bytes(self.buffer)
+        if self.compress:
+            data = zlib.compress(data, 1)
+        self.file.write(BLOCK.pack(self.compress, self.buffered,
+                                   self.count - self.buffered, len(data)))
+        self.file.write(data)
+        self.buffer = bytearray()
+        self.buffered = 0
+
+    def flush(self):
+        """
+        Writes the buffered records and flushes the file.
+
+        :return: None
+        """
+        self.flush_block()
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TracedCall(WrappedCall):
+    """
+    A remote method that records its message when it runs.
+    """
+
+    __slots__ = ("channel", "size", "batch", "tracer")
+
+    def __init__(self, func, channel, size, batch, tracer):
+        super().__init__(func)
+        self.channel = channel
+        self.size = size
+        self.batch = batch
+        self.tracer = tracer
+
+    def before(self, msg):
+        tracer = self.tracer
+        tracer.writer.write(tracer.inner.now, self.channel, self.size,
+                            self.batch, msg)
+
+
+class TraceDispatcher(Dispatcher):
+    """
+    Wraps the dispatcher of a network to record every delivered message.
+
+    A broadcast is recorded once, on its multicast channel. Dropped
+    messages of a fault model are not recorded, since they are never
+    delivered. `Sender.call` and `Sender.gather` do not go through the
+    dispatcher, so their messages are not recorded.
+    """
+
+    def __init__(self, inner, writer):
+        """
+        A basic constructor.
+
+        :param inner: the dispatcher that delivers the messages
+        :param writer: the TraceWriter of the trace
+        """
+        self.inner = inner
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    @property
+    def now(self):
+        return self.inner.now
+
+    @now.setter
+    def now(self, value):
+        self.inner.now = value
+
+    def traced(self, channel, func, msg, size):
+        if size is None:
+            size = msg_size(msg)
+        return TracedCall(func, channel, size, is_batch(channel, func),
+                          self)
+
+    def deliver(self, channel, func, msg, size=None):
+        return self.inner.deliver(channel,
+                                  self.traced(channel, func, msg, size),
+                                  msg, size)
+
+    def broadcast(self, channel, group_call, msg, size=None):
+        return self.inner.broadcast(channel,
+                                    self.traced(channel, group_call, msg,
+                                                size),
+                                    msg, size)
+
+    def deliver_many(self, channel, func, msgs):
+        for msg in msgs:
+            self.deliver(channel, func, msg)
+
+    def pending(self):
+        return self.inner.pending()
+
+    def pending_events(self):
+        return [(time, channel, getattr(func, "func", func), msg)
+                for time, channel, func, msg in self.inner.pending_events()]
+
+    def load_events(self, events):
+        self.inner.load_events([(time, channel,
+                                 self.traced(channel, func, msg, None), msg)
+                                for time, channel, func, msg in events])
+
+    def run(self, max_events=None):
+        return self.inner.run(max_events)
+
+    def run_until(self, stop):
+        return self.inner.run_until(stop)
+
+
+###############################################################################
+#
+# Reading
+#
+###############################################################################
+class TraceReader:
+    """
+    Reads a trace file through mmap.
+
+    The headers of the blocks are read when the reader is opened, so that
+    `records` can start at any record by decompressing only the blocks
+    from that record on.
+    """
+
+    def __init__(self, path):
+        """
+        A basic constructor.
+
+        :param path: the path of the trace file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise TypeError(f"{path!r} is not a trace file")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # (first record, records, offset of the data, length, compressed)
+        self.blocks = []
+        offset = len(MAGIC)
+        size = len(self.map)
+        while offset + BLOCK.size <= size:
+            compressed, count, first, length = \
+                BLOCK.unpack_from(self.map, offset)
+            start = offset + BLOCK.size
+            if start + length > size:
+                break
+            self.blocks.append((first, count, start, length, compressed))
+            offset = start + length
+        # the end of the last complete block
+        self.end = offset
+
+    def __len__(self):
+        if not self.blocks:
+            return 0
+        first, count = self.blocks[-1][:2]
+        return first + count
+
+    def block_of(self, index):
+        """
+        :param index: the number of a record
+        :return: the index of the block of the record
+        """
+        low, high = 0, len(self.blocks)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.blocks[middle][0] <= index:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def read_block(self, block):
+        """
+        :param block: the index of a block
+        :return: the records of the block
+        """
+        _, count, start, length, compressed = self.blocks[block]
+        raw = memoryview(self.map)[start:start + length]
+        data = memoryview(zlib.decompress(raw)) if compressed else raw
+
+        records = []
+        offset = 0
+        unpack = RECORD.unpack_from
+        for _ in range(count):
+            time, cid, src, dst, size, batch, name_len, data_len = \
+                unpack(data, offset)
+            offset += RECORD.size
+            endpoint = bytes(data[offset:offset + name_len]).decode()
+            offset += name_len
+            payload = bytes(data[offset:offset + data_len])
+            offset += data_len
+            records.append(Record(time, cid, decode_nid(src),
+                                  decode_nid(dst), endpoint, size,
+                                  bool(batch), payload))
+        data.release()
+        raw.release()
+        return records
+
+    def records(self, start=0, stop=None):
+        """
+        :param start: the number of the first record
+        :param stop: the number after the last record (None for all)
+        :return: an iterator of the records
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        for block in range(self.block_of(start), len(self.blocks)):
+            first = self.blocks[block][0]
+            if first >= stop:
+                return
+            for index, record in enumerate(self.read_block(block), first):
+                if index >= stop:
+                    return
+                if index >= start:
+                    yield record
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+###############################################################################
+#
+# Replay
+#
+###############################################################################
+class ReplayDispatcher(Dispatcher):
+    """
+    The dispatcher of a replayed network.
+
+    The messages sent by the replayed handlers are accounted as usual but
+    not delivered, since their deliveries are in the trace. They are kept
+    to be matched with the records of the trace.
+    """
+
+    def __init__(self):
+        # (cid, batch, pickled msg) of the sent messages not yet replayed
+        self.sent = collections.Counter()
+
+    def deliver(self, channel, func, msg, size=None):
+        self.sent[(channel.cid, is_batch(channel, func),
+                   pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))] += 1
+
+    def pending(self):
+        return sum(self.sent.values())
+
+
+class Replayer:
+    """
+    Replays a trace into a network built like the recorded one.
+
+    Every record is delivered to its remote method in the recorded order.
+    A record that a replayed handler has sent is only delivered; a record
+    that no handler sent, e.g. a message sent by the code that fed the
+    stream to the sites, is also accounted on its channel with its
+    recorded size. So the counters of the replayed network match the
+    recorded run, and the sends that never match a record (`unmatched`)
+    show where a protocol diverges from its trace.
+    """
+
+    def __init__(self, net, reader):
+        """
+        A basic constructor.
+
+        :param net: a freshly built network with the channels of the
+            recorded one
+        :param reader: the TraceReader of the trace
+        """
+        self.net = net
+        self.reader = reader
+        self.dispatcher = ReplayDispatcher()
+        net.dispatcher = self.dispatcher
+        self.channels = {channel.cid: channel for channel in net.channels}
+        self.funcs = {}
+        # the records that no replayed handler had sent
+        self.external = 0
+        self.replayed = 0
+
+    def func(self, channel, batch):
+        """
+        :return: the remote method the messages of a channel are delivered
+            to
+        """
+        key = (channel.cid, batch)
+        func = self.funcs.get(key)
+        if func is None:
+            proxy = channel.src.proxy_to(channel.dst)
+            endpoint = proxy.endpoints[channel.endpoint]
+            func = self.funcs[key] = endpoint.send_batch if batch \
+                else endpoint.send
+        return func
+
+    def run(self, start=0, stop=None):
+        """
+        Replays records of the trace.
+
+        Records are replayed into the current state of the hosts; when
+        starting after the first record, the hosts should be in the state
+        they had at that record, e.g. restored from a checkpoint.
+
+        :param start: the number of the first record
+        :param stop: the number after the last record (None for all)
+        :return: the number of replayed records
+        """
+        sent = self.dispatcher.sent
+        replayed = 0
+        for record in self.reader.records(start, stop):
+            channel = self.channels.get(record.cid)
+            if channel is None or channel.endpoint != record.endpoint:
+                raise TypeError(f"The network has no channel {record.cid} "
+                                f"of {record.endpoint!r}")
+            msg = record.msg
+            key = (record.cid, record.batch, record.data)
+            if sent[key]:
+                sent[key] -= 1
+                if not sent[key]:
+                    del sent[key]
+            else:
+                if record.batch:
+                    channel.transmit_many(msg, record.size)
+                else:
+                    channel.transmit(msg, record.size)
+                self.external += 1
+            self.dispatcher.now = record.time
+            self.func(channel, record.batch)(msg)
+            replayed += 1
+        self.replayed += replayed
+        return replayed
+
+    def unmatched(self):
+        """
+        :return: the number of messages the replayed handlers sent that no
+            replayed record matched
+        """
+        return self.dispatcher.pending()